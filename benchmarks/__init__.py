@@ -0,0 +1 @@
+"""Benchmarks of the ComfyUI clients against an in-process fake server"""
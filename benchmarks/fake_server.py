@@ -0,0 +1,246 @@
+"""In-process fake ComfyUI server for benchmarks and tests"""
+
+import asyncio
+import io
+import json
+import os
+import threading
+import uuid
+
+from aiohttp import web
+from PIL import Image
+
+# Node types whose images are reported as outputs
+OUTPUT_NODES = {"SaveImage", "PreviewImage"}
+
+
+def make_image(width, height, format="PNG"):
+    """Encoded noise image, so files are as large as real generations"""
+    image = Image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    image.save(buffer, format=format)
+    return buffer.getvalue()
+
+
+class FakeComfyUI:
+    """
+    Serves ``/prompt``, ``/history``, ``/view``, ``/upload/image``, ``/queue``
+    and ``/ws`` like ComfyUI, without running anything.
+
+    Each prompt "executes" for ``delay`` seconds, sending ``steps`` progress
+    messages for its KSampler nodes, and every SaveImage / PreviewImage node
+    outputs ``batch`` images of ``image_size`` (width, height) pixels. Up to
+    ``workers`` prompts execute at once; the rest wait in the queue. With
+    ``assign_ids``, the ``prompt_id`` clients send is ignored and the server
+    picks its own, as older ComfyUI versions do.
+
+    The server runs on its own thread and event loop::
+
+        with FakeComfyUI(delay=0.1) as server:
+            client = ComfyUIClient(server.address, "workflow_api.json")
+    """
+
+    def __init__(
+        self,
+        delay=0.05,
+        image_size=(512, 512),
+        batch=1,
+        steps=4,
+        workers=1,
+        assign_ids=False,
+        host="127.0.0.1",
+        port=0,
+    ):
+        self.delay = delay
+        self.batch = batch
+        self.steps = steps
+        self.workers = workers
+        self.assign_ids = assign_ids
+        self.host = host
+        self.port = port
+        self.image = make_image(*image_size)
+        # Requests served, by route
+        self.requests = {}
+        self.history = {}
+        self.pending = []
+        self.uploads = []
+        self._sockets = {}
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    def start(self):
+        """Start serving in a background thread and return ``address``"""
+        ready = threading.Event()
+        errors = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                self._loop.run_until_complete(self._serve())
+            except Exception as e:
+                errors.append(e)
+                ready.set()
+                return
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-comfyui", daemon=True)
+        self._thread.start()
+        ready.wait()
+        if errors:
+            raise errors[0]
+        return self.address
+
+    def stop(self):
+        if self._loop is None:
+            return
+        future = asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop)
+        future.result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    async def _serve(self):
+        app = web.Application(middlewares=[self._count])
+        app.router.add_get("/ws", self._websocket)
+        app.router.add_post("/prompt", self._prompt)
+        app.router.add_get("/history/{prompt_id}", self._history)
+        app.router.add_get("/view", self._view)
+        app.router.add_get("/queue", self._queue)
+        app.router.add_post("/upload/image", self._upload)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._jobs = asyncio.Queue()
+        for _ in range(self.workers):
+            asyncio.ensure_future(self._work())
+
+    @web.middleware
+    async def _count(self, request, handler):
+        route = request.match_info.route.resource
+        name = route.canonical if route is not None else request.path
+        self.requests[name] = self.requests.get(name, 0) + 1
+        return await handler(request)
+
+    async def _send(self, client_id, msg_type, data):
+        ws = self._sockets.get(client_id)
+        if ws is None or ws.closed:
+            return
+        try:
+            await ws.send_str(json.dumps({"type": msg_type, "data": data}))
+        except ConnectionError:
+            pass
+
+    async def _websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        client_id = request.query.get("clientId")
+        self._sockets[client_id] = ws
+        status = {"status": {"exec_info": {"queue_remaining": len(self.pending)}}}
+        await self._send(client_id, "status", status)
+        async for _ in ws:
+            pass
+        if self._sockets.get(client_id) is ws:
+            del self._sockets[client_id]
+        return ws
+
+    async def _prompt(self, request):
+        body = await request.json()
+        prompt = body.get("prompt")
+        if not isinstance(prompt, dict):
+            return web.json_response({"error": "no prompt"}, status=400)
+        prompt_id = body.get("prompt_id")
+        if self.assign_ids or not prompt_id:
+            prompt_id = str(uuid.uuid4())
+        self.pending.append(prompt_id)
+        await self._jobs.put((prompt_id, prompt, body.get("client_id")))
+        number = len(self.history) + len(self.pending)
+        return web.json_response(
+            {"prompt_id": prompt_id, "number": number, "node_errors": {}}
+        )
+
+    async def _work(self):
+        while True:
+            prompt_id, prompt, client_id = await self._jobs.get()
+            try:
+                await self._execute(prompt_id, prompt, client_id)
+            finally:
+                self.pending.remove(prompt_id)
+
+    async def _execute(self, prompt_id, prompt, client_id):
+        await self._send(client_id, "execution_start", {"prompt_id": prompt_id})
+        samplers = [n for n in prompt.values() if n.get("class_type") == "KSampler"]
+        step_delay = self.delay / max(len(samplers) * self.steps, 1)
+        outputs = {}
+        for node_id, node in prompt.items():
+            data = {"node": node_id, "prompt_id": prompt_id}
+            await self._send(client_id, "executing", data)
+            if node.get("class_type") == "KSampler":
+                for step in range(1, self.steps + 1):
+                    await asyncio.sleep(step_delay)
+                    progress = dict(data, value=step, max=self.steps)
+                    await self._send(client_id, "progress", progress)
+            if node.get("class_type") in OUTPUT_NODES:
+                images = [
+                    {
+                        "filename": f"{prompt_id}_{i:05}.png",
+                        "subfolder": "",
+                        "type": "output",
+                    }
+                    for i in range(self.batch)
+                ]
+                outputs[node_id] = {"images": images}
+                executed = dict(data, output={"images": images})
+                await self._send(client_id, "executed", executed)
+        if not samplers:
+            await asyncio.sleep(self.delay)
+        self.history[prompt_id] = {
+            "prompt": [len(self.history), prompt_id, prompt, {}, list(outputs)],
+            "outputs": outputs,
+            "status": {"status_str": "success", "completed": True, "messages": []},
+        }
+        await self._send(client_id, "execution_success", {"prompt_id": prompt_id})
+        await self._send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+
+    async def _history(self, request):
+        prompt_id = request.match_info["prompt_id"]
+        if prompt_id not in self.history:
+            return web.json_response({})
+        return web.json_response({prompt_id: self.history[prompt_id]})
+
+    async def _view(self, request):
+        return web.Response(body=self.image, content_type="image/png")
+
+    async def _queue(self, request):
+        entries = [[0, prompt_id, {}, {}, []] for prompt_id in self.pending]
+        running, pending = entries[: self.workers], entries[self.workers :]
+        return web.json_response({"queue_running": running, "queue_pending": pending})
+
+    async def _upload(self, request):
+        form = await request.post()
+        image = form["image"]
+        image.file.read()
+        self.uploads.append(image.filename)
+        return web.json_response(
+            {
+                "name": image.filename,
+                "subfolder": form.get("subfolder", ""),
+                "type": "input",
+            }
+        )
@@ -0,0 +1,290 @@
+"""
+Measure the clients and workflow conversion against ``FakeComfyUI``.
+
+Reports jobs/sec, p50/p99 latency, peak Python memory (tracemalloc) and the
+mean time of each ``generate()`` phase per scenario::
+
+    python -m benchmarks.run --jobs 200 --concurrency 8
+    python -m benchmarks.run --json baseline.json
+    python -m benchmarks.run --baseline baseline.json --tolerance 0.2
+
+With ``--baseline``, the exit status is 1 when a scenario's jobs/sec drops or
+its p99 latency grows by more than ``--tolerance`` (a fraction).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from comfyuiclient import ComfyUIClient, ComfyUIClientAsync, convert_workflow_to_api
+
+from .fake_server import FakeComfyUI
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+WORKFLOW = os.path.join(ROOT, "workflow.json")
+WORKFLOW_API = os.path.join(ROOT, "workflow_api.json")
+OUTPUT_NODES = ["Result Image"]
+
+SCENARIOS = ("sync", "async", "convert")
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of ``values``"""
+    ordered = sorted(values)
+    index = max(int(round(fraction * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(name, latencies, seconds, peak, results=()):
+    """Result dict of one scenario; latencies and durations in seconds"""
+    phases = {}
+    for result in results:
+        for phase, duration in result.durations().items():
+            phases[phase] = phases.get(phase, 0.0) + duration
+    return {
+        "scenario": name,
+        "jobs": len(latencies),
+        "seconds": seconds,
+        "jobs_per_sec": len(latencies) / seconds if seconds else 0.0,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_memory_mib": None if peak is None else peak / 2**20,
+        "phases_ms": {
+            phase: total / len(results) * 1000 for phase, total in phases.items()
+        },
+    }
+
+
+def measure(run, memory):
+    """Return ``(run(), seconds, peak traced bytes or None)``"""
+    if memory:
+        tracemalloc.start()
+    began = time.perf_counter()
+    try:
+        value = run()
+        seconds = time.perf_counter() - began
+        peak = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return value, seconds, peak
+
+
+def bench_sync(address, jobs, concurrency, memory):
+    client = ComfyUIClient(address, WORKFLOW_API, pool_size=concurrency * 4)
+    client.connect()
+
+    def job(seed):
+        began = time.perf_counter()
+        overrides = {"KSampler": {"seed": seed}}
+        result = client.generate(OUTPUT_NODES, overrides, output="bytes")
+        return time.perf_counter() - began, result
+
+    def run():
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            return list(executor.map(job, range(jobs)))
+
+    try:
+        job(-1)  # warm up connections
+        timed, seconds, peak = measure(run, memory)
+    finally:
+        client.close()
+    latencies, results = zip(*timed)
+    return summarize("sync", latencies, seconds, peak, results)
+
+
+def bench_async(address, jobs, concurrency, memory):
+    async def main():
+        client = ComfyUIClientAsync(address, WORKFLOW_API)
+        await client.connect()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def job(seed):
+            async with semaphore:
+                began = time.perf_counter()
+                overrides = {"KSampler": {"seed": seed}}
+                result = await client.generate(OUTPUT_NODES, overrides, "bytes")
+                return time.perf_counter() - began, result
+
+        try:
+            await job(-1)
+            if memory:
+                tracemalloc.start()
+            began = time.perf_counter()
+            timed = await asyncio.gather(*(job(seed) for seed in range(jobs)))
+            seconds = time.perf_counter() - began
+            peak = tracemalloc.get_traced_memory()[1] if memory else None
+        finally:
+            if memory:
+                tracemalloc.stop()
+            await client.close()
+        return timed, seconds, peak
+
+    timed, seconds, peak = asyncio.run(main())
+    latencies, results = zip(*timed)
+    return summarize("async", latencies, seconds, peak, results)
+
+
+def bench_convert(jobs, memory):
+    with open(WORKFLOW, encoding="utf-8") as f:
+        workflow = json.load(f)
+
+    def run():
+        latencies = []
+        for _ in range(jobs):
+            began = time.perf_counter()
+            convert_workflow_to_api(workflow)
+            latencies.append(time.perf_counter() - began)
+        return latencies
+
+    latencies, seconds, peak = measure(run, memory)
+    return summarize("convert", latencies, seconds, peak)
+
+
+def regressions(results, baseline, tolerance):
+    """Messages for scenarios that got slower than ``baseline`` allows"""
+    previous = {entry["scenario"]: entry for entry in baseline["results"]}
+    messages = []
+    for result in results:
+        before = previous.get(result["scenario"])
+        if before is None:
+            continue
+        name = result["scenario"]
+        if result["jobs_per_sec"] < before["jobs_per_sec"] * (1 - tolerance):
+            messages.append(
+                f"{name}: {result['jobs_per_sec']:.1f} jobs/s, "
+                f"baseline {before['jobs_per_sec']:.1f}"
+            )
+        if result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            messages.append(
+                f"{name}: p99 {result['p99_ms']:.2f} ms, "
+                f"baseline {before['p99_ms']:.2f}"
+            )
+    return messages
+
+
+def report(results, out=None):
+    out = out or sys.stdout
+    out.write(
+        f"{'scenario':<10}{'jobs':>7}{'jobs/s':>10}{'p50 ms':>10}"
+        f"{'p99 ms':>10}{'peak MiB':>10}\n"
+    )
+    for result in results:
+        peak = result["peak_memory_mib"]
+        out.write(
+            f"{result['scenario']:<10}{result['jobs']:>7}"
+            f"{result['jobs_per_sec']:>10.1f}{result['p50_ms']:>10.2f}"
+            f"{result['p99_ms']:>10.2f}"
+            f"{'-' if peak is None else format(peak, '.1f'):>10}\n"
+        )
+        if result["phases_ms"]:
+            phases = ", ".join(
+                f"{phase} {ms:.2f}" for phase, ms in result["phases_ms"].items()
+            )
+            out.write(f"  mean ms per job: {phases}\n")
+
+
+def image_size(value):
+    width, _, height = value.partition("x")
+    return int(width), int(height or width)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help="Comma-separated scenarios to run (default: %(default)s)",
+    )
+    parser.add_argument("--jobs", type=int, default=100, help="Generations per client")
+    parser.add_argument(
+        "--convert-jobs", type=int, default=1000, help="Workflow conversions"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="Generations in flight"
+    )
+    parser.add_argument(
+        "--delay", type=float, default=0.01, help="Seconds each prompt executes"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=4, help="Prompts the server runs at once"
+    )
+    parser.add_argument(
+        "--image-size",
+        type=image_size,
+        default=(512, 512),
+        help="WIDTHxHEIGHT of output images",
+    )
+    parser.add_argument("--batch", type=int, default=1, help="Images per prompt")
+    parser.add_argument(
+        "--no-memory",
+        dest="memory",
+        action="store_false",
+        help="Skip tracemalloc, which slows down the measured code",
+    )
+    parser.add_argument("--json", metavar="PATH", help="Write the results as JSON")
+    parser.add_argument("--baseline", metavar="PATH", help="JSON results to compare")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed slowdown against the baseline (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+    args.scenarios = [name.strip() for name in args.scenarios.split(",")]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    server = FakeComfyUI(
+        delay=args.delay,
+        image_size=args.image_size,
+        batch=args.batch,
+        workers=args.workers,
+    )
+    with server:
+        for name in args.scenarios:
+            if name == "sync":
+                result = bench_sync(
+                    server.address, args.jobs, args.concurrency, args.memory
+                )
+            elif name == "async":
+                result = bench_async(
+                    server.address, args.jobs, args.concurrency, args.memory
+                )
+            else:
+                result = bench_convert(args.convert_jobs, args.memory)
+            results.append(result)
+    report(results)
+
+    if args.json:
+        settings = {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("json", "baseline")
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        messages = regressions(results, baseline, args.tolerance)
+        for message in messages:
+            print(f"REGRESSION {message}")
+        if messages:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
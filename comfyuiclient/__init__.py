@@ -1,6 +1,63 @@
 """ComfyUI Client - A Python client for ComfyUI API"""
 
-from .client import ComfyUIClient, ComfyUIClientAsync, convert_workflow_to_api
+from .client import (
+    WEBSOCKET_OUTPUT_NODES,
+    WIDGET_MAPPINGS,
+    ComfyUIClient,
+    ComfyUIClientAsync,
+    GenerationResult,
+    LazyImage,
+    NodeSchema,
+    OpenTelemetryMetrics,
+    ParameterSlot,
+    ProgressEvent,
+    PromptValidationError,
+    ResultCache,
+    RetryPolicy,
+    SchemaCache,
+    Span,
+    UploadCache,
+    WorkflowCache,
+    WorkflowTemplate,
+    apply_overrides,
+    convert_workflow_to_api,
+    load_widget_mappings,
+    prompt_hash,
+    register_widget_mapping,
+    validate_prompt,
+    widget_mappings_from_object_info,
+)
+from .pool import ComfyUIPool, ComfyUIPoolAsync
+from .watcher import WorkflowWatcher
 
 __version__ = "0.1.0"
-__all__ = ["ComfyUIClient", "ComfyUIClientAsync", "convert_workflow_to_api"]
+__all__ = [
+    "ComfyUIClient",
+    "ComfyUIClientAsync",
+    "ComfyUIPool",
+    "ComfyUIPoolAsync",
+    "GenerationResult",
+    "LazyImage",
+    "NodeSchema",
+    "OpenTelemetryMetrics",
+    "ParameterSlot",
+    "ProgressEvent",
+    "PromptValidationError",
+    "ResultCache",
+    "RetryPolicy",
+    "SchemaCache",
+    "Span",
+    "UploadCache",
+    "WEBSOCKET_OUTPUT_NODES",
+    "WIDGET_MAPPINGS",
+    "WorkflowCache",
+    "WorkflowTemplate",
+    "WorkflowWatcher",
+    "apply_overrides",
+    "convert_workflow_to_api",
+    "load_widget_mappings",
+    "prompt_hash",
+    "register_widget_mapping",
+    "validate_prompt",
+    "widget_mappings_from_object_info",
+]
@@ -1,21 +1,162 @@
+import asyncio
+import contextlib
+import contextvars
+import hashlib
 import io
 import json
+import os
 import random
+import struct
 import sys
+import threading
 import time
 import uuid
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Optional
 
 import aiohttp
 import requests
 from PIL import Image
 
+try:
+    import websocket  # websocket-client, optional
+except ImportError:  # pragma: no cover
+    websocket = None  # type: ignore[assignment]
+
+
+# Input names of each node type's widgets, in ``widgets_values`` order.
+# None marks a UI-only widget, such as the "control after generate" choice
+# after a seed or the upload button of LoadImage, whose value is skipped.
+# Use register_widget_mapping() or load_widget_mappings() to add node types.
+WIDGET_MAPPINGS = {
+    "KSampler": [
+        "seed",
+        None,
+        "steps",
+        "cfg",
+        "sampler_name",
+        "scheduler",
+        "denoise",
+    ],
+    "CLIPTextEncode": ["text"],
+    "EmptyLatentImage": ["width", "height", "batch_size"],
+    "CheckpointLoaderSimple": ["ckpt_name"],
+    "SaveImage": ["filename_prefix"],
+    "PreviewImage": [],
+    "VAEDecode": [],
+    "VAEEncode": [],
+    "VAELoader": ["vae_name"],
+    "LoraLoader": ["lora_name", "strength_model", "strength_clip"],
+    "ControlNetLoader": ["control_net_name"],
+    "LoadImage": ["image", None],
+    "ImageScale": ["upscale_method", "width", "height", "crop"],
+}
+
+# Bumped by every registry change so cached conversions can be invalidated
+_widget_mappings_version = 0
+_widget_mappings_fingerprint = (None, None)
+
+# /object_info input types the frontend shows as widgets; any other type
+# is a node connection
+_WIDGET_TYPES = {"INT", "FLOAT", "STRING", "BOOLEAN", "COMBO"}
+
+
+def register_widget_mapping(class_type, widgets):
+    """
+    Set the widget input names of ``class_type`` for convert_workflow_to_api().
+
+    ``widgets`` lists the input names in ``widgets_values`` order, with None
+    for UI-only widgets whose value is not sent to the server.
+    """
+    global _widget_mappings_version
+    WIDGET_MAPPINGS[class_type] = list(widgets)
+    _widget_mappings_version += 1
+
+
+def widget_mappings_from_object_info(object_info):
+    """
+    Derive widget mappings for every node type in a server's ``/object_info``.
+
+    Connection inputs and inputs with ``forceInput`` are skipped; seed
+    control and image upload widgets are mapped to None.
+    """
+    mappings = {}
+    for class_type, info in object_info.items():
+        inputs = info.get("input") or {}
+        order = info.get("input_order") or {}
+        widgets = []
+        for section in ("required", "optional"):
+            specs = inputs.get(section) or {}
+            for name in order.get(section, specs):
+                spec = specs.get(name)
+                if not spec:
+                    continue
+                input_type = spec[0]
+                options = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+                if options.get("forceInput"):
+                    continue
+                if not isinstance(input_type, list) and input_type not in _WIDGET_TYPES:
+                    continue
+                widgets.append(name)
+                if options.get("control_after_generate") or (
+                    input_type == "INT" and name in ("seed", "noise_seed")
+                ):
+                    widgets.append(None)
+                if options.get("image_upload"):
+                    widgets.append(None)
+        mappings[class_type] = widgets
+    return mappings
+
+
+def load_widget_mappings(source):
+    """
+    Register widget mappings from a dict or a JSON file and return them.
 
-def convert_workflow_to_api(workflow_json):
+    ``source`` is either ``{class_type: [input names]}``, as written by
+    ``fetch_widget_mappings(cache_path)``, or a server's ``/object_info``.
+    """
+    global _widget_mappings_version
+    if isinstance(source, str):
+        with open(source, "r", encoding="utf8") as f:
+            source = json.load(f)
+    if any(isinstance(value, dict) for value in source.values()):
+        mappings = widget_mappings_from_object_info(source)
+    else:
+        mappings = {key: list(value) for key, value in source.items()}
+    WIDGET_MAPPINGS.update(mappings)
+    _widget_mappings_version += 1
+    return mappings
+
+
+def _save_widget_mappings(path, mappings):
+    partial = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(partial, "w", encoding="utf8") as f:
+        json.dump(mappings, f)
+    os.replace(partial, path)
+
+
+def _widget_mappings_digest():
+    """Hash of the registry, recomputed only after it changed"""
+    global _widget_mappings_fingerprint
+    version, digest = _widget_mappings_fingerprint
+    if version != _widget_mappings_version:
+        version = _widget_mappings_version
+        data = json.dumps(WIDGET_MAPPINGS, sort_keys=True).encode("utf8")
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        _widget_mappings_fingerprint = (version, digest)
+    return digest
+
+
+def convert_workflow_to_api(workflow_json, widget_mappings=None):
     """
     Convert ComfyUI workflow format to API format.
 
     Args:
         workflow_json: Dict or path to workflow.json file
+        widget_mappings: Widget input names by node type, defaults to the
+            ``WIDGET_MAPPINGS`` registry. Widget values of node types
+            without a mapping are dropped.
 
     Returns:
         API format dict ready for ComfyUI API
@@ -24,6 +165,8 @@ def convert_workflow_to_api(workflow_json):
     if isinstance(workflow_json, str):
         with open(workflow_json, "r", encoding="utf8") as f:
             workflow_json = json.load(f)
+    if widget_mappings is None:
+        widget_mappings = WIDGET_MAPPINGS
 
     api_json = {}
 
@@ -36,31 +179,6 @@ def convert_workflow_to_api(workflow_json):
         source_slot = link[2]
         link_map[link_id] = [str(source_node), source_slot]
 
-    # Widget value mappings for different node types
-    widget_mappings = {
-        "KSampler": [
-            "seed",
-            "seed_control",
-            "steps",
-            "cfg",
-            "sampler_name",
-            "scheduler",
-            "denoise",
-        ],
-        "CLIPTextEncode": ["text"],
-        "EmptyLatentImage": ["width", "height", "batch_size"],
-        "CheckpointLoaderSimple": ["ckpt_name"],
-        "SaveImage": ["filename_prefix"],
-        "PreviewImage": [],
-        "VAEDecode": [],
-        "VAEEncode": [],
-        "VAELoader": ["vae_name"],
-        "LoraLoader": ["lora_name", "strength_model", "strength_clip"],
-        "ControlNetLoader": ["control_net_name"],
-        "LoadImage": ["image", "upload"],
-        "ImageScale": ["upscale_method", "width", "height", "crop"],
-    }
-
     # Process each node
     for node in workflow_json.get("nodes", []):
         node_id = str(node["id"])
@@ -73,16 +191,15 @@ def convert_workflow_to_api(workflow_json):
 
         inputs = {}
 
-        # Map widget values to named inputs
+        # Map widget values to named inputs, skipping UI-only widgets
+        param_names = widget_mappings.get(node_type, ())
         widget_values = node.get("widgets_values", [])
-        if node_type in widget_mappings:
-            param_names = widget_mappings[node_type]
-            for i, param_name in enumerate(param_names):
-                if i < len(widget_values):
-                    # Skip "randomize" value for seed_control in KSampler
-                    if param_name == "seed_control" and widget_values[i] == "randomize":
-                        continue
-                    inputs[param_name] = widget_values[i]
+        if isinstance(widget_values, dict):
+            # Some custom nodes store their widget values by name
+            widget_values = [widget_values.get(name) for name in param_names]
+        for param_name, value in zip(param_names, widget_values):
+            if param_name is not None:
+                inputs[param_name] = value
 
         # Add connected inputs
         for input_def in node.get("inputs", []):
@@ -96,32 +213,1596 @@ def convert_workflow_to_api(workflow_json):
     return api_json
 
 
+ParameterSlot = namedtuple("ParameterSlot", ["node_id", "input_name"])
+
+
+def apply_overrides(prompt, overrides, resolve=None):
+    """
+    Build a per-call prompt with input overrides applied.
+
+    Only the nodes named in ``overrides`` (and their ``inputs`` dicts) are
+    copied; every other node is shared with ``prompt``, which is never
+    modified. This keeps one loaded workflow safe to use from many concurrent
+    generations without a full deepcopy per job.
+
+    Args:
+        prompt: API format prompt dict
+        overrides: Dict of ``{node: {input_name: value}}``. ``node`` may be a
+            node id or anything ``resolve`` understands (e.g. a title). A
+            ``ParameterSlot`` key maps straight to its input's value instead.
+        resolve: Optional callable mapping a node key to a node id
+
+    Returns:
+        API format dict with the overrides applied
+    """
+    if not overrides:
+        return prompt
+
+    result = dict(prompt)
+    for key, inputs in overrides.items():
+        if isinstance(key, ParameterSlot):
+            key, inputs = key.node_id, {key.input_name: inputs}
+        node_id = str(key) if str(key) in prompt else None
+        if node_id is None and resolve is not None:
+            node_id = resolve(key)
+        if node_id is None:
+            raise ValueError(f"Node not found for override: {key}")
+
+        node = result[node_id]
+        if node is prompt[node_id]:
+            node = dict(node)
+            node["inputs"] = dict(node.get("inputs", {}))
+            result[node_id] = node
+        node["inputs"].update(inputs)
+
+    return result
+
+
+class WorkflowTemplate:
+    """
+    An API format prompt with its node lookups precomputed.
+
+    Nodes are indexed by class_type and ``_meta.title`` once, so ``find()`` is
+    a dict lookup. A name shared by several nodes resolves to the first of
+    them in prompt order, as a linear scan would; such names are listed in
+    ``duplicates`` and ``find(name, strict=True)`` refuses them.
+
+    For per-job parameterization, resolve inputs to ``slot()``s up front and
+    pass ``{slot: value}`` dicts to ``render()`` or as ``overrides``.
+    """
+
+    def __init__(self, prompt, index=None, duplicates=None):
+        self.prompt = prompt
+        if index is None:
+            index, duplicates = self._build_index(prompt)
+        self.index = index
+        self.duplicates = duplicates
+
+    @staticmethod
+    def _build_index(prompt):
+        index = {}
+        matches = {}
+        for node_id, node in prompt.items():
+            names = {
+                node.get("class_type", "").strip(),
+                node.get("_meta", {}).get("title", "").strip(),
+            }
+            names.discard("")
+            for name in names:
+                index.setdefault(name, node_id)
+                matches.setdefault(name, []).append(node_id)
+        duplicates = {name: ids for name, ids in matches.items() if len(ids) > 1}
+        return index, duplicates
+
+    def with_prompt(self, prompt):
+        """Reuse this index for ``prompt``, a copy with only inputs changed"""
+        return WorkflowTemplate(prompt, self.index, self.duplicates)
+
+    def find(self, name, strict=False):
+        """Return the id of the node with class_type or title ``name``, or None"""
+        name = name.strip()
+        if strict and name in self.duplicates:
+            raise ValueError(
+                f"{name!r} matches several nodes: {', '.join(self.duplicates[name])}"
+            )
+        return self.index.get(name)
+
+    def slot(self, node, input_name):
+        """Resolve ``node`` (an id, title or class_type) and an input to a slot"""
+        node_id = str(node) if str(node) in self.prompt else self.find(node)
+        if node_id is None:
+            raise ValueError(f"Node not found: {node}")
+        return ParameterSlot(node_id, input_name)
+
+    def render(self, values):
+        """Return a copy of the prompt with ``{slot: value}`` applied"""
+        return apply_overrides(self.prompt, values)
+
+
+def _parse_workflow(data):
+    """Parse workflow file contents, converting workflow.json to API format"""
+    workflow = json.loads(data)
+    if "nodes" in workflow and "links" in workflow:
+        return convert_workflow_to_api(workflow)
+    return workflow
+
+
+def _file_stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _copy_prompt(prompt):
+    """Copy every node and its inputs, the parts a client may modify"""
+    return {
+        node_id: dict(node, inputs=dict(node.get("inputs", {})))
+        for node_id, node in prompt.items()
+    }
+
+
+class WorkflowCache:
+    """
+    Parsed and converted workflows, shared by every client in the process.
+
+    Files are re-read only when their mtime or size changes, and re-parsed
+    only when their content hash changes as well. With ``directory``, the API
+    format of each workflow is also stored there under its content hash, so
+    new processes skip ``convert_workflow_to_api()`` too. Registering widget
+    mappings invalidates every entry, as it changes the conversion.
+    """
+
+    def __init__(self, max_entries=64, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._entries = OrderedDict()  # path -> (stamp, digest, template)
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def load(self, path):
+        """
+        Return a ``WorkflowTemplate`` of the workflow at ``path``.
+
+        Each call gets its own copy of the nodes and their inputs, so callers
+        may modify them freely; the node index is shared.
+        """
+        path = os.path.abspath(path)
+        mappings = _widget_mappings_digest()
+        stamp = _file_stamp(path) + (mappings,)
+        with self._lock:
+            entry = self._entries.get(path)
+        if entry is None or entry[0] != stamp:
+            with open(path, "rb") as f:
+                data = f.read()
+            digest = hashlib.sha256(data + mappings.encode()).hexdigest()
+            if entry is not None and entry[1] == digest:
+                template = entry[2]
+            else:
+                template = WorkflowTemplate(self._load_api_prompt(data, digest))
+            entry = (stamp, digest, template)
+        with self._lock:
+            self._entries[path] = entry
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        template = entry[2]
+        return template.with_prompt(_copy_prompt(template.prompt))
+
+    def _load_api_prompt(self, data, digest):
+        if self.directory is None:
+            return _parse_workflow(data)
+        cached = os.path.join(self.directory, f"{digest}.json")
+        try:
+            with open(cached, "r", encoding="utf8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+        prompt = _parse_workflow(data)
+        try:
+            partial = f"{cached}.{uuid.uuid4().hex}.tmp"
+            with open(partial, "w", encoding="utf8") as f:
+                json.dump(prompt, f)
+            os.replace(partial, cached)
+        except OSError as e:
+            print(f"Could not write workflow cache {cached}: {e}")
+        return prompt
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_default_workflow_cache = WorkflowCache()
+
+
+def _resolve_workflow_cache(workflow_cache):
+    """Client ``workflow_cache`` option: None for the shared cache, False for none"""
+    if workflow_cache is None:
+        return _default_workflow_cache
+    if workflow_cache is False:
+        return None
+    return workflow_cache
+
+
+class SchemaCache:
+    """
+    Node schemas (``/object_info``) of ComfyUI servers, keyed by address.
+
+    A schema is fetched once and reused until it is older than ``max_age``
+    seconds (never, by default) or refreshed explicitly. Revalidation sends
+    the server's ETag in ``If-None-Match``, and a ``304 Not Modified`` keeps the
+    cached schema. With ``path``, schemas are also persisted to that JSON file
+    so new processes start without fetching them.
+    """
+
+    def __init__(self, path=None, max_age=None):
+        self.path = path
+        self.max_age = max_age
+        self._entries = {}
+        self._specs = {}  # server -> (version, {class_type: NodeSchema})
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf8") as f:
+                    self._entries.update(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable schema cache {path}: {e}")
+
+    def get(self, server):
+        """Return the ``{etag, version, fetched, object_info}`` entry of ``server``"""
+        with self._lock:
+            return self._entries.get(server)
+
+    def is_stale(self, entry):
+        if self.max_age is None:
+            return False
+        return time.time() - entry["fetched"] > self.max_age
+
+    def put(self, server, object_info, etag=None):
+        data = json.dumps(object_info, sort_keys=True).encode("utf8")
+        entry = {
+            "etag": etag,
+            # Changes whenever the schema does, even without an ETag
+            "version": etag or hashlib.sha256(data).hexdigest(),
+            "fetched": time.time(),
+            "object_info": object_info,
+        }
+        with self._lock:
+            self._entries[server] = entry
+            if self.path is not None:
+                self._save()
+        return entry
+
+    def touch(self, server):
+        """Mark the schema of ``server`` as just revalidated"""
+        with self._lock:
+            self._entries[server] = dict(self._entries[server], fetched=time.time())
+            if self.path is not None:
+                self._save()
+
+    def specs(self, server):
+        """Return ``{class_type: NodeSchema}`` of the cached schema"""
+        with self._lock:
+            entry = self._entries[server]
+            version, specs = self._specs.get(server, (None, None))
+            if version != entry["version"]:
+                specs = _node_schemas(entry["object_info"])
+                self._specs[server] = (entry["version"], specs)
+            return specs
+
+    def invalidate(self, server=None):
+        with self._lock:
+            if server is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(server, None)
+            if self.path is not None:
+                self._save()
+
+    def _save(self):
+        partial = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(partial, "w", encoding="utf8") as f:
+            json.dump(self._entries, f)
+        os.replace(partial, self.path)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_default_schema_cache = SchemaCache()
+
+
+def _resolve_schema_cache(schema_cache):
+    """Client ``schema_cache`` option: None for the shared cache, False for none"""
+    if schema_cache is None:
+        return _default_schema_cache
+    if schema_cache is False:
+        return None
+    return schema_cache
+
+
+# What validation needs of a node type: its input specs by name, the names
+# of its required inputs, the types of its outputs, and whether it is an
+# output node
+NodeSchema = namedtuple("NodeSchema", ["inputs", "required", "outputs", "output_node"])
+
+
+def _node_schemas(object_info):
+    schemas = {}
+    for class_type, info in object_info.items():
+        sections = info.get("input") or {}
+        inputs = {}
+        for section in ("required", "optional", "hidden"):
+            inputs.update(sections.get(section) or {})
+        schemas[class_type] = NodeSchema(
+            inputs,
+            frozenset(sections.get("required") or ()),
+            tuple(info.get("output") or ()),
+            bool(info.get("output_node")),
+        )
+    return schemas
+
+
+def _schema_specs(client, object_info):
+    """Node schemas of ``object_info``, shared through the client's cache"""
+    if client.schema_cache is not None:
+        return client.schema_cache.specs(client.SERVER_ADDRESS)
+    return _node_schemas(object_info)
+
+
+def _value_error(spec, value):
+    """Describe why the server would reject ``value`` for an input, if it would"""
+    if not isinstance(spec, list) or not spec:
+        # Hidden inputs have no spec
+        return None
+    input_type = spec[0]
+    options = spec[1] if len(spec) > 1 and isinstance(spec[1], dict) else {}
+    if input_type in ("INT", "FLOAT"):
+        try:
+            number = int(value) if input_type == "INT" else float(value)
+        except (TypeError, ValueError):
+            return f"expects {input_type}, got {value!r}"
+        if "min" in options and number < options["min"]:
+            return f"is {value!r}, below its minimum {options['min']}"
+        if "max" in options and number > options["max"]:
+            return f"is {value!r}, above its maximum {options['max']}"
+        return None
+    choices = input_type if isinstance(input_type, list) else None
+    if input_type == "COMBO":
+        choices = options.get("options")
+    # Upload inputs also accept files uploaded after the schema was fetched
+    if choices is None or options.get("image_upload") or value in choices:
+        return None
+    return f"is {value!r}, not one of {choices[:10]!r}"
+
+
+def _check_inputs(schema, class_type, inputs):
+    """Validate ``inputs`` of a ``class_type`` node against a server's schema"""
+    node = schema.get(class_type)
+    if node is None:
+        raise ValueError(f"Node type {class_type!r} is not installed on the server")
+    for name, value in inputs.items():
+        spec = node.inputs.get(name)
+        if spec is None:
+            raise ValueError(f"{class_type} has no input {name!r}")
+        # Links are checked by validate_prompt()
+        error = None if isinstance(value, list) else _value_error(spec, value)
+        if error is not None:
+            raise ValueError(f"{class_type}.{name} {error}")
+
+
+class PromptValidationError(ValueError):
+    """A prompt the server would reject; ``errors`` lists every problem found"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("Invalid prompt: " + "; ".join(errors))
+
+
+def _types_match(output_type, input_type):
+    """Whether an output of ``output_type`` may feed an ``input_type`` input"""
+    if not isinstance(output_type, str) or not isinstance(input_type, str):
+        # Choice lists and similar widget types are left to the server
+        return True
+    if "*" in (output_type, input_type) or output_type == input_type:
+        return True
+    return bool(set(output_type.split(",")) & set(input_type.split(",")))
+
+
+def _find_cycle(links):
+    """Return a node on a dependency cycle of ``{node_id: [source ids]}``"""
+    state = {}  # node_id -> 1 while on the DFS stack, 2 once finished
+    for root in links:
+        if root in state:
+            continue
+        state[root] = 1
+        stack = [(root, iter(links[root]))]
+        while stack:
+            node_id, sources = stack[-1]
+            for source in sources:
+                if state.get(source) == 1:
+                    return source
+                if source not in state:
+                    state[source] = 1
+                    stack.append((source, iter(links.get(source, ()))))
+                    break
+            else:
+                state[node_id] = 2
+                stack.pop()
+    return None
+
+
+def _link_error(prompt, schema, link, spec):
+    """Describe what is wrong with ``link`` for an input of ``spec``, if anything"""
+    if len(link) != 2 or not isinstance(link[1], int):
+        return "is a malformed link"
+    source = prompt.get(link[0]) if isinstance(link[0], str) else None
+    if not isinstance(source, dict):
+        return f"links to missing node {link[0]!r}"
+    source_schema = schema.get(source.get("class_type")) if schema else None
+    if source_schema is None or not isinstance(spec, list):
+        return None
+    if not 0 <= link[1] < len(source_schema.outputs):
+        return f"links to missing output {link[1]} of node {link[0]}"
+    output_type = source_schema.outputs[link[1]]
+    if not _types_match(output_type, spec[0]):
+        return f"expects {spec[0]}, node {link[0]} outputs {output_type}"
+    return None
+
+
+def _node_errors(prompt, schema, node_id, node, sources):
+    """Return the problems of one node, adding the nodes it links to to ``sources``"""
+    class_type = node.get("class_type") if isinstance(node, dict) else None
+    inputs = node.get("inputs") if isinstance(node, dict) else None
+    if class_type is None or not isinstance(inputs, dict):
+        return [f"node {node_id} needs a class_type and inputs"]
+    where = f"node {node_id} ({class_type})"
+    node_schema = schema.get(class_type) if schema is not None else None
+    if schema is not None and node_schema is None:
+        errors = [f"{where}: node type is not installed on the server"]
+    else:
+        missing = sorted(node_schema.required - inputs.keys()) if node_schema else []
+        errors = [f"{where}: required input {name!r} is missing" for name in missing]
+
+    for name, value in inputs.items():
+        spec = node_schema.inputs.get(name) if node_schema else None
+        if node_schema is not None and spec is None:
+            # The server ignores inputs its node type does not declare
+            continue
+        if value is None:
+            error = "is not connected"
+        elif isinstance(value, list):
+            error = _link_error(prompt, schema, value, spec)
+            if error is None and value[0] in prompt:
+                sources.append(value[0])
+        else:
+            error = _value_error(spec, value)
+        if error is not None:
+            errors.append(f"{where}: input {name!r} {error}")
+    return errors
+
+
+def validate_prompt(prompt, schema=None):
+    """
+    Check an API format prompt locally before it is queued.
+
+    Finds links that are malformed or point at missing nodes or outputs, and
+    dependency cycles. With ``schema``, the ``{class_type: NodeSchema}`` of
+    ``load_schema()``, it also finds unknown node types, missing required
+    inputs, mismatched link types, invalid widget values and
+    prompts without an output node. All problems are reported at once.
+
+    Raises:
+        PromptValidationError: If the server would reject the prompt
+    """
+    errors = []
+    links = {}
+    has_output = False
+    for node_id, node in prompt.items():
+        sources = links[node_id] = []
+        errors.extend(_node_errors(prompt, schema, node_id, node, sources))
+        if schema is not None and isinstance(node, dict):
+            node_schema = schema.get(node.get("class_type"))
+            has_output = has_output or bool(node_schema and node_schema.output_node)
+
+    cycle = _find_cycle(links)
+    if cycle is not None:
+        errors.append(f"node {cycle} is part of a dependency cycle")
+    if schema is not None and prompt and not has_output and not errors:
+        errors.append("prompt has no output node")
+    if errors:
+        raise PromptValidationError(errors)
+
+
+# One progress update of a running prompt, as passed to ``on_progress``
+# callbacks and yielded by ``ComfyUIClientAsync.stream()``. Its fields:
+# - type: the WebSocket message type, e.g. "execution_start", "execution_cached",
+#   "executing", "progress", "executed", "execution_success" or
+#   "execution_error"; "preview" for an image frame, with the encoded image
+#   as ``output``; stream() ends with a "result" event
+# - node: id of the node the message is about, if any
+# - value, max: step counts of a "progress" event
+# - nodes: ids of the nodes served from the server's cache, for
+#   "execution_cached"
+# - output: a node's outputs for "executed", the GenerationResult for "result"
+# - elapsed: seconds since the first message about the prompt
+# - node_elapsed: seconds since the current node started executing
+ProgressEvent = namedtuple(
+    "ProgressEvent",
+    [
+        "type",
+        "prompt_id",
+        "node",
+        "value",
+        "max",
+        "nodes",
+        "output",
+        "elapsed",
+        "node_elapsed",
+    ],
+)
+
+_PROGRESS_TYPES = {
+    "execution_start",
+    "execution_cached",
+    "executing",
+    "progress",
+    "executed",
+    "execution_success",
+    "execution_error",
+    "execution_interrupted",
+}
+
+
+class _ProgressTracker:
+    """Timing of one prompt's execution and the callbacks following it"""
+
+    def __init__(self):
+        self.listeners = []
+        self.started = None
+        self.node = None
+        self.node_started = None
+        # time.monotonic() when the prompt was queued by generate() and when
+        # the server reported it finished
+        self.queued = None
+        self.finished = None
+        # Nodes whose image frames are outputs, and those frames by node id
+        # as (extension, data)
+        self.output_nodes = frozenset()
+        self.frames = {}
+
+    def adopt(self, other):
+        """Take over what ``other`` received before this tracker took its id"""
+        self.listeners.extend(other.listeners)
+        self.started = other.started
+        self.node, self.node_started = other.node, other.node_started
+        self.finished = other.finished
+        for node, frames in other.frames.items():
+            self.frames.setdefault(node, []).extend(frames)
+
+    def add_frame(self, prompt_id, node, extension, data):
+        if node in self.output_nodes:
+            self.frames.setdefault(node, []).append((extension, data))
+        self.publish("preview", prompt_id, {"node": node, "output": data})
+
+    def publish(self, msg_type, prompt_id, payload):
+        now = time.monotonic()
+        if self.started is None:
+            self.started = now
+        node = payload.get("node", payload.get("node_id"))
+        if msg_type == "executing" and node != self.node:
+            self.node, self.node_started = node, now
+        if (msg_type == "executing" and node is None) or msg_type in (
+            "execution_error",
+            "execution_interrupted",
+        ):
+            self.finished = now
+        if not self.listeners:
+            return
+        event = ProgressEvent(
+            msg_type,
+            prompt_id,
+            node,
+            payload.get("value"),
+            payload.get("max"),
+            payload.get("nodes"),
+            payload.get("output"),
+            now - self.started,
+            None if self.node_started is None else now - self.node_started,
+        )
+        for listener in list(self.listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                print(f"Error in progress listener: {e}")
+
+
+def _route_message(data, get_waiter):
+    """Resolve the waiter of the prompt a WebSocket message belongs to."""
+    payload = data.get("data") or {}
+    prompt_id = payload.get("prompt_id")
+    if prompt_id is None:
+        return
+
+    msg_type = data.get("type")
+    if msg_type in _PROGRESS_TYPES:
+        get_waiter(prompt_id).publish(msg_type, prompt_id, payload)
+    if msg_type == "executing" and payload.get("node") is None:
+        get_waiter(prompt_id).set_result(None)
+    elif msg_type == "execution_error":
+        get_waiter(prompt_id).set_exception(
+            RuntimeError(
+                f"Prompt {prompt_id} failed on node {payload.get('node_id')}: "
+                f"{payload.get('exception_message', 'unknown error')}"
+            )
+        )
+    elif msg_type == "execution_interrupted":
+        get_waiter(prompt_id).set_exception(
+            RuntimeError(f"Prompt {prompt_id} was interrupted")
+        )
+
+
+# Node types that send their images as binary WebSocket frames; frames
+# received while they execute are collected as their outputs
+WEBSOCKET_OUTPUT_NODES = {"SaveImageWebsocket"}
+
+# Binary WebSocket frames start with a big-endian event type
+_PREVIEW_IMAGE = 1  # then a format (1 JPEG, 2 PNG) and the image
+_PREVIEW_IMAGE_WITH_METADATA = 4  # then a JSON metadata length, metadata, image
+_PREVIEW_FORMATS = {1: "jpeg", 2: "png"}
+
+
+def _parse_frame(data):
+    """Return ``(metadata, extension, image)`` of an image frame, or None"""
+    if len(data) < 8:
+        return None
+    event_type, value = struct.unpack_from(">II", data)
+    if event_type == _PREVIEW_IMAGE:
+        return {}, _PREVIEW_FORMATS.get(value, "bin"), data[8:]
+    if event_type == _PREVIEW_IMAGE_WITH_METADATA:
+        metadata = json.loads(data[8 : 8 + value])
+        extension = metadata.get("image_type", "image/bin").split("/")[-1]
+        return metadata, extension, data[8 + value :]
+    return None
+
+
+def _executing_node(data):
+    """``(prompt_id, node)`` of an ``executing`` message, or None"""
+    if data.get("type") != "executing":
+        return None
+    payload = data.get("data") or {}
+    return payload.get("prompt_id"), payload.get("node")
+
+
+def _websocket_output_nodes(prompt):
+    return frozenset(
+        node_id
+        for node_id, node in prompt.items()
+        if node.get("class_type") in WEBSOCKET_OUTPUT_NODES
+    )
+
+
+def _add_frames(images, frames, sink, prompt_id):
+    """Add image frames received over the WebSocket to download results"""
+    for node_id, node_frames in frames.items():
+        node_images = images.setdefault(node_id, [])
+        for index, (extension, data) in enumerate(node_frames):
+            if sink is None:
+                node_images.append(data)
+                continue
+            image = {
+                "filename": f"{prompt_id}_{node_id}_{index:05}.{extension}",
+                "subfolder": "",
+                "type": "websocket",
+            }
+            with _open_sink(sink, node_id, image) as write:
+                write(data)
+            node_images.append(_sink_result(sink, image))
+
+
+def _queue_remaining(data):
+    """Queue depth reported by a WebSocket ``status`` message, or None"""
+    if data.get("type") != "status":
+        return None
+    status = (data.get("data") or {}).get("status") or {}
+    return (status.get("exec_info") or {}).get("queue_remaining")
+
+
+def _queue_depth(queue):
+    """Number of running and pending prompts in a ``/queue`` response"""
+    return len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+
+
+def _output_files(outputs):
+    """List the ``(node_id, image)`` pairs of a history ``outputs`` dict."""
+    return [
+        (node_id, image)
+        for node_id, node_output in outputs.items()
+        for image in node_output.get("images", [])
+    ]
+
+
+def _group_outputs(outputs, files, image_data):
+    """Rebuild per-node image lists from downloads made in ``files`` order."""
+    output_images = {
+        node_id: []
+        for node_id, node_output in outputs.items()
+        if "images" in node_output
+    }
+    for (node_id, _), data in zip(files, image_data):
+        output_images[node_id].append(data)
+    output_text = {
+        node_id: node_output["text"]
+        for node_id, node_output in outputs.items()
+        if "text" in node_output
+    }
+    return output_images, output_text
+
+
+def _is_directory_sink(sink):
+    return isinstance(sink, (str, os.PathLike))
+
+
+def _sink_path(sink, image):
+    """
+    ``<sink>/<subfolder>/<filename>`` of a file, mirroring the server's
+    folders so that equal names in different subfolders stay apart.
+    """
+    subfolder = (image.get("subfolder") or "").replace("\\", "/").split("/")
+    parts = [part for part in subfolder if part not in ("", ".", "..")]
+    return os.path.join(sink, *parts, os.path.basename(image["filename"]))
+
+
+@contextlib.contextmanager
+def _open_sink(sink, node_id, image):
+    """
+    Yield a ``write(chunk)`` callable that sends one output file to ``sink``.
+
+    Directory sinks get ``<sink>/<subfolder>/<filename>``, written to a
+    ``.part`` file and renamed once complete. File objects receive every
+    chunk in turn and callables are called as ``sink(node_id, image, chunk)``.
+    """
+    if _is_directory_sink(sink):
+        path = _sink_path(sink, image)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = path + ".part"
+        try:
+            with open(partial, "wb") as f:
+                yield f.write
+            os.replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+    elif hasattr(sink, "write"):
+        yield sink.write
+    elif callable(sink):
+        yield lambda chunk: sink(node_id, image, chunk)
+    else:
+        raise TypeError(f"Unsupported sink type: {type(sink).__name__}")
+
+
+def _sink_result(sink, image):
+    """What ``download_outputs()`` reports for a file sent to ``sink``"""
+    if _is_directory_sink(sink):
+        return _sink_path(sink, image)
+    return image
+
+
+class LazyImage:
+    """
+    Image file returned by the server, decoded only when pixels are needed.
+
+    ``data`` holds the bytes exactly as served. Any other attribute
+    (``size``, ``mode``, ``getpixel()``, ...) opens the image with PIL on first
+    use and is delegated to it. ``save()`` writes the original bytes when the
+    target format matches, skipping a decode and re-encode.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self._image = None
+
+    @property
+    def image(self):
+        """The decoded ``PIL.Image.Image``"""
+        if self._image is None:
+            self._image = Image.open(io.BytesIO(self.data))
+        return self._image
+
+    def save(self, fp, format=None, **params):
+        target = format
+        if target is None and isinstance(fp, (str, os.PathLike)):
+            extension = os.path.splitext(os.fspath(fp))[1].lower()
+            target = Image.registered_extensions().get(extension)
+        if params or (target is not None and target.upper() != self.image.format):
+            self.image.save(fp, format, **params)
+            return
+
+        if isinstance(fp, (str, os.PathLike)):
+            with open(fp, "wb") as f:
+                f.write(self.data)
+        else:
+            fp.write(self.data)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.image, name)
+
+    def __repr__(self):
+        return f"<LazyImage {len(self.data)} bytes>"
+
+
+OUTPUT_MODES = ("pil", "bytes", "lazy")
+
+
+def _decode_image(image_data, output):
+    """Convert downloaded image bytes to the requested ``generate()`` output."""
+    if output == "pil":
+        return Image.open(io.BytesIO(image_data))
+    if output == "lazy":
+        return LazyImage(image_data)
+    return image_data
+
+
+class UploadCache:
+    """
+    Server paths of already uploaded images, keyed by content hash.
+
+    An in-memory LRU of up to ``max_entries`` uploads. With ``path``, entries
+    are also persisted to that file so new processes skip uploads too. One
+    cache may be shared by several clients and threads, and the file by
+    several processes; keys include the server address.
+
+    The file is a journal of JSON lines, each mapping keys to server paths.
+    Every upload appends one line; once the journal holds more than twice
+    ``max_entries`` lines it is rewritten with the current entries.
+    """
+
+    def __init__(self, max_entries=1024, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Lines in the journal file, as far as this instance knows
+        self._journal_lines = 0
+        if path is not None and os.path.exists(path):
+            try:
+                self._load()
+            except OSError as e:
+                print(f"Ignoring unreadable upload cache {path}: {e}")
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            image_path = self._entries.get(key)
+            if image_path is not None:
+                self._entries.move_to_end(key)
+            return image_path
+
+    def put(self, key, image_path):
+        with self._lock:
+            self._entries[key] = image_path
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            if self.path is None:
+                return
+            self._journal_lines += 1
+            compact = self._journal_lines > 2 * self.max_entries
+            if compact:
+                self._journal_lines = 1
+                snapshot = dict(self._entries)
+        if compact:
+            self._rewrite(snapshot)
+        else:
+            self._append({key: image_path})
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._journal_lines = 0
+        if self.path is not None:
+            self._rewrite({})
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf8") as f:
+            for line in f:
+                try:
+                    entries = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash; the rest is still usable
+                    continue
+                self._journal_lines += 1
+                for key, image_path in entries.items():
+                    self._entries[key] = image_path
+                    self._entries.move_to_end(key)
+
+    def _append(self, entries):
+        # A single short write in append mode, so lines written by several
+        # processes at once do not interleave
+        with open(self.path, "a", encoding="utf8") as f:
+            f.write(json.dumps(entries) + "\n")
+
+    def _rewrite(self, entries):
+        partial = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(partial, "w", encoding="utf8") as f:
+            if entries:
+                f.write(json.dumps(entries) + "\n")
+        os.replace(partial, self.path)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _resolve_upload_cache(upload_cache):
+    """Client ``upload_cache`` option: None for a private cache, False for none"""
+    if upload_cache is None:
+        return UploadCache()
+    if upload_cache is False:
+        return None
+    return upload_cache
+
+
+def prompt_hash(prompt):
+    """
+    Hash of what the server executes for an API format prompt.
+
+    Node titles (``_meta``) and key order do not affect the hash; node ids,
+    class types and inputs, seeds included, do.
+    """
+    canonical = {
+        node_id: {"class_type": node.get("class_type"), "inputs": node.get("inputs")}
+        for node_id, node in prompt.items()
+    }
+    data = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf8")).hexdigest()
+
+
+class ResultCache:
+    """
+    Outputs of finished prompts, keyed by ``prompt_hash()``.
+
+    An in-memory LRU holding up to ``max_bytes`` of image data. With
+    ``directory``, entries are also written there, one file each, and the
+    least recently used files are deleted beyond ``max_disk_bytes``; new
+    processes reuse them. One cache may be shared by several clients and
+    threads. Only use it for deterministic workflows: fixed seeds and no
+    nodes that read changing files.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20, directory=None, max_disk_bytes=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes or 8 * max_bytes
+        self._entries = OrderedDict()  # key -> (prompt_id, images, text, size)
+        self._size = 0
+        self._files = OrderedDict()  # key -> file size, least recent first
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+
+    def get(self, key):
+        """Return ``(prompt_id, images, text)`` stored under ``key``, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[:3]
+            if key not in self._files:
+                return None
+        try:
+            entry = self._read(key)
+        except (OSError, ValueError) as e:
+            print(f"Dropping unreadable result cache entry {key}: {e}")
+            self._discard(key)
+            return None
+        self._remember(key, *entry)
+        return entry
+
+    def put(self, key, prompt_id, images, text):
+        """Store the ``(images, text)`` outputs of a prompt under ``key``"""
+        self._remember(key, prompt_id, images, text)
+        if self.directory is None:
+            return
+        try:
+            size = self._write(key, prompt_id, images, text)
+        except OSError as e:
+            print(f"Could not write result cache entry {key}: {e}")
+            return
+        with self._lock:
+            self._disk_size += size - self._files.pop(key, 0)
+            self._files[key] = size
+            evicted = []
+            while self._disk_size > self.max_disk_bytes and len(self._files) > 1:
+                old, old_size = self._files.popitem(last=False)
+                self._disk_size -= old_size
+                evicted.append(old)
+        for old in evicted:
+            with contextlib.suppress(OSError):
+                os.remove(self._path(old))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            files, self._files = list(self._files), OrderedDict()
+            self._disk_size = 0
+        for key in files:
+            with contextlib.suppress(OSError):
+                os.remove(self._path(key))
+
+    def _remember(self, key, prompt_id, images, text):
+        size = sum(len(data) for datas in images.values() for data in datas)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[3]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (prompt_id, images, text, size)
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted[3]
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.result")
+
+    def _scan(self):
+        """Index the entries already on disk, least recently used first"""
+        found = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".result"):
+                stat = os.stat(os.path.join(self.directory, name))
+                found.append((stat.st_mtime, name[: -len(".result")], stat.st_size))
+        for _, key, size in sorted(found):
+            self._files[key] = size
+            self._disk_size += size
+
+    def _write(self, key, prompt_id, images, text):
+        # A JSON header line, then the image files back to back
+        header = {
+            "prompt_id": prompt_id,
+            "images": {
+                node_id: [len(d) for d in datas] for node_id, datas in images.items()
+            },
+            "text": text,
+        }
+        path = self._path(key)
+        partial = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(partial, "wb") as f:
+            f.write(json.dumps(header).encode("utf8") + b"\n")
+            for datas in images.values():
+                for data in datas:
+                    f.write(data)
+        os.replace(partial, path)
+        return os.path.getsize(path)
+
+    def _read(self, key):
+        path = self._path(key)
+        with open(path, "rb") as f:
+            header = json.loads(f.readline())
+            images = {
+                node_id: [f.read(length) for length in lengths]
+                for node_id, lengths in header["images"].items()
+            }
+        # Mark the file as recently used for the next process's LRU order
+        os.utime(path)
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+        return header["prompt_id"], images, header["text"]
+
+    def _discard(self, key):
+        with self._lock:
+            self._disk_size -= self._files.pop(key, 0)
+        with contextlib.suppress(OSError):
+            os.remove(self._path(key))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries.keys() | self._files.keys())
+
+
+class RetryPolicy:
+    """
+    Retry HTTP requests that failed for transient reasons.
+
+    Connection errors, timeouts and responses with a status in
+    ``retry_statuses`` are retried up to ``max_attempts`` attempts in total,
+    waiting ``backoff * 2 ** (attempt - 1)`` seconds (at most ``max_backoff``)
+    between attempts. ``jitter`` randomly shortens each wait by up to that
+    fraction so that clients failing together do not retry in lockstep.
+    """
+
+    def __init__(
+        self,
+        max_attempts=3,
+        backoff=0.5,
+        max_backoff=10.0,
+        jitter=0.5,
+        retry_statuses=(429, 500, 502, 503, 504),
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+
+    def is_retryable(self, error):
+        if isinstance(error, (requests.HTTPError, aiohttp.ClientResponseError)):
+            response = getattr(error, "response", None)
+            status = getattr(error, "status", None)
+            if status is None and response is not None:
+                status = response.status_code
+            return status in self.retry_statuses
+        return isinstance(
+            error,
+            (
+                requests.ConnectionError,
+                requests.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+                aiohttp.ClientConnectionError,
+                aiohttp.ClientPayloadError,
+                asyncio.TimeoutError,
+            ),
+        )
+
+    def delay(self, attempt):
+        """Seconds to wait after failed attempt number ``attempt``"""
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        return delay * (1 - self.jitter * random.random())
+
+    def call(self, request, retry_if=None):
+        """
+        Return ``request()``, calling it again after retryable errors.
+
+        ``retry_if``, if given, is checked before each retry; return False from
+        it when a retry would repeat side effects of the failed attempt.
+        """
+        attempt = 1
+        while True:
+            try:
+                return request()
+            except Exception as e:
+                if not self._should_retry(e, attempt, retry_if):
+                    raise
+            time.sleep(self.delay(attempt))
+            attempt += 1
+
+    async def call_async(self, request, retry_if=None):
+        """Like ``call()``, for a coroutine function ``request``"""
+        attempt = 1
+        while True:
+            try:
+                return await request()
+            except Exception as e:
+                if not self._should_retry(e, attempt, retry_if):
+                    raise
+            await asyncio.sleep(self.delay(attempt))
+            attempt += 1
+
+    def _should_retry(self, error, attempt, retry_if):
+        return (
+            attempt < self.max_attempts
+            and self.is_retryable(error)
+            and (retry_if is None or retry_if())
+        )
+
+
+def _resolve_retry_policy(retry):
+    """Client ``retry`` option: None for the default policy, False for none"""
+    if retry is None:
+        return RetryPolicy()
+    if retry is False:
+        return RetryPolicy(max_attempts=1)
+    return retry
+
+
+def _find_in_queue(queue, prompt_id):
+    """Whether ``prompt_id`` is running or pending in a ``/queue`` response"""
+    return any(
+        len(item) > 1 and item[1] == prompt_id
+        for item in queue.get("queue_running", []) + queue.get("queue_pending", [])
+    )
+
+
+def _image_digest(image):
+    """
+    Hash a PIL image's pixels, which is much cheaper than encoding it.
+
+    The palette and ``info`` (transparency, ICC profile, ...) are hashed too,
+    since the encoder writes them into the file.
+    """
+    digest = hashlib.sha256(f"{image.mode}:{image.size}:".encode())
+    digest.update(image.tobytes())
+    palette = image.getpalette()
+    if palette is not None:
+        digest.update(bytes(palette))
+    digest.update(repr(sorted(image.info.items())).encode())
+    return digest.hexdigest()
+
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG", ".png"),
+    (b"\xff\xd8", ".jpg"),
+    (b"GIF8", ".gif"),
+    (b"BM", ".bmp"),
+)
+
+
+def _sniff_extension(data):
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    for signature, extension in _IMAGE_SIGNATURES:
+        if data[: len(signature)] == signature:
+            return extension
+    return ".png"
+
+
+def _is_path(image):
+    return isinstance(image, (str, os.PathLike))
+
+
+def _buffer_bytes(image):
+    """Read an already encoded image given as bytes or a file object"""
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return image
+    if hasattr(image, "getvalue"):
+        return image.getvalue()
+    if hasattr(image, "read"):
+        return image.read()
+    raise TypeError(f"Unsupported image type: {type(image).__name__}")
+
+
+def _upload_source(image, format, params):
+    """
+    Return ``(digest, extension)`` identifying an upload, without encoding it.
+
+    PIL images are hashed by pixels and encoding options; files are hashed in
+    chunks; bytes are hashed as they are.
+    """
+    if isinstance(image, Image.Image):
+        key = f"{_image_digest(image)}:{format}:{sorted(params.items())}"
+        return hashlib.sha256(key.encode()).hexdigest(), "." + format.lower()
+    if _is_path(image):
+        digest = hashlib.sha256()
+        with open(image, "rb") as f:
+            for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        extension = os.path.splitext(os.fspath(image))[1].lower()
+        return digest.hexdigest(), extension or ".png"
+    return hashlib.sha256(image).hexdigest(), _sniff_extension(bytes(image[:12]))
+
+
+def _encode_image(image, format, params):
+    byte_data = io.BytesIO()
+    image.save(byte_data, format=format, **params)
+    return byte_data.getvalue()
+
+
+def _multipart_stream(boundary, fields, filename, path):
+    """Yield a multipart/form-data body that reads the file at ``path`` in chunks"""
+    for name, value in fields.items():
+        yield (
+            f"--{boundary}\r\n"
+            f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+            f"{value}\r\n"
+        ).encode()
+    yield (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            yield chunk
+    yield f"\r\n--{boundary}--\r\n".encode()
+
+
+# One timed phase of a request, as listed in ``GenerationResult.timings``
+# and passed to the clients' ``metrics`` hook. Its fields:
+# - name: "queue_prompt", "wait_for_start" (queued until the server started
+#   it), "execution", "get_history", "get_image" (one per file) or "decode"
+# - start: wall-clock start, in seconds since the epoch
+# - duration: seconds
+# - attributes: details such as the prompt_id or filename; "error" holds the
+#   exception type of a failed request
+Span = namedtuple("Span", ["name", "start", "duration", "attributes"])
+
+# The span list of the generate() call running in this context, if any
+# (a string annotation, as ContextVar is not subscriptable before Python 3.9)
+_current_timings: "contextvars.ContextVar[Optional[List[Span]]]" = (
+    contextvars.ContextVar("comfyuiclient_timings", default=None)
+)
+
+
+def _record_span(metrics, span):
+    """Add ``span`` to the running generation and pass it to ``metrics``"""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.append(span)
+    if metrics is not None:
+        try:
+            metrics(span)
+        except Exception as e:
+            print(f"Error in metrics hook: {e}")
+
+
+@contextlib.contextmanager
+def _timed(metrics, name, **attributes):
+    """Record the time spent in the ``with`` block as a ``name`` span"""
+    start = time.time()
+    began = time.monotonic()
+    try:
+        yield
+    except BaseException as e:
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        duration = time.monotonic() - began
+        _record_span(metrics, Span(name, start, duration, attributes))
+
+
+def _record_execution(metrics, prompt_id, waiter):
+    """Record when a finished prompt waited in the queue and executed"""
+    if waiter.started is None:
+        return
+    # Waiter times are monotonic; spans start at wall-clock times
+    offset = time.time() - time.monotonic()
+    if waiter.queued is not None:
+        waited = max(waiter.started - waiter.queued, 0.0)
+        span = Span(
+            "wait_for_start", waiter.queued + offset, waited, {"prompt_id": prompt_id}
+        )
+        _record_span(metrics, span)
+    if waiter.finished is not None:
+        span = Span(
+            "execution",
+            waiter.started + offset,
+            waiter.finished - waiter.started,
+            {"prompt_id": prompt_id},
+        )
+        _record_span(metrics, span)
+
+
+class OpenTelemetryMetrics:
+    """
+    ``metrics`` hook exporting spans through OpenTelemetry.
+
+    Every span adds its duration to a histogram (in seconds) with the phase
+    as its ``phase`` attribute. With a ``tracer``, spans are also exported as
+    trace spans carrying all their attributes. Needs the optional
+    ``opentelemetry-api`` package unless ``meter`` is given.
+    """
+
+    def __init__(self, meter=None, tracer=None, name="comfyui.client.duration"):
+        if meter is None:
+            try:
+                from opentelemetry import metrics
+            except ImportError:
+                raise ImportError(
+                    "OpenTelemetryMetrics requires opentelemetry-api: "
+                    "pip install opentelemetry-api"
+                ) from None
+            meter = metrics.get_meter("comfyuiclient")
+        self.histogram = meter.create_histogram(
+            name, unit="s", description="Duration of ComfyUI client phases"
+        )
+        self.tracer = tracer
+
+    def __call__(self, span):
+        attributes = {"phase": span.name}
+        if "error" in span.attributes:
+            attributes["error"] = span.attributes["error"]
+        self.histogram.record(span.duration, attributes)
+        if self.tracer is not None:
+            start = int(span.start * 1e9)
+            trace_span = self.tracer.start_span(
+                span.name, start_time=start, attributes=span.attributes
+            )
+            trace_span.end(end_time=start + int(span.duration * 1e9))
+
+
+class GenerationResult(dict):
+    """
+    Outputs of one ``generate()`` call, keyed by node name.
+
+    As a dict it maps each requested image node to its first image and each
+    text node to its text. ``images`` maps every image node to the full list
+    of images it produced, so batched generations (batch_size > 1) keep all of
+    them. ``timings`` lists the ``Span``s recorded while producing it.
+    """
+
+    def __init__(self, prompt_id=None):
+        super().__init__()
+        self.prompt_id = prompt_id
+        self.images = {}
+        self.text = {}
+        # True when served from a ResultCache without queueing the prompt
+        self.cached = False
+        self.timings = []
+
+    def durations(self):
+        """Total seconds spent in each phase, e.g. all ``get_image`` spans"""
+        totals = {}
+        for span in self.timings:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration
+        return totals
+
+    @classmethod
+    def build(
+        cls, prompt_id, node_ids, images, text, output="pil"
+    ) -> "GenerationResult":
+        """Collect the outputs of the nodes in ``node_ids`` ({id: name})"""
+        result = cls(prompt_id)
+        for node_id, node_images in images.items():
+            if node_id in node_ids:
+                name = node_ids[node_id]
+                decoded = [_decode_image(data, output) for data in node_images]
+                result.images[name] = decoded
+                if decoded:
+                    result[name] = decoded[0]
+        for node_id, node_text in text.items():
+            if node_id in node_ids:
+                result.text[node_ids[node_id]] = node_text
+                result[node_ids[node_id]] = node_text
+        return result
+
+
+class _PromptWaiter(_ProgressTracker):
+    """Completion state for one prompt, fed by the WebSocket reader task."""
+
+    def __init__(self):
+        super().__init__()
+        self.done = asyncio.get_event_loop().create_future()
+        self.claimed = False
+
+    def set_result(self, result):
+        if not self.done.done():
+            self.done.set_result(result)
+
+    def set_exception(self, exc):
+        if not self.done.done():
+            self.done.set_exception(exc)
+
+    def adopt(self, other):
+        super().adopt(other)
+        if other.done.done() and not other.done.cancelled():
+            if other.done.exception() is not None:
+                self.set_exception(other.done.exception())
+            else:
+                self.set_result(other.done.result())
+
+
+class _SyncPromptWaiter(_ProgressTracker):
+    """Completion state for one prompt, fed by the WebSocket reader thread."""
+
+    def __init__(self):
+        super().__init__()
+        self.event = threading.Event()
+        self.error = None
+        self.claimed = False
+
+    def set_result(self, result):
+        self.event.set()
+
+    def set_exception(self, exc):
+        if not self.event.is_set():
+            self.error = exc
+            self.event.set()
+
+    def adopt(self, other):
+        super().adopt(other)
+        if other.event.is_set() and other.error is not None:
+            self.set_exception(other.error)
+        elif other.event.is_set():
+            self.set_result(None)
+
+
 class ComfyUIClientAsync:
 
-    def __init__(self, server, prompt_file, debug=False):
+    # Prompts queued with our client_id but never awaited are kept around
+    # until this many have piled up, then the oldest finished ones are dropped.
+    MAX_UNCLAIMED_PROMPTS = 1024
+
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+    # While waiting, history is checked this often in case the completion
+    # message was missed or went to another client id
+    HISTORY_CHECK_INTERVAL = 5.0
+
+    def __init__(
+        self,
+        server,
+        prompt_file,
+        debug=False,
+        timeout=300.0,
+        download_concurrency=4,
+        upload_cache=None,
+        retry=None,
+        heartbeat=30.0,
+        reconnect_attempts=10,
+        workflow_cache=None,
+        schema_cache=None,
+        validate=True,
+        result_cache=None,
+        metrics=None,
+    ):
         self.PROMPT_FILE = prompt_file
         self.SERVER_ADDRESS = server
         self.CLIENT_ID = str(uuid.uuid4())
         self.ws = None
         self.session = None
         self.debug = debug
+        self.timeout = timeout
+        self.download_concurrency = download_concurrency
+        self.upload_cache = _resolve_upload_cache(upload_cache)
+        self.retry = _resolve_retry_policy(retry)
+        self.workflow_cache = _resolve_workflow_cache(workflow_cache)
+        self._workflow_stamp = None
+        self.schema_cache = _resolve_schema_cache(schema_cache)
+        # Node schemas by type once load_schema() was called; set_data()
+        # and validate_prompt() check against them
+        self.schema = None
+        # Check every prompt with validate_prompt() before queueing it
+        self.validate = validate
+        # Outputs of already executed prompts; None (the default) disables it
+        self.result_cache = result_cache
+        # Called with every Span the client records, e.g. an
+        # OpenTelemetryMetrics; spans of generate() also go to result.timings
+        self.metrics = metrics
+        # Seconds between WebSocket pings; a socket that misses its pong is
+        # treated as dropped. None disables pings.
+        self.heartbeat = heartbeat
+        # Attempts to reopen a dropped WebSocket, spaced by ``retry`` delays,
+        # before pending prompts fail with ConnectionError
+        self.reconnect_attempts = reconnect_attempts
+        self._reader_task = None
+        self._waiters = OrderedDict()
+        # Prompts running or pending on the server, from ``status`` messages
+        # and ``get_queue()``; None until the server has reported it
+        self.queue_remaining = None
+        # (prompt_id, node) last reported executing; binary frames without
+        # metadata belong to it
+        self._executing = (None, None)
 
         self.reload()
 
-    def reload(self):
-        """Reload workflow file and convert if needed"""
-        try:
-            with open(self.PROMPT_FILE, "r", encoding="utf8") as f:
-                data = json.load(f)
+    def reload(self, force=False):
+        """
+        Load the workflow file, converting it to API format if needed.
 
-            # Convert workflow.json to API format if needed
-            if "nodes" in data and "links" in data:
-                self.comfyui_prompt = convert_workflow_to_api(data)
+        Does nothing while the file's mtime and size are unchanged, unless
+        ``force`` is set; a forced reload also discards ``set_data()`` changes.
+        """
+        try:
+            stamp = _file_stamp(self.PROMPT_FILE)
+            if stamp == self._workflow_stamp and not force:
+                return
+            if self.workflow_cache is not None:
+                self.template = self.workflow_cache.load(self.PROMPT_FILE)
             else:
-                self.comfyui_prompt = data
+                with open(self.PROMPT_FILE, "rb") as f:
+                    self.template = WorkflowTemplate(_parse_workflow(f.read()))
+            self._workflow_stamp = stamp
 
             if self.debug:
                 print(f"Loaded workflow from {self.PROMPT_FILE}")
+                for name, node_ids in self.template.duplicates.items():
+                    print(f"{name!r} matches nodes {node_ids}; using {node_ids[0]}")
         except FileNotFoundError:
             print(f"Prompt file not found: {self.PROMPT_FILE}")
         except json.JSONDecodeError:
@@ -132,15 +1813,168 @@ class ComfyUIClientAsync:
     async def connect(self):
         try:
             self.session = aiohttp.ClientSession()
-            self.ws = await self.session.ws_connect(
-                f"ws://{self.SERVER_ADDRESS}/ws?clientId={self.CLIENT_ID}"
-            )
+            self.ws = await self._open_websocket()
         except aiohttp.ClientError as e:
             if self.session:
                 await self.session.close()
             raise ConnectionError(f"Failed to connect to ComfyUI server: {e}")
+        self._reader_task = asyncio.ensure_future(self._read_messages())
+
+    async def _open_websocket(self):
+        # The same client id on every connection, so the server keeps sending
+        # the messages of prompts queued before a reconnect
+        return await self.session.ws_connect(
+            f"ws://{self.SERVER_ADDRESS}/ws?clientId={self.CLIENT_ID}",
+            heartbeat=self.heartbeat,
+        )
+
+    async def _read_messages(self):
+        """
+        Own the WebSocket and route every message to its prompt's waiter.
+
+        A dropped socket is reopened; if that keeps failing, every pending
+        prompt fails with ``ConnectionError``.
+        """
+        error = ConnectionError("WebSocket connection closed")
+        try:
+            while True:
+                try:
+                    await self._receive_messages()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    error = ConnectionError(f"WebSocket connection failed: {e}")
+                if not await self._reconnect():
+                    break
+                error = ConnectionError("WebSocket connection closed")
+        finally:
+            for waiter in self._waiters.values():
+                waiter.set_exception(error)
+                # Unclaimed waiters would otherwise warn about an
+                # exception that nobody retrieved.
+                if not waiter.claimed:
+                    waiter.done.exception()
+
+    async def _receive_messages(self):
+        """Handle messages until the socket closes"""
+        while True:
+            message = await self.ws.receive()
+            if message.type in (aiohttp.WSMsgType.TEXT, aiohttp.WSMsgType.BINARY):
+                try:
+                    if message.type == aiohttp.WSMsgType.TEXT:
+                        self._handle_message(json.loads(message.data))
+                    else:
+                        self._handle_frame(message.data)
+                except (ValueError, TypeError, AttributeError) as e:
+                    if self.debug:
+                        print(f"Ignoring malformed WebSocket message: {e}")
+            elif message.type in (
+                aiohttp.WSMsgType.CLOSE,
+                aiohttp.WSMsgType.CLOSING,
+                aiohttp.WSMsgType.CLOSED,
+                aiohttp.WSMsgType.ERROR,
+            ):
+                return
+
+    async def _reconnect(self):
+        """Reopen the WebSocket; return False once every attempt has failed"""
+        for attempt in range(1, self.reconnect_attempts + 1):
+            await asyncio.sleep(self.retry.delay(attempt))
+            try:
+                ws = await self._open_websocket()
+            except Exception as e:
+                if self.debug:
+                    print(f"WebSocket reconnect attempt {attempt} failed: {e}")
+                continue
+            old_ws, self.ws = self.ws, ws
+            try:
+                await old_ws.close()
+            except Exception:
+                pass
+            if self.debug:
+                print("WebSocket reconnected")
+            await self._reconcile()
+            return True
+        return False
+
+    async def _reconcile(self):
+        """
+        Settle prompts whose completion message was missed while disconnected.
+
+        Prompts still running are left to the new socket's messages.
+        """
+        for prompt_id, waiter in list(self._waiters.items()):
+            if not waiter.done.done():
+                await self._settle_from_history(prompt_id, waiter)
+
+    async def _settle_from_history(self, prompt_id, waiter):
+        """Resolve ``waiter`` if the history of ``prompt_id`` shows it ended"""
+        try:
+            entry = (await self.get_history(prompt_id)).get(prompt_id)
+        except Exception as e:
+            if self.debug:
+                print(f"Error getting history for {prompt_id}: {e}")
+            return
+        if entry is None:
+            return
+        status = entry.get("status") or {}
+        if status.get("status_str") == "error":
+            waiter.set_exception(RuntimeError(f"Prompt {prompt_id} failed"))
+        elif "outputs" in entry:
+            waiter.set_result(None)
+
+    def _handle_message(self, data):
+        remaining = _queue_remaining(data)
+        if remaining is not None:
+            self.queue_remaining = remaining
+        executing = _executing_node(data)
+        if executing is not None:
+            self._executing = executing
+        _route_message(data, self._get_waiter)
+
+    def _handle_frame(self, data):
+        """Route a binary image frame to its prompt, by default the running one"""
+        frame = _parse_frame(data)
+        if frame is None:
+            return
+        metadata, extension, image = frame
+        prompt_id = metadata.get("prompt_id", self._executing[0])
+        node = metadata.get("node_id", self._executing[1])
+        if prompt_id is not None:
+            self._get_waiter(prompt_id).add_frame(prompt_id, node, extension, image)
+
+    def _get_waiter(self, prompt_id):
+        waiter = self._waiters.get(prompt_id)
+        if waiter is None:
+            waiter = self._waiters[prompt_id] = _PromptWaiter()
+            if len(self._waiters) > self.MAX_UNCLAIMED_PROMPTS:
+                self._drop_unclaimed()
+        return waiter
+
+    def _drop_unclaimed(self):
+        for prompt_id, waiter in list(self._waiters.items()):
+            if not waiter.claimed and waiter.done.done():
+                if not waiter.done.cancelled():
+                    waiter.done.exception()
+                del self._waiters[prompt_id]
+                if len(self._waiters) <= self.MAX_UNCLAIMED_PROMPTS:
+                    break
+
+    async def _stop_reader(self):
+        if self._reader_task is None:
+            return
+        self._reader_task.cancel()
+        try:
+            await self._reader_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            if self.debug:
+                print(f"Error stopping WebSocket reader: {e}")
+        self._reader_task = None
 
     async def close(self):
+        await self._stop_reader()
         try:
             if self.ws:
                 await self.ws.close()
@@ -154,75 +1988,309 @@ class ComfyUIClientAsync:
             if self.debug:
                 print(f"Error closing session: {e}")
 
-    async def queue_prompt(self, prompt):
-        try:
-            payload = {"prompt": prompt, "client_id": self.CLIENT_ID}
+    async def queue_prompt(self, prompt, prompt_id=None):
+        """
+        Queue ``prompt`` under ``prompt_id`` (a new id by default).
+
+        Failed requests are retried according to ``retry``. Before each retry
+        the server is asked whether the prompt already arrived, so a lost
+        response never queues the same work twice.
+        """
+        if prompt_id is None:
+            prompt_id = str(uuid.uuid4())
+        payload = {
+            "prompt": prompt,
+            "client_id": self.CLIENT_ID,
+            "prompt_id": prompt_id,
+        }
+        attempted = False
+
+        async def post():
+            nonlocal attempted
+            if attempted and await self._is_known_prompt(prompt_id):
+                return {"prompt_id": prompt_id}
+            attempted = True
             async with self.session.post(
                 f"http://{self.SERVER_ADDRESS}/prompt", json=payload
             ) as response:
                 response.raise_for_status()
-                result = await response.json()
-                if "prompt_id" not in result:
-                    raise ValueError("Server response missing prompt_id")
-                return result
+                return await response.json()
+
+        try:
+            with _timed(self.metrics, "queue_prompt", prompt_id=prompt_id):
+                result = await self.retry.call_async(post)
         except aiohttp.ClientError as e:
             raise ConnectionError(f"Failed to queue prompt: {e}")
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON response from server: {e}")
+        if "prompt_id" not in result:
+            raise ValueError("Server response missing prompt_id")
+        return result
+
+    async def _is_known_prompt(self, prompt_id):
+        """Whether the server has ``prompt_id`` queued, running or finished"""
+        async with self.session.get(f"http://{self.SERVER_ADDRESS}/queue") as response:
+            response.raise_for_status()
+            if _find_in_queue(await response.json(), prompt_id):
+                return True
+        async with self.session.get(
+            f"http://{self.SERVER_ADDRESS}/history/{prompt_id}"
+        ) as response:
+            response.raise_for_status()
+            return prompt_id in await response.json()
 
     async def get_image(self, filename, subfolder, folder_type):
-        try:
-            params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+
+        async def fetch():
             async with self.session.get(
                 f"http://{self.SERVER_ADDRESS}/view", params=params
             ) as response:
                 response.raise_for_status()
                 return await response.read()
+
+        try:
+            with _timed(self.metrics, "get_image", filename=filename):
+                return await self.retry.call_async(fetch)
         except aiohttp.ClientError as e:
             raise ConnectionError(f"Failed to get image {filename}: {e}")
 
-    async def get_history(self, prompt_id):
+    async def stream_image(self, filename, subfolder, folder_type, write):
+        """
+        Pass ``/view`` to ``write(chunk)`` piece by piece; return the size.
+
+        Only failures before the first chunk is written are retried.
+        """
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        size = 0
+
+        async def fetch():
+            nonlocal size
+            async with self.session.get(
+                f"http://{self.SERVER_ADDRESS}/view", params=params
+            ) as response:
+                response.raise_for_status()
+                async for chunk in response.content.iter_chunked(
+                    self.DOWNLOAD_CHUNK_SIZE
+                ):
+                    write(chunk)
+                    size += len(chunk)
+                return size
+
         try:
+            with _timed(self.metrics, "get_image", filename=filename):
+                return await self.retry.call_async(fetch, retry_if=lambda: size == 0)
+        except aiohttp.ClientError as e:
+            raise ConnectionError(f"Failed to get image {filename}: {e}")
+
+    async def get_history(self, prompt_id):
+        async def fetch():
             async with self.session.get(
                 f"http://{self.SERVER_ADDRESS}/history/{prompt_id}"
             ) as response:
                 response.raise_for_status()
                 return await response.json()
+
+        try:
+            with _timed(self.metrics, "get_history", prompt_id=prompt_id):
+                return await self.retry.call_async(fetch)
         except aiohttp.ClientError as e:
             raise ConnectionError(f"Failed to get history for {prompt_id}: {e}")
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON response from server: {e}")
 
-    async def get_images(self, prompt):
-        prompt_id = (await self.queue_prompt(prompt))["prompt_id"]
-        output_images = {}
-        output_text = {}
+    async def get_queue(self):
+        """Return the server's ``/queue``: its running and pending prompts"""
 
-        while True:
-            message = await self.ws.receive()
-            if message.type == aiohttp.WSMsgType.TEXT:
-                data = json.loads(message.data)
-                if (
-                    data["type"] == "executing"
-                    and data["data"]["node"] is None
-                    and data["data"]["prompt_id"] == prompt_id
-                ):
-                    break
+        async def fetch():
+            async with self.session.get(
+                f"http://{self.SERVER_ADDRESS}/queue"
+            ) as response:
+                response.raise_for_status()
+                return await response.json()
+
+        try:
+            queue = await self.retry.call_async(fetch)
+        except aiohttp.ClientError as e:
+            raise ConnectionError(f"Failed to get queue: {e}")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON response from server: {e}")
+        self.queue_remaining = _queue_depth(queue)
+        return queue
+
+    async def get_object_info(self, refresh=False):
+        """
+        Return the server's ``/object_info``: the inputs of every node type.
+
+        Served from ``schema_cache`` unless the cached schema is stale or
+        ``refresh`` is set, in which case it is revalidated with the server.
+        """
+        cache = self.schema_cache
+        entry = cache.get(self.SERVER_ADDRESS) if cache is not None else None
+        if entry is not None and not refresh and not cache.is_stale(entry):
+            return entry["object_info"]
+        object_info, etag = await self._fetch_object_info(entry and entry["etag"])
+        if cache is None:
+            return object_info
+        if object_info is None:
+            cache.touch(self.SERVER_ADDRESS)
+            return entry["object_info"]
+        return cache.put(self.SERVER_ADDRESS, object_info, etag)["object_info"]
+
+    async def _fetch_object_info(self, etag=None):
+        """Return ``(object_info, etag)``, or ``(None, etag)`` if unchanged"""
+        headers = {"If-None-Match": etag} if etag else {}
+
+        async def fetch():
+            async with self.session.get(
+                f"http://{self.SERVER_ADDRESS}/object_info", headers=headers
+            ) as response:
+                if response.status == 304:
+                    return None, etag
+                response.raise_for_status()
+                return await response.json(), response.headers.get("ETag")
 
+        try:
+            return await self.retry.call_async(fetch)
+        except aiohttp.ClientError as e:
+            raise ConnectionError(f"Failed to get object info: {e}")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON response from server: {e}")
+
+    async def load_schema(self, refresh=False):
+        """
+        Load the server's node schema to validate ``set_data()`` locally.
+
+        Only ``schema`` is set; use ``fetch_widget_mappings()`` to register
+        the server's widget mappings.
+        """
+        object_info = await self.get_object_info(refresh)
+        self.schema = _schema_specs(self, object_info)
+        return self.schema
+
+    async def fetch_widget_mappings(self, cache_path=None):
+        """
+        Register the widget mappings of every node type the server knows.
+
+        With ``cache_path``, mappings are read from that file if it exists
+        and written to it otherwise; delete it after installing node packs.
+        The workflow is then reloaded, discarding ``set_data()`` changes.
+        """
+        if cache_path is not None and os.path.exists(cache_path):
+            mappings = load_widget_mappings(cache_path)
+        else:
+            mappings = load_widget_mappings(await self.get_object_info())
+            if cache_path is not None:
+                _save_widget_mappings(cache_path, mappings)
+        self.reload(force=True)
+        return mappings
+
+    async def wait_for_completion(self, prompt_id, timeout=None):
+        """Wait until the server reports that ``prompt_id`` finished executing.
+
+        Any number of prompts can be awaited concurrently; the WebSocket reader
+        started by ``connect()`` resolves each one as its messages arrive.
+        History is checked every ``HISTORY_CHECK_INTERVAL`` seconds as well,
+        so prompts queued by another client, whose messages go to that
+        client, complete too.
+        """
+        if self._reader_task is None or self._reader_task.done():
+            raise ConnectionError("Not connected; call connect() first")
+        if timeout is None:
+            timeout = self.timeout
+        loop = asyncio.get_event_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        waiter = self._get_waiter(prompt_id)
+        waiter.claimed = True
+        try:
+            while not waiter.done.done():
+                wait = self.HISTORY_CHECK_INTERVAL
+                if deadline is not None:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise TimeoutError(
+                            f"Timeout waiting for prompt {prompt_id} to complete"
+                        )
+                    wait = min(wait, remaining)
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.done), wait)
+                except asyncio.TimeoutError:
+                    await self._settle_from_history(prompt_id, waiter)
+            waiter.done.result()
+        finally:
+            self._waiters.pop(prompt_id, None)
+        _record_execution(self.metrics, prompt_id, waiter)
+
+    async def get_images(self, prompt, prompt_id=None):
+        """
+        Queue ``prompt`` and return its ``(images, text)`` outputs.
+
+        Pass the ``prompt_id`` of an earlier call that failed while waiting to
+        resume it: a prompt the server already has is awaited, not resubmitted.
+        """
+        if prompt_id is None or not await self._check_known_prompt(prompt_id):
+            prompt_id = (await self.queue_prompt(prompt, prompt_id))["prompt_id"]
+        else:
+            # It may have finished long ago, its completion message with it
+            await self._settle_from_history(prompt_id, self._get_waiter(prompt_id))
+        return await self.get_outputs(prompt_id)
+
+    async def _check_known_prompt(self, prompt_id):
+        try:
+            return await self.retry.call_async(lambda: self._is_known_prompt(prompt_id))
+        except aiohttp.ClientError as e:
+            raise ConnectionError(f"Failed to look up prompt {prompt_id}: {e}")
+
+    async def get_outputs(self, prompt_id, timeout=None, sink=None):
+        waiter = self._waiters.get(prompt_id)
+        await self.wait_for_completion(prompt_id, timeout)
         history = (await self.get_history(prompt_id))[prompt_id]
-        for node_id, node_output in history["outputs"].items():
-            images_output = []
-            if "images" in node_output:
-                for image in node_output["images"]:
-                    image_data = await self.get_image(
+        images, text = await self.download_outputs(history["outputs"], sink)
+        if waiter is not None:
+            _add_frames(images, waiter.frames, sink, prompt_id)
+        return images, text
+
+    async def download_outputs(self, outputs, sink=None):
+        """
+        Fetch every image in a history ``outputs`` dict concurrently.
+
+        At most ``download_concurrency`` requests run at once; images keep
+        their order within each node.
+
+        Args:
+            outputs: The ``outputs`` of a history entry
+            sink: Stream the files instead of reading them into memory. A
+                directory path, a writable file object or a callable
+                ``sink(node_id, image, chunk)``. Only directory sinks are
+                written concurrently.
+
+        Returns:
+            ``(images, text)`` dicts keyed by node id. With a sink, images
+            hold the saved paths (directory) or the image entries instead of
+            the file contents.
+        """
+        concurrency = self.download_concurrency
+        if sink is not None and not _is_directory_sink(sink):
+            concurrency = 1
+        elif sink is not None:
+            os.makedirs(sink, exist_ok=True)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(node_id, image):
+            async with semaphore:
+                if sink is None:
+                    return await self.get_image(
                         image["filename"], image["subfolder"], image["type"]
                     )
-                    images_output.append(image_data)
-                output_images[node_id] = images_output
-            if "text" in node_output:
-                output_text[node_id] = node_output["text"]
+                with _open_sink(sink, node_id, image) as write:
+                    await self.stream_image(
+                        image["filename"], image["subfolder"], image["type"], write
+                    )
+                return _sink_result(sink, image)
 
-        return output_images, output_text
+        files = _output_files(outputs)
+        image_data = await asyncio.gather(*(fetch(*item) for item in files))
+        return _group_outputs(outputs, files, image_data)
 
     async def set_data(
         self,
@@ -239,116 +2307,420 @@ class ComfyUIClientAsync:
         if key_id is None:
             return
 
+        inputs = {}
         if input_key is not None and input_value is not None:
-            self.comfyui_prompt[key_id]["inputs"][input_key] = input_value
+            inputs[input_key] = input_value
         if text is not None:
-            self.comfyui_prompt[key_id]["inputs"]["text"] = text
+            inputs["text"] = text
         if seed is not None:
-            self.comfyui_prompt[key_id]["inputs"]["seed"] = int(seed)
+            inputs["seed"] = int(seed)
         if number is not None:
-            self.comfyui_prompt[key_id]["inputs"]["Number"] = number
+            inputs["Number"] = number
         if value is not None:
-            self.comfyui_prompt[key_id]["inputs"]["value"] = value
+            inputs["value"] = value
+        if self.schema is not None:
+            # Fail before uploading anything
+            _check_inputs(
+                self.schema, self.comfyui_prompt[key_id]["class_type"], inputs
+            )
         if image is not None:
-            try:
-                # Upload image to comfyui server
-                folder_name = "temp"
+            # Set image path
+            inputs["image"] = await self.upload_image(image)
+
+        # Swap in an updated copy so generations already in flight in other
+        # tasks never see a node change under them
+        self.template = self.template.with_prompt(
+            apply_overrides(self.comfyui_prompt, {key_id: inputs})
+        )
+
+        if self.debug:
+            print(f"Set data for {key} (id: {key_id}): {self.comfyui_prompt[key_id]}")
+
+    async def upload_image(self, image, format="PNG", **params):
+        """
+        Upload an image and return its path for a ``LoadImage`` input.
+
+        Args:
+            image: A PIL image, encoded image bytes or file object, or the path
+                of an image file (streamed, never read into memory at once)
+            format: Encoding used for PIL images, e.g. ``"JPEG"`` or ``"WEBP"``
+            **params: Encoder options for PIL images, e.g. ``compress_level=1``
+                for faster PNG encoding or ``quality=90``
+
+        Uploads are named after a hash of their content, so concurrent uploads
+        never collide, and identical images are only encoded and uploaded once
+        per server while they stay in ``upload_cache``. Hashing and encoding
+        run in the default executor to keep the event loop responsive.
+        """
+        if not isinstance(image, Image.Image) and not _is_path(image):
+            image = _buffer_bytes(image)
+        loop = asyncio.get_event_loop()
+        digest, extension = await loop.run_in_executor(
+            None, _upload_source, image, format, params
+        )
+        cache_key = f"{self.SERVER_ADDRESS}/{digest}"
+        if self.upload_cache is not None:
+            image_path = self.upload_cache.get(cache_key)
+            if image_path is not None:
+                return image_path
+
+        if isinstance(image, Image.Image):
+            image = await loop.run_in_executor(
+                None, _encode_image, image, format, params
+            )
+        image_path = await self._send_upload(image, f"{digest[:32]}{extension}")
+        if self.upload_cache is not None:
+            self.upload_cache.put(cache_key, image_path)
+        return image_path
 
-                # Save image to byte data
-                byte_data = io.BytesIO()
-                image.save(byte_data, format="PNG")
-                byte_data.seek(0)
+    async def _send_upload(self, image, filename):
+        """POST encoded image bytes or an image file to ``/upload/image``"""
+
+        async def post():
+            with contextlib.ExitStack() as stack:
+                content = image
+                if _is_path(image):
+                    content = stack.enter_context(open(image, "rb"))
 
                 # Upload image using existing session
                 data = aiohttp.FormData()
-                data.add_field("image", byte_data, filename="temp.png")
-                data.add_field("subfolder", folder_name)
+                data.add_field("image", content, filename=filename)
+                data.add_field("subfolder", "temp")
+                data.add_field("overwrite", "true")
 
                 async with self.session.post(
                     f"http://{self.SERVER_ADDRESS}/upload/image", data=data
                 ) as response:
                     response.raise_for_status()
-                    resp_json = await response.json()
+                    return await response.json()
 
-                    if "name" not in resp_json or "subfolder" not in resp_json:
-                        raise ValueError(
-                            "Invalid upload response: missing required fields"
-                        )
+        try:
+            resp_json = await self.retry.call_async(post)
+            if "name" not in resp_json or "subfolder" not in resp_json:
+                raise ValueError("Invalid upload response: missing required fields")
+        except aiohttp.ClientError as e:
+            raise ConnectionError(f"Failed to upload image: {e}")
+        except Exception as e:
+            raise RuntimeError(f"Error processing image upload: {e}")
 
-                # Set image path
-                self.comfyui_prompt[key_id]["inputs"]["image"] = (
-                    resp_json.get("subfolder") + "/" + resp_json.get("name")
-                )
-            except aiohttp.ClientError as e:
-                raise ConnectionError(f"Failed to upload image: {e}")
-            except Exception as e:
-                raise RuntimeError(f"Error processing image upload: {e}")
+        return resp_json.get("subfolder") + "/" + resp_json.get("name")
 
-        if self.debug:
-            print(f"Set data for {key} (id: {key_id}): {self.comfyui_prompt[key_id]}")
+    @property
+    def comfyui_prompt(self):
+        return self.template.prompt
+
+    @comfyui_prompt.setter
+    def comfyui_prompt(self, prompt):
+        self.template = WorkflowTemplate(prompt)
 
     def find_key_by_title(self, target_title):
-        target_title = target_title.strip()
-        for key, value in self.comfyui_prompt.items():
-            # Check class_type first
-            class_type = value.get("class_type", "").strip()
-            if class_type == target_title:
-                return key
-            # Then check title
-            title = value.get("_meta", {}).get("title", "").strip()
-            if title == target_title:
-                return key
-        if self.debug:
+        key = self.template.find(target_title)
+        if key is None and self.debug:
             print(f"Key not found: {target_title}")
-        return None
-
-    async def generate(self, node_names=None) -> dict:
+        return key
+
+    def prepare_prompt(self, overrides=None):
+        """Return the prompt for one generation without touching comfyui_prompt"""
+        return apply_overrides(self.comfyui_prompt, overrides, self.find_key_by_title)
+
+    async def generate(
+        self, node_names=None, overrides=None, output="pil", on_progress=None
+    ) -> dict:
+        """
+        Queue the workflow and collect the outputs of ``node_names``.
+
+        Returns a ``GenerationResult``: a dict of node name to its first image
+        (or text), with every image of a batch in ``result.images``.
+
+        Args:
+            node_names: Titles or class_types of the nodes to return
+            overrides: Per-call input changes, see ``prepare_prompt()``
+            output: How images are returned: ``"pil"`` (``PIL.Image``),
+                ``"bytes"`` (the file as served) or ``"lazy"`` (``LazyImage``,
+                decoded on first pixel access)
+            on_progress: Called with a ``ProgressEvent`` for every WebSocket
+                message about the prompt
+
+        The time spent in each phase is listed in ``result.timings``.
+        """
+        if output not in OUTPUT_MODES:
+            raise ValueError(f"output must be one of {OUTPUT_MODES}, got {output!r}")
+        # One workflow version for the whole job, even if it is reloaded meanwhile
+        template = self.template
         node_ids = {}
         if node_names is not None:
             for node_name in node_names:
-                node_id = self.find_key_by_title(node_name)
+                node_id = template.find(node_name)
                 if node_id is not None:
                     node_ids[node_id] = node_name
 
-        images, text = await self.get_images(self.comfyui_prompt)
-        results = {}
-        for node_id, node_images in images.items():
-            if node_id in node_ids:
-                for image_data in node_images:
-                    image = Image.open(io.BytesIO(image_data))
-                    results[node_ids[node_id]] = image
-        for node_id, node_text in text.items():
-            if node_id in node_ids:
-                results[node_ids[node_id]] = node_text
+        prompt = apply_overrides(template.prompt, overrides, template.find)
+        if self.validate:
+            validate_prompt(prompt, self.schema)
+        timings: List[Span] = []
+        token = _current_timings.set(timings)
+        try:
+            prompt_id, images, text, cached = await self._run(prompt, on_progress)
+            with _timed(self.metrics, "decode", output=output):
+                result = GenerationResult.build(
+                    prompt_id, node_ids, images, text, output
+                )
+        finally:
+            _current_timings.reset(token)
+        result.cached = cached
+        result.timings = timings
+        return result
+
+    async def _run(self, prompt, on_progress):
+        """Return ``(prompt_id, images, text, cached)`` of ``prompt``"""
+        # The result cache may read and write files, so keep it off the loop
+        loop = asyncio.get_event_loop()
+        key = None
+        if self.result_cache is not None:
+            key = prompt_hash(prompt)
+            hit = await loop.run_in_executor(None, self.result_cache.get, key)
+            if hit is not None:
+                return hit + (True,)
+        prompt_id = await self._queue_tracked(prompt, on_progress)
+        images, text = await self.get_outputs(prompt_id)
+        if key is not None:
+            await loop.run_in_executor(
+                None, self.result_cache.put, key, prompt_id, images, text
+            )
+        return prompt_id, images, text, False
+
+    async def _queue_tracked(self, prompt, on_progress):
+        """
+        Queue ``prompt`` and return its id, following it with ``on_progress``
+        and collecting the image frames of its WebSocket output nodes and
+        the times it waited and executed.
+        """
+        output_nodes = _websocket_output_nodes(prompt)
+        if on_progress is None and not output_nodes:
+            prompt_id = (await self.queue_prompt(prompt))["prompt_id"]
+            # Messages may already have arrived, making the wait negative; it
+            # is reported as zero
+            self._get_waiter(prompt_id).queued = time.monotonic()
+            return prompt_id
+        prompt_id = str(uuid.uuid4())
+        # Listen before queueing so that no early message is missed
+        waiter = self._get_waiter(prompt_id)
+        waiter.output_nodes = output_nodes
+        if on_progress is not None:
+            waiter.listeners.append(on_progress)
+        try:
+            queued_id = (await self.queue_prompt(prompt, prompt_id))["prompt_id"]
+        except BaseException:
+            self._waiters.pop(prompt_id, None)
+            raise
+        if queued_id != prompt_id:
+            self._rekey_waiter(prompt_id, queued_id, waiter)
+        waiter.queued = time.monotonic()
+        return queued_id
+
+    def _rekey_waiter(self, prompt_id, queued_id, waiter):
+        """
+        Move ``waiter`` from ``prompt_id`` to ``queued_id``, the id a server
+        that ignores the requested one gave the prompt.
+        """
+        self._waiters.pop(prompt_id, None)
+        early = self._waiters.get(queued_id)
+        if early is not None:
+            waiter.adopt(early)
+        self._waiters[queued_id] = waiter
+
+    async def stream(self, node_names=None, overrides=None, output="pil"):
+        """
+        Run ``generate()`` and yield a ``ProgressEvent`` for each update.
+
+        The last event has type ``"result"`` and the ``GenerationResult`` as
+        its ``output``; errors of the generation are raised after the events
+        leading up to them.
+
+        Usage:
+            async for event in client.stream(["Result Image"]):
+                if event.type == "progress":
+                    print(f"{event.value}/{event.max}")
+                elif event.type == "result":
+                    images = event.output
+        """
+        events = asyncio.Queue()
+        task = asyncio.ensure_future(
+            self.generate(node_names, overrides, output, events.put_nowait)
+        )
+        task.add_done_callback(lambda _: events.put_nowait(None))
+        try:
+            while True:
+                event = await events.get()
+                if event is None:
+                    break
+                yield event
+            result = await task
+            yield ProgressEvent(
+                "result", result.prompt_id, None, None, None, None, result, None, None
+            )
+        finally:
+            if not task.done():
+                task.cancel()
 
-        return results
+    async def generate_many(
+        self,
+        jobs,
+        node_names=None,
+        max_in_flight=8,
+        return_exceptions=False,
+        output="pil",
+    ):
+        """
+        Run ``generate()`` for many override sets, keeping the server busy.
+
+        Up to ``max_in_flight`` prompts are queued at once; results are yielded
+        as ``(index, result)`` in completion order, where ``index`` is the
+        position of the job in ``jobs``.
+
+        Args:
+            jobs: Iterable of overrides dicts (see ``generate()``)
+            node_names: Output node names passed to every ``generate()`` call
+            max_in_flight: Maximum number of prompts queued at the same time
+            return_exceptions: Yield a failed job's exception as its result
+                instead of raising it
+            output: Image output mode passed to ``generate()``
+        """
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        jobs = iter(enumerate(jobs))
+        pending = {}
+
+        def submit():
+            for index, overrides in jobs:
+                task = asyncio.ensure_future(
+                    self.generate(node_names, overrides, output)
+                )
+                pending[task] = index
+                if len(pending) >= max_in_flight:
+                    break
+
+        try:
+            submit()
+            while pending:
+                done, _ = await asyncio.wait(
+                    list(pending), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    index = pending.pop(task)
+                    if task.exception() is not None and not return_exceptions:
+                        raise task.exception()
+                    yield index, task.exception() or task.result()
+                submit()
+        finally:
+            for task in pending:
+                task.cancel()
 
 
 class ComfyUIClient:
 
-    def __init__(self, server, prompt_file, debug=False):
+    MAX_UNCLAIMED_PROMPTS = 1024
+
+    DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+    # History polling backoff, used when no WebSocket is available
+    POLL_INTERVAL_MIN = 0.05
+    POLL_INTERVAL_MAX = 2.0
+    # With a WebSocket, history is still checked this often in case a
+    # completion message was missed
+    HISTORY_CHECK_INTERVAL = 5.0
+
+    def __init__(
+        self,
+        server,
+        prompt_file,
+        debug=False,
+        timeout=300.0,
+        use_websocket=True,
+        download_concurrency=4,
+        upload_cache=None,
+        retry=None,
+        pool_size=32,
+        connect_timeout=10.0,
+        read_timeout=60.0,
+        keep_alive=True,
+        workflow_cache=None,
+        schema_cache=None,
+        validate=True,
+        result_cache=None,
+        metrics=None,
+    ):
         self.PROMPT_FILE = prompt_file
         self.SERVER_ADDRESS = server
         self.CLIENT_ID = str(uuid.uuid4())
         self.session = None
+        self.ws = None
         self.debug = debug
+        self.timeout = timeout
+        self.use_websocket = use_websocket
+        self.download_concurrency = download_concurrency
+        # HTTP connections kept open to the server; should cover every
+        # request made concurrently (generations x download_concurrency)
+        self.pool_size = pool_size
+        # (connect, read) timeout of each HTTP request, see requests' timeouts
+        self.request_timeout = (connect_timeout, read_timeout)
+        self.keep_alive = keep_alive
+        self.upload_cache = _resolve_upload_cache(upload_cache)
+        self.retry = _resolve_retry_policy(retry)
+        self.workflow_cache = _resolve_workflow_cache(workflow_cache)
+        self._workflow_stamp = None
+        self.schema_cache = _resolve_schema_cache(schema_cache)
+        # Node schemas by type once load_schema() was called; set_data()
+        # and validate_prompt() check against them
+        self.schema = None
+        # Check every prompt with validate_prompt() before queueing it
+        self.validate = validate
+        # Outputs of already executed prompts; None (the default) disables it
+        self.result_cache = result_cache
+        # Called with every Span the client records, e.g. an
+        # OpenTelemetryMetrics; spans of generate() also go to result.timings
+        self.metrics = metrics
+        self._reader_thread = None
+        # Fetches the images of every generate(); created on first use and
+        # shut down by close()
+        self._download_executor = None
+        self._download_executor_lock = threading.Lock()
+        # Serializes set_data() swaps so concurrent updates are all kept
+        self._template_lock = threading.Lock()
+        self._waiters = OrderedDict()
+        self._waiters_lock = threading.Lock()
+        # Prompts running or pending on the server, from ``status`` messages
+        # and ``get_queue()``; None until the server has reported it
+        self.queue_remaining = None
+        # (prompt_id, node) last reported executing; binary frames without
+        # metadata belong to it
+        self._executing = (None, None)
 
         self.reload()
 
-    def reload(self):
-        """Reload workflow file and convert if needed"""
-        try:
-            with open(self.PROMPT_FILE, "r", encoding="utf8") as f:
-                data = json.load(f)
+    def reload(self, force=False):
+        """
+        Load the workflow file, converting it to API format if needed.
 
-            # Convert workflow.json to API format if needed
-            if "nodes" in data and "links" in data:
-                self.comfyui_prompt = convert_workflow_to_api(data)
+        Does nothing while the file's mtime and size are unchanged, unless
+        ``force`` is set; a forced reload also discards ``set_data()`` changes.
+        """
+        try:
+            stamp = _file_stamp(self.PROMPT_FILE)
+            if stamp == self._workflow_stamp and not force:
+                return
+            if self.workflow_cache is not None:
+                self.template = self.workflow_cache.load(self.PROMPT_FILE)
             else:
-                self.comfyui_prompt = data
+                with open(self.PROMPT_FILE, "rb") as f:
+                    self.template = WorkflowTemplate(_parse_workflow(f.read()))
+            self._workflow_stamp = stamp
 
             if self.debug:
                 print(f"Loaded workflow from {self.PROMPT_FILE}")
+                for name, node_ids in self.template.duplicates.items():
+                    print(f"{name!r} matches nodes {node_ids}; using {node_ids[0]}")
         except FileNotFoundError:
             print(f"Prompt file not found: {self.PROMPT_FILE}")
         except json.JSONDecodeError:
@@ -357,96 +2729,492 @@ class ComfyUIClient:
             print(f"Error: {e} while reading prompt file: {self.PROMPT_FILE}")
 
     def connect(self):
-        self.session = requests.Session()
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=self.pool_size
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+        self.session = session
+        if self.use_websocket and websocket is not None:
+            self._connect_websocket()
+
+    def _connect_websocket(self):
+        """Open the WebSocket used for completion events, if possible.
+
+        Without it, completion is detected by polling ``/history``.
+        """
+        try:
+            self.ws = websocket.create_connection(
+                f"ws://{self.SERVER_ADDRESS}/ws?clientId={self.CLIENT_ID}",
+                timeout=self.request_timeout[0],
+            )
+            self.ws.settimeout(None)
+        except Exception as e:
+            self.ws = None
+            if self.debug:
+                print(f"WebSocket unavailable, polling history instead: {e}")
+            return
+        self._reader_thread = threading.Thread(
+            target=self._read_messages, name="comfyui-ws-reader", daemon=True
+        )
+        self._reader_thread.start()
+
+    def _read_messages(self):
+        """Own the WebSocket and route every message to its prompt's waiter."""
+        ws = self.ws
+        try:
+            while True:
+                message = ws.recv()
+                if not message:
+                    break
+                try:
+                    if isinstance(message, bytes):
+                        self._handle_frame(message)
+                    else:
+                        self._handle_message(json.loads(message))
+                except (ValueError, TypeError, AttributeError) as e:
+                    if self.debug:
+                        print(f"Ignoring malformed WebSocket message: {e}")
+        except Exception as e:
+            if self.debug and self.ws is not None:
+                print(f"WebSocket closed, falling back to polling: {e}")
+        finally:
+            # Wake every waiter; with the socket gone they poll history instead
+            if self.ws is ws:
+                self.ws = None
+            with self._waiters_lock:
+                waiters = list(self._waiters.values())
+            for waiter in waiters:
+                waiter.event.set()
+
+    def _handle_message(self, data):
+        remaining = _queue_remaining(data)
+        if remaining is not None:
+            self.queue_remaining = remaining
+        executing = _executing_node(data)
+        if executing is not None:
+            self._executing = executing
+        _route_message(data, self._get_waiter)
+
+    def _handle_frame(self, data):
+        """Route a binary image frame to its prompt, by default the running one"""
+        frame = _parse_frame(data)
+        if frame is None:
+            return
+        metadata, extension, image = frame
+        prompt_id = metadata.get("prompt_id", self._executing[0])
+        node = metadata.get("node_id", self._executing[1])
+        if prompt_id is not None:
+            self._get_waiter(prompt_id).add_frame(prompt_id, node, extension, image)
+
+    def _get_waiter(self, prompt_id):
+        with self._waiters_lock:
+            waiter = self._waiters.get(prompt_id)
+            if waiter is None:
+                waiter = self._waiters[prompt_id] = _SyncPromptWaiter()
+                if len(self._waiters) > self.MAX_UNCLAIMED_PROMPTS:
+                    self._drop_unclaimed()
+            return waiter
+
+    def _drop_unclaimed(self):
+        for prompt_id, waiter in list(self._waiters.items()):
+            if not waiter.claimed and waiter.event.is_set():
+                del self._waiters[prompt_id]
+                if len(self._waiters) <= self.MAX_UNCLAIMED_PROMPTS:
+                    break
 
     def close(self):
+        ws, self.ws = self.ws, None
+        if ws is not None:
+            try:
+                # abort() wakes the reader thread blocked in recv()
+                ws.abort()
+                ws.shutdown()
+            except Exception as e:
+                if self.debug:
+                    print(f"Error closing WebSocket: {e}")
+        if self._reader_thread is not None:
+            self._reader_thread.join(timeout=5)
+            self._reader_thread = None
+        with self._download_executor_lock:
+            executor, self._download_executor = self._download_executor, None
+        if executor is not None:
+            executor.shutdown()
         if self.session is not None:
             self.session.close()
             self.session = None
 
-    def queue_prompt(self, prompt):
-        try:
-            payload = {"prompt": prompt, "client_id": self.CLIENT_ID}
+    def queue_prompt(self, prompt, prompt_id=None):
+        """
+        Queue ``prompt`` under ``prompt_id`` (a new id by default).
+
+        Failed requests are retried according to ``retry``. Before each retry
+        the server is asked whether the prompt already arrived, so a lost
+        response never queues the same work twice.
+        """
+        if prompt_id is None:
+            prompt_id = str(uuid.uuid4())
+        payload = {
+            "prompt": prompt,
+            "client_id": self.CLIENT_ID,
+            "prompt_id": prompt_id,
+        }
+        attempted = False
+
+        def post():
+            nonlocal attempted
+            if attempted and self._is_known_prompt(prompt_id):
+                return {"prompt_id": prompt_id}
+            attempted = True
             response = self.session.post(
-                f"http://{self.SERVER_ADDRESS}/prompt", json=payload
+                f"http://{self.SERVER_ADDRESS}/prompt",
+                json=payload,
+                timeout=self.request_timeout,
             )
             response.raise_for_status()
-            result = response.json()
-            if "prompt_id" not in result:
-                raise ValueError("Server response missing prompt_id")
-            return result
+            return response.json()
+
+        try:
+            with _timed(self.metrics, "queue_prompt", prompt_id=prompt_id):
+                result = self.retry.call(post)
         except requests.RequestException as e:
             raise ConnectionError(f"Failed to queue prompt: {e}")
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON response from server: {e}")
+        if "prompt_id" not in result:
+            raise ValueError("Server response missing prompt_id")
+        return result
+
+    def _is_known_prompt(self, prompt_id):
+        """Whether the server has ``prompt_id`` queued, running or finished"""
+        response = self.session.get(
+            f"http://{self.SERVER_ADDRESS}/queue", timeout=self.request_timeout
+        )
+        response.raise_for_status()
+        if _find_in_queue(response.json(), prompt_id):
+            return True
+        response = self.session.get(
+            f"http://{self.SERVER_ADDRESS}/history/{prompt_id}",
+            timeout=self.request_timeout,
+        )
+        response.raise_for_status()
+        return prompt_id in response.json()
 
     def get_image(self, filename, subfolder, folder_type):
-        try:
-            params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+
+        def fetch():
             response = self.session.get(
-                f"http://{self.SERVER_ADDRESS}/view", params=params
+                f"http://{self.SERVER_ADDRESS}/view",
+                params=params,
+                timeout=self.request_timeout,
             )
             response.raise_for_status()
             return response.content
+
+        try:
+            with _timed(self.metrics, "get_image", filename=filename):
+                return self.retry.call(fetch)
         except requests.RequestException as e:
             raise ConnectionError(f"Failed to get image {filename}: {e}")
 
-    def get_history(self, prompt_id):
+    def stream_image(self, filename, subfolder, folder_type, write):
+        """
+        Pass ``/view`` to ``write(chunk)`` piece by piece; return the size.
+
+        Only failures before the first chunk is written are retried.
+        """
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        size = 0
+
+        def fetch():
+            nonlocal size
+            with self.session.get(
+                f"http://{self.SERVER_ADDRESS}/view",
+                params=params,
+                stream=True,
+                timeout=self.request_timeout,
+            ) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(self.DOWNLOAD_CHUNK_SIZE):
+                    write(chunk)
+                    size += len(chunk)
+                return size
+
         try:
+            with _timed(self.metrics, "get_image", filename=filename):
+                return self.retry.call(fetch, retry_if=lambda: size == 0)
+        except requests.RequestException as e:
+            raise ConnectionError(f"Failed to get image {filename}: {e}")
+
+    def get_history(self, prompt_id):
+        def fetch():
             response = self.session.get(
-                f"http://{self.SERVER_ADDRESS}/history/{prompt_id}"
+                f"http://{self.SERVER_ADDRESS}/history/{prompt_id}",
+                timeout=self.request_timeout,
             )
             response.raise_for_status()
             return response.json()
+
+        try:
+            with _timed(self.metrics, "get_history", prompt_id=prompt_id):
+                return self.retry.call(fetch)
         except requests.RequestException as e:
             raise ConnectionError(f"Failed to get history for {prompt_id}: {e}")
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON response from server: {e}")
 
-    def get_images(self, prompt):
-        result = self.queue_prompt(prompt)
-        prompt_id = result.get("prompt_id")
-        if not prompt_id:
-            raise ValueError("Failed to get prompt_id from server response")
+    def get_queue(self):
+        """Return the server's ``/queue``: its running and pending prompts"""
 
-        output_images = {}
-        output_text = {}
-        max_retries = 300  # Maximum 5 minutes wait
-        retry_count = 0
+        def fetch():
+            response = self.session.get(
+                f"http://{self.SERVER_ADDRESS}/queue", timeout=self.request_timeout
+            )
+            response.raise_for_status()
+            return response.json()
 
-        while retry_count < max_retries:
-            try:
-                history = self.get_history(prompt_id)
-                if prompt_id in history and "outputs" in history[prompt_id]:
-                    break
-                time.sleep(1)
-                retry_count += 1
-            except Exception as e:
-                if self.debug:
-                    print(f"Error getting history (retry {retry_count}): {e}")
-                if retry_count >= max_retries:
-                    raise TimeoutError(
-                        f"Timeout waiting for prompt {prompt_id} to complete"
-                    )
-                time.sleep(1)
-                retry_count += 1
+        try:
+            queue = self.retry.call(fetch)
+        except requests.RequestException as e:
+            raise ConnectionError(f"Failed to get queue: {e}")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON response from server: {e}")
+        self.queue_remaining = _queue_depth(queue)
+        return queue
+
+    def get_object_info(self, refresh=False):
+        """
+        Return the server's ``/object_info``: the inputs of every node type.
+
+        Served from ``schema_cache`` unless the cached schema is stale or
+        ``refresh`` is set, in which case it is revalidated with the server.
+        """
+        cache = self.schema_cache
+        entry = cache.get(self.SERVER_ADDRESS) if cache is not None else None
+        if entry is not None and not refresh and not cache.is_stale(entry):
+            return entry["object_info"]
+        object_info, etag = self._fetch_object_info(entry and entry["etag"])
+        if cache is None:
+            return object_info
+        if object_info is None:
+            cache.touch(self.SERVER_ADDRESS)
+            return entry["object_info"]
+        return cache.put(self.SERVER_ADDRESS, object_info, etag)["object_info"]
+
+    def _fetch_object_info(self, etag=None):
+        """Return ``(object_info, etag)``, or ``(None, etag)`` if unchanged"""
+        headers = {"If-None-Match": etag} if etag else {}
+
+        def fetch():
+            response = self.session.get(
+                f"http://{self.SERVER_ADDRESS}/object_info",
+                headers=headers,
+                timeout=self.request_timeout,
+            )
+            if response.status_code == 304:
+                return None, etag
+            response.raise_for_status()
+            return response.json(), response.headers.get("ETag")
 
-        if retry_count >= max_retries:
-            raise TimeoutError(f"Timeout waiting for prompt {prompt_id} to complete")
+        try:
+            return self.retry.call(fetch)
+        except requests.RequestException as e:
+            raise ConnectionError(f"Failed to get object info: {e}")
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON response from server: {e}")
 
-        for node_id, node_output in history[prompt_id]["outputs"].items():
-            images_output = []
-            if "images" in node_output:
-                for image in node_output["images"]:
-                    image_data = self.get_image(
-                        image["filename"], image["subfolder"], image["type"]
+    def load_schema(self, refresh=False):
+        """
+        Load the server's node schema to validate ``set_data()`` locally.
+
+        Only ``schema`` is set; use ``fetch_widget_mappings()`` to register
+        the server's widget mappings.
+        """
+        object_info = self.get_object_info(refresh)
+        self.schema = _schema_specs(self, object_info)
+        return self.schema
+
+    def fetch_widget_mappings(self, cache_path=None):
+        """
+        Register the widget mappings of every node type the server knows.
+
+        With ``cache_path``, mappings are read from that file if it exists
+        and written to it otherwise; delete it after installing node packs.
+        The workflow is then reloaded, discarding ``set_data()`` changes.
+        """
+        if cache_path is not None and os.path.exists(cache_path):
+            mappings = load_widget_mappings(cache_path)
+        else:
+            mappings = load_widget_mappings(self.get_object_info())
+            if cache_path is not None:
+                _save_widget_mappings(cache_path, mappings)
+        self.reload(force=True)
+        return mappings
+
+    def get_images(self, prompt, prompt_id=None):
+        """
+        Queue ``prompt`` and return its ``(images, text)`` outputs.
+
+        Pass the ``prompt_id`` of an earlier call that failed while waiting to
+        resume it: a prompt the server already has is awaited, not resubmitted.
+        """
+        if prompt_id is None or not self._check_known_prompt(prompt_id):
+            result = self.queue_prompt(prompt, prompt_id)
+            prompt_id = result.get("prompt_id")
+            if not prompt_id:
+                raise ValueError("Failed to get prompt_id from server response")
+        else:
+            # It may have finished long ago, its completion message with it
+            entry = self._check_history(prompt_id)
+            if entry is not None:
+                return self.download_outputs(entry["outputs"])
+
+        return self.get_outputs(prompt_id)
+
+    def _check_known_prompt(self, prompt_id):
+        try:
+            return self.retry.call(lambda: self._is_known_prompt(prompt_id))
+        except requests.RequestException as e:
+            raise ConnectionError(f"Failed to look up prompt {prompt_id}: {e}")
+
+    def wait_for_completion(self, prompt_id, timeout=None):
+        """
+        Wait until ``prompt_id`` finishes and return its history entry.
+
+        Completion is signalled by the WebSocket when one is connected; history
+        is polled with an increasing interval otherwise, or if the socket drops.
+
+        Args:
+            prompt_id: Id returned by ``queue_prompt()``
+            timeout: Seconds to wait, defaults to the client's ``timeout``
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        waiter = None
+        if self.ws is not None:
+            waiter = self._get_waiter(prompt_id)
+            waiter.claimed = True
+        delay = self.POLL_INTERVAL_MIN
+
+        try:
+            while True:
+                if waiter is not None and self.ws is not None:
+                    remaining = max(deadline - time.monotonic(), 0)
+                    if waiter.event.wait(min(remaining, self.HISTORY_CHECK_INTERVAL)):
+                        if waiter.error is not None:
+                            raise waiter.error
+                        _record_execution(self.metrics, prompt_id, waiter)
+                        # History may lag the completion message; poll from here
+                        waiter = None
+
+                entry = self._check_history(prompt_id)
+                if entry is not None:
+                    return entry
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"Timeout waiting for prompt {prompt_id} to complete"
                     )
-                    images_output.append(image_data)
-                output_images[node_id] = images_output
-            if "text" in node_output:
-                output_text[node_id] = node_output["text"]
+                if waiter is None or self.ws is None:
+                    time.sleep(min(delay, remaining))
+                    delay = min(delay * 1.5, self.POLL_INTERVAL_MAX)
+        finally:
+            with self._waiters_lock:
+                self._waiters.pop(prompt_id, None)
+
+    def _check_history(self, prompt_id):
+        """Return the history entry of a finished prompt, or None"""
+        try:
+            history = self.get_history(prompt_id)
+        except Exception as e:
+            if self.debug:
+                print(f"Error getting history for {prompt_id}: {e}")
+            return None
+        entry = history.get(prompt_id)
+        if entry is not None and "outputs" in entry:
+            return entry
+        return None
 
-        return output_images, output_text
+    def get_outputs(self, prompt_id, timeout=None, sink=None):
+        with self._waiters_lock:
+            waiter = self._waiters.get(prompt_id)
+        history = self.wait_for_completion(prompt_id, timeout)
+        images, text = self.download_outputs(history["outputs"], sink)
+        if waiter is not None:
+            _add_frames(images, waiter.frames, sink, prompt_id)
+        return images, text
+
+    def download_outputs(self, outputs, sink=None):
+        """
+        Fetch every image in a history ``outputs`` dict.
+
+        Multiple images are fetched from the client's thread pool of
+        ``download_concurrency`` workers sharing its session; images keep
+        their order within each node.
+
+        Args:
+            outputs: The ``outputs`` of a history entry
+            sink: Stream the files instead of reading them into memory. A
+                directory path, a writable file object or a callable
+                ``sink(node_id, image, chunk)``. Only directory sinks are
+                written concurrently.
+
+        Returns:
+            ``(images, text)`` dicts keyed by node id. With a sink, images
+            hold the saved paths (directory) or the image entries instead of
+            the file contents.
+        """
+        files = _output_files(outputs)
+        workers = min(self.download_concurrency, len(files))
+        if sink is not None and not _is_directory_sink(sink):
+            workers = 1
+        elif sink is not None:
+            os.makedirs(sink, exist_ok=True)
+
+        def fetch(item):
+            node_id, image = item
+            if sink is None:
+                return self.get_image(
+                    image["filename"], image["subfolder"], image["type"]
+                )
+            with _open_sink(sink, node_id, image) as write:
+                self.stream_image(
+                    image["filename"], image["subfolder"], image["type"], write
+                )
+            return _sink_result(sink, image)
+
+        if workers <= 1:
+            image_data = [fetch(item) for item in files]
+        else:
+            executor = self._get_download_executor()
+            # Each download gets a copy of this context so that its span
+            # reaches the running generate()
+            futures = [
+                executor.submit(contextvars.copy_context().run, fetch, item)
+                for item in files
+            ]
+            try:
+                image_data = [future.result() for future in futures]
+            finally:
+                # After a failure, skip the queued downloads and let the
+                # running ones finish, so none outlives this call
+                for future in futures:
+                    future.cancel()
+                wait(futures)
+        return _group_outputs(outputs, files, image_data)
+
+    def _get_download_executor(self):
+        with self._download_executor_lock:
+            if self._download_executor is None:
+                self._download_executor = ThreadPoolExecutor(
+                    max_workers=self.download_concurrency,
+                    thread_name_prefix="comfyui-download",
+                )
+            return self._download_executor
 
     def set_data(
         self,
@@ -463,85 +3231,282 @@ class ComfyUIClient:
         if key_id is None:
             return
 
+        inputs = {}
         if input_key is not None and input_value is not None:
-            self.comfyui_prompt[key_id]["inputs"][input_key] = input_value
+            inputs[input_key] = input_value
         if text is not None:
-            self.comfyui_prompt[key_id]["inputs"]["text"] = text
+            inputs["text"] = text
         if seed is not None:
-            self.comfyui_prompt[key_id]["inputs"]["seed"] = int(seed)
+            inputs["seed"] = int(seed)
         if number is not None:
-            self.comfyui_prompt[key_id]["inputs"]["Number"] = number
+            inputs["Number"] = number
         if value is not None:
-            self.comfyui_prompt[key_id]["inputs"]["value"] = value
+            inputs["value"] = value
+        if self.schema is not None:
+            # Fail before uploading anything
+            _check_inputs(
+                self.schema, self.comfyui_prompt[key_id]["class_type"], inputs
+            )
         if image is not None:
-            # Upload image to comfyui server
-            folder_name = "temp"
+            # Set image path
+            inputs["image"] = self.upload_image(image)
+
+        # Swap in an updated copy so generations running in other threads
+        # never see a node change under them
+        with self._template_lock:
+            self.template = self.template.with_prompt(
+                apply_overrides(self.comfyui_prompt, {key_id: inputs})
+            )
 
-            # Save image to byte data
-            byte_data = io.BytesIO()
-            image.save(byte_data, format="PNG")
-            byte_data.seek(0)
+        if self.debug:
+            print(f"Set data for {key} (id: {key_id}): {self.comfyui_prompt[key_id]}")
 
-            # Upload image
-            try:
+    def upload_image(self, image, format="PNG", **params):
+        """
+        Upload an image and return its path for a ``LoadImage`` input.
+
+        Args:
+            image: A PIL image, encoded image bytes or file object, or the path
+                of an image file (streamed, never read into memory at once)
+            format: Encoding used for PIL images, e.g. ``"JPEG"`` or ``"WEBP"``
+            **params: Encoder options for PIL images, e.g. ``compress_level=1``
+                for faster PNG encoding or ``quality=90``
+
+        Uploads are named after a hash of their content, so concurrent uploads
+        never collide, and identical images are only encoded and uploaded once
+        per server while they stay in ``upload_cache``.
+        """
+        if not isinstance(image, Image.Image) and not _is_path(image):
+            image = _buffer_bytes(image)
+        digest, extension = _upload_source(image, format, params)
+        cache_key = f"{self.SERVER_ADDRESS}/{digest}"
+        if self.upload_cache is not None:
+            image_path = self.upload_cache.get(cache_key)
+            if image_path is not None:
+                return image_path
+
+        if isinstance(image, Image.Image):
+            image = _encode_image(image, format, params)
+        image_path = self._send_upload(image, f"{digest[:32]}{extension}")
+        if self.upload_cache is not None:
+            self.upload_cache.put(cache_key, image_path)
+        return image_path
+
+    def _send_upload(self, image, filename):
+        """POST encoded image bytes or an image file to ``/upload/image``"""
+        url = f"http://{self.SERVER_ADDRESS}/upload/image"
+        fields = {"subfolder": "temp", "overwrite": "true"}
+
+        def post():
+            if _is_path(image):
+                boundary = uuid.uuid4().hex
                 resp = self.session.post(
-                    f"http://{self.SERVER_ADDRESS}/upload/image",
-                    files={"image": ("temp.png", byte_data)},
-                    data={"subfolder": folder_name},
+                    url,
+                    data=_multipart_stream(boundary, fields, filename, image),
+                    headers={
+                        "Content-Type": f"multipart/form-data; boundary={boundary}"
+                    },
+                    timeout=self.request_timeout,
                 )
-                resp.raise_for_status()
+            else:
+                resp = self.session.post(
+                    url,
+                    files={"image": (filename, image)},
+                    data=fields,
+                    timeout=self.request_timeout,
+                )
+            resp.raise_for_status()
+            return resp.json()
 
-                resp_json = resp.json()
-                if "name" not in resp_json or "subfolder" not in resp_json:
-                    raise ValueError("Invalid upload response: missing required fields")
+        try:
+            resp_json = self.retry.call(post)
+            if "name" not in resp_json or "subfolder" not in resp_json:
+                raise ValueError("Invalid upload response: missing required fields")
+        except requests.RequestException as e:
+            raise ConnectionError(f"Failed to upload image: {e}")
+        except Exception as e:
+            raise RuntimeError(f"Error processing image upload: {e}")
 
-                # Set image path
-                self.comfyui_prompt[key_id]["inputs"]["image"] = (
-                    resp_json.get("subfolder") + "/" + resp_json.get("name")
-                )
-            except requests.RequestException as e:
-                raise ConnectionError(f"Failed to upload image: {e}")
-            except Exception as e:
-                raise RuntimeError(f"Error processing image upload: {e}")
+        return resp_json.get("subfolder") + "/" + resp_json.get("name")
 
-        if self.debug:
-            print(f"Set data for {key} (id: {key_id}): {self.comfyui_prompt[key_id]}")
+    @property
+    def comfyui_prompt(self):
+        return self.template.prompt
+
+    @comfyui_prompt.setter
+    def comfyui_prompt(self, prompt):
+        self.template = WorkflowTemplate(prompt)
 
     def find_key_by_title(self, target_title):
-        target_title = target_title.strip()
-        for key, value in self.comfyui_prompt.items():
-            # Check class_type first
-            class_type = value.get("class_type", "").strip()
-            if class_type == target_title:
-                return key
-            # Then check title
-            title = value.get("_meta", {}).get("title", "").strip()
-            if title == target_title:
-                return key
-        if self.debug:
+        key = self.template.find(target_title)
+        if key is None and self.debug:
             print(f"Key not found: {target_title}")
-        return None
-
-    def generate(self, node_names=None) -> dict:
+        return key
+
+    def prepare_prompt(self, overrides=None):
+        """Return the prompt for one generation without touching comfyui_prompt"""
+        return apply_overrides(self.comfyui_prompt, overrides, self.find_key_by_title)
+
+    def generate(
+        self, node_names=None, overrides=None, output="pil", on_progress=None
+    ) -> dict:
+        """
+        Queue the workflow and collect the outputs of ``node_names``.
+
+        Returns a ``GenerationResult``: a dict of node name to its first image
+        (or text), with every image of a batch in ``result.images``.
+
+        Args:
+            node_names: Titles or class_types of the nodes to return
+            overrides: Per-call input changes, see ``prepare_prompt()``
+            output: How images are returned: ``"pil"`` (``PIL.Image``),
+                ``"bytes"`` (the file as served) or ``"lazy"`` (``LazyImage``,
+                decoded on first pixel access)
+            on_progress: Called with a ``ProgressEvent`` for every WebSocket
+                message about the prompt
+
+        The time spent in each phase is listed in ``result.timings``.
+        """
+        if output not in OUTPUT_MODES:
+            raise ValueError(f"output must be one of {OUTPUT_MODES}, got {output!r}")
+        # One workflow version for the whole job, even if it is reloaded meanwhile
+        template = self.template
         node_ids = {}
         if node_names is not None:
             for node_name in node_names:
-                node_id = self.find_key_by_title(node_name)
+                node_id = template.find(node_name)
                 if node_id is not None:
                     node_ids[node_id] = node_name
 
-        images, text = self.get_images(self.comfyui_prompt)
-        results = {}
-        for node_id, node_images in images.items():
-            if node_id in node_ids:
-                for image_data in node_images:
-                    image = Image.open(io.BytesIO(image_data))
-                    results[node_ids[node_id]] = image
-        for node_id, node_text in text.items():
-            if node_id in node_ids:
-                results[node_ids[node_id]] = node_text
+        prompt = apply_overrides(template.prompt, overrides, template.find)
+        if self.validate:
+            validate_prompt(prompt, self.schema)
+        timings: List[Span] = []
+        token = _current_timings.set(timings)
+        try:
+            prompt_id, images, text, cached = self._run(prompt, on_progress)
+            with _timed(self.metrics, "decode", output=output):
+                result = GenerationResult.build(
+                    prompt_id, node_ids, images, text, output
+                )
+        finally:
+            _current_timings.reset(token)
+        result.cached = cached
+        result.timings = timings
+        return result
+
+    def _run(self, prompt, on_progress):
+        """Return ``(prompt_id, images, text, cached)`` of ``prompt``"""
+        key = None
+        if self.result_cache is not None:
+            key = prompt_hash(prompt)
+            hit = self.result_cache.get(key)
+            if hit is not None:
+                return hit + (True,)
+        prompt_id = self._queue_tracked(prompt, on_progress)
+        images, text = self.get_outputs(prompt_id)
+        if key is not None:
+            self.result_cache.put(key, prompt_id, images, text)
+        return prompt_id, images, text, False
+
+    def _queue_tracked(self, prompt, on_progress):
+        """
+        Queue ``prompt`` and return its id, following it with ``on_progress``
+        and collecting the image frames of its WebSocket output nodes and
+        the times it waited and executed.
+
+        The callback runs on the WebSocket reader thread; without a WebSocket
+        it is never called.
+        """
+        output_nodes = _websocket_output_nodes(prompt)
+        if on_progress is None and not output_nodes:
+            prompt_id = (self.queue_prompt(prompt))["prompt_id"]
+            # Messages may already have arrived, making the wait negative; it
+            # is reported as zero
+            self._get_waiter(prompt_id).queued = time.monotonic()
+            return prompt_id
+        prompt_id = str(uuid.uuid4())
+        # Listen before queueing so that no early message is missed
+        waiter = self._get_waiter(prompt_id)
+        waiter.output_nodes = output_nodes
+        if on_progress is not None:
+            waiter.listeners.append(on_progress)
+        try:
+            queued_id = self.queue_prompt(prompt, prompt_id)["prompt_id"]
+        except BaseException:
+            with self._waiters_lock:
+                self._waiters.pop(prompt_id, None)
+            raise
+        if queued_id != prompt_id:
+            self._rekey_waiter(prompt_id, queued_id, waiter)
+        waiter.queued = time.monotonic()
+        return queued_id
+
+    def _rekey_waiter(self, prompt_id, queued_id, waiter):
+        """
+        Move ``waiter`` from ``prompt_id`` to ``queued_id``, the id a server
+        that ignores the requested one gave the prompt.
+        """
+        with self._waiters_lock:
+            self._waiters.pop(prompt_id, None)
+            early = self._waiters.get(queued_id)
+            if early is not None:
+                waiter.adopt(early)
+            self._waiters[queued_id] = waiter
+
+    def generate_many(
+        self,
+        jobs,
+        node_names=None,
+        max_in_flight=4,
+        return_exceptions=False,
+        output="pil",
+    ):
+        """
+        Run ``generate()`` for many override sets, keeping the server busy.
+
+        Up to ``max_in_flight`` prompts are queued at once from a thread pool;
+        results are yielded as ``(index, result)`` in completion order, where
+        ``index`` is the position of the job in ``jobs``.
+
+        Args:
+            jobs: Iterable of overrides dicts (see ``generate()``)
+            node_names: Output node names passed to every ``generate()`` call
+            max_in_flight: Maximum number of prompts queued at the same time
+            return_exceptions: Yield a failed job's exception as its result
+                instead of raising it
+            output: Image output mode passed to ``generate()``
+        """
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        jobs = iter(enumerate(jobs))
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+
+            def submit():
+                for index, overrides in jobs:
+                    future = executor.submit(
+                        self.generate, node_names, overrides, output
+                    )
+                    pending[future] = index
+                    if len(pending) >= max_in_flight:
+                        break
 
-        return results
+            try:
+                submit()
+                while pending:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = pending.pop(future)
+                        if future.exception() is not None and not return_exceptions:
+                            raise future.exception()
+                        yield index, future.exception() or future.result()
+                    submit()
+            finally:
+                for future in pending:
+                    future.cancel()
 
 
 def main():
@@ -595,6 +3560,4 @@ if __name__ == "__main__":
     main()
 
     # async
-    import asyncio
-
     asyncio.run(main_async())
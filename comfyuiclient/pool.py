@@ -0,0 +1,373 @@
+"""Load balancing across several ComfyUI servers"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .client import ComfyUIClient, ComfyUIClientAsync
+
+
+class _Backend:
+    """One server of a pool and the prompts the pool has running on it"""
+
+    def __init__(self, client):
+        self.client = client
+        self.in_flight = 0
+        # time.monotonic() after which a failed server is probed again,
+        # None while it is healthy
+        self.down_until = None
+
+    @property
+    def load(self):
+        # The server's own count includes other clients' prompts, but only
+        # catches up with ours on its next status message
+        return max(self.in_flight, self.client.queue_remaining or 0)
+
+    def mark_down(self, retry_after):
+        self.down_until = time.monotonic() + retry_after
+
+
+def _least_loaded(backends, exclude):
+    healthy = [b for b in backends if b.down_until is None and b not in exclude]
+    if not healthy:
+        return None
+    return min(healthy, key=lambda b: (b.load, b.in_flight))
+
+
+def _expired(backends, retry_after):
+    """
+    Claim the failed backends that are due for another connection attempt.
+
+    Reconnecting closes the client, so a backend still running generations
+    waits until they have finished or failed.
+    """
+    now = time.monotonic()
+    expired = [
+        b
+        for b in backends
+        if b.down_until is not None and b.down_until <= now and not b.in_flight
+    ]
+    for backend in expired:
+        # Concurrent callers skip the server while it is being probed
+        backend.mark_down(retry_after)
+    return expired
+
+
+def _is_server_down(error):
+    """
+    Whether a ``ConnectionError`` from a client means the server is unusable.
+
+    A 4xx response (e.g. a prompt the server rejected) would fail the same way
+    on every server, so it is not a reason to fail over.
+    """
+    cause = error.__cause__ or error.__context__
+    status = getattr(cause, "status", None)  # aiohttp
+    response = getattr(cause, "response", None)  # requests
+    if status is None and response is not None:
+        status = response.status_code
+    return status is None or status >= 500
+
+
+class ComfyUIPoolAsync:
+    """
+    Dispatch generations across several ComfyUI servers.
+
+    Every ``generate()`` goes to the healthy server with the fewest running
+    and pending prompts, taken from the larger of the pool's own count and the
+    queue depth the server reports over its WebSocket. A server that cannot be
+    reached is taken out of rotation, the generation is retried on the next
+    server, and the failed server is reconnected after ``retry_after`` seconds.
+    """
+
+    # Default generate_many() concurrency for each server in the pool
+    MAX_IN_FLIGHT_PER_SERVER = 4
+
+    def __init__(self, servers, prompt_file, debug=False, retry_after=30.0, **kwargs):
+        """
+        Args:
+            servers: Server addresses, e.g. ``["gpu0:8188", "gpu1:8188"]``
+            prompt_file: Workflow loaded by the client of every server
+            debug: Print connection failures and failovers
+            retry_after: Seconds before a failed server is tried again
+            **kwargs: Options for each ``ComfyUIClientAsync``, e.g. ``timeout``
+        """
+        if not servers:
+            raise ValueError("At least one server is required")
+        self.debug = debug
+        self.retry_after = retry_after
+        self.backends = [
+            _Backend(ComfyUIClientAsync(server, prompt_file, debug=debug, **kwargs))
+            for server in servers
+        ]
+
+    @property
+    def clients(self):
+        return [backend.client for backend in self.backends]
+
+    async def connect(self):
+        """Connect to every server; fails only if none can be reached"""
+        for backend in self.backends:
+            backend.mark_down(self.retry_after)
+        await asyncio.gather(*(self._connect_backend(b) for b in self.backends))
+        if all(backend.down_until is not None for backend in self.backends):
+            raise ConnectionError("Failed to connect to any ComfyUI server")
+
+    async def _connect_backend(self, backend):
+        client = backend.client
+        try:
+            await client.close()
+            await client.connect()
+            await client.get_queue()
+        except Exception as e:
+            if self.debug:
+                print(f"Server {client.SERVER_ADDRESS} unavailable: {e}")
+            return
+        backend.down_until = None
+
+    async def close(self):
+        await asyncio.gather(*(client.close() for client in self.clients))
+
+    async def _acquire(self, tried):
+        expired = _expired(self.backends, self.retry_after)
+        if expired:
+            await asyncio.gather(*(self._connect_backend(b) for b in expired))
+        return _least_loaded(self.backends, tried)
+
+    async def generate(self, node_names=None, overrides=None, output="pil"):
+        """
+        Run ``generate()`` on the least loaded server.
+
+        Takes the same arguments as ``ComfyUIClientAsync.generate()``. Raises
+        ``ConnectionError`` only once every healthy server has failed.
+        """
+        tried = set()
+        error = None
+        while True:
+            backend = await self._acquire(tried)
+            if backend is None:
+                raise ConnectionError(
+                    f"No ComfyUI server available (last error: {error})"
+                )
+            tried.add(backend)
+            backend.in_flight += 1
+            try:
+                return await backend.client.generate(node_names, overrides, output)
+            except ConnectionError as e:
+                if not _is_server_down(e):
+                    raise
+                error = e
+                backend.mark_down(self.retry_after)
+                if self.debug:
+                    print(f"Server {backend.client.SERVER_ADDRESS} failed: {e}")
+            finally:
+                backend.in_flight -= 1
+
+    async def generate_many(
+        self,
+        jobs,
+        node_names=None,
+        max_in_flight=None,
+        return_exceptions=False,
+        output="pil",
+    ):
+        """
+        Run ``generate()`` for many override sets across the pool.
+
+        Works like ``ComfyUIClientAsync.generate_many()``; ``max_in_flight``
+        defaults to ``MAX_IN_FLIGHT_PER_SERVER`` per server.
+        """
+        if max_in_flight is None:
+            max_in_flight = self.MAX_IN_FLIGHT_PER_SERVER * len(self.backends)
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        jobs = iter(enumerate(jobs))
+        pending = {}
+
+        def submit():
+            for index, overrides in jobs:
+                task = asyncio.ensure_future(
+                    self.generate(node_names, overrides, output)
+                )
+                pending[task] = index
+                if len(pending) >= max_in_flight:
+                    break
+
+        try:
+            submit()
+            while pending:
+                done, _ = await asyncio.wait(
+                    list(pending), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    index = pending.pop(task)
+                    if task.exception() is not None and not return_exceptions:
+                        raise task.exception()
+                    yield index, task.exception() or task.result()
+                submit()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+class ComfyUIPool:
+    """
+    Dispatch generations across several ComfyUI servers.
+
+    The thread-safe counterpart of ``ComfyUIPoolAsync``, built on
+    ``ComfyUIClient``. Without ``websocket-client`` the servers' queue depths
+    are only known from ``refresh()``, so the pool balances on its own count.
+    """
+
+    MAX_IN_FLIGHT_PER_SERVER = 4
+
+    def __init__(self, servers, prompt_file, debug=False, retry_after=30.0, **kwargs):
+        """
+        Args:
+            servers: Server addresses, e.g. ``["gpu0:8188", "gpu1:8188"]``
+            prompt_file: Workflow loaded by the client of every server
+            debug: Print connection failures and failovers
+            retry_after: Seconds before a failed server is tried again
+            **kwargs: Options for each ``ComfyUIClient``, e.g. ``timeout``
+        """
+        if not servers:
+            raise ValueError("At least one server is required")
+        self.debug = debug
+        self.retry_after = retry_after
+        self.backends = [
+            _Backend(ComfyUIClient(server, prompt_file, debug=debug, **kwargs))
+            for server in servers
+        ]
+        self._lock = threading.Lock()
+
+    @property
+    def clients(self):
+        return [backend.client for backend in self.backends]
+
+    def connect(self):
+        """Connect to every server; fails only if none can be reached"""
+        with self._lock:
+            for backend in self.backends:
+                backend.mark_down(self.retry_after)
+        for backend in self.backends:
+            self._connect_backend(backend)
+        if all(backend.down_until is not None for backend in self.backends):
+            raise ConnectionError("Failed to connect to any ComfyUI server")
+
+    def _connect_backend(self, backend):
+        client = backend.client
+        try:
+            client.close()
+            client.connect()
+            client.get_queue()
+        except Exception as e:
+            if self.debug:
+                print(f"Server {client.SERVER_ADDRESS} unavailable: {e}")
+            return
+        with self._lock:
+            backend.down_until = None
+
+    def refresh(self):
+        """Update the queue depth of every healthy server from ``/queue``"""
+        for backend in self.backends:
+            if backend.down_until is None:
+                try:
+                    backend.client.get_queue()
+                except ConnectionError as e:
+                    with self._lock:
+                        backend.mark_down(self.retry_after)
+                    if self.debug:
+                        print(f"Server {backend.client.SERVER_ADDRESS} failed: {e}")
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+
+    def _acquire(self, tried):
+        with self._lock:
+            expired = _expired(self.backends, self.retry_after)
+        for backend in expired:
+            self._connect_backend(backend)
+        with self._lock:
+            backend = _least_loaded(self.backends, tried)
+            if backend is not None:
+                backend.in_flight += 1
+            return backend
+
+    def generate(self, node_names=None, overrides=None, output="pil"):
+        """
+        Run ``generate()`` on the least loaded server.
+
+        Takes the same arguments as ``ComfyUIClient.generate()``. Raises
+        ``ConnectionError`` only once every healthy server has failed.
+        """
+        tried = set()
+        error = None
+        while True:
+            backend = self._acquire(tried)
+            if backend is None:
+                raise ConnectionError(
+                    f"No ComfyUI server available (last error: {error})"
+                )
+            tried.add(backend)
+            try:
+                return backend.client.generate(node_names, overrides, output)
+            except ConnectionError as e:
+                if not _is_server_down(e):
+                    raise
+                error = e
+                with self._lock:
+                    backend.mark_down(self.retry_after)
+                if self.debug:
+                    print(f"Server {backend.client.SERVER_ADDRESS} failed: {e}")
+            finally:
+                with self._lock:
+                    backend.in_flight -= 1
+
+    def generate_many(
+        self,
+        jobs,
+        node_names=None,
+        max_in_flight=None,
+        return_exceptions=False,
+        output="pil",
+    ):
+        """
+        Run ``generate()`` for many override sets across the pool.
+
+        Works like ``ComfyUIClient.generate_many()``; ``max_in_flight``
+        defaults to ``MAX_IN_FLIGHT_PER_SERVER`` per server.
+        """
+        if max_in_flight is None:
+            max_in_flight = self.MAX_IN_FLIGHT_PER_SERVER * len(self.backends)
+        if max_in_flight < 1:
+            raise ValueError("max_in_flight must be at least 1")
+
+        jobs = iter(enumerate(jobs))
+        pending = {}
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+
+            def submit():
+                for index, overrides in jobs:
+                    future = executor.submit(
+                        self.generate, node_names, overrides, output
+                    )
+                    pending[future] = index
+                    if len(pending) >= max_in_flight:
+                        break
+
+            try:
+                submit()
+                while pending:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = pending.pop(future)
+                        if future.exception() is not None and not return_exceptions:
+                            raise future.exception()
+                        yield index, future.exception() or future.result()
+                    submit()
+            finally:
+                for future in pending:
+                    future.cancel()
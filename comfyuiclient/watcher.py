@@ -0,0 +1,96 @@
+"""Hot reloading of workflow files for live clients"""
+
+import os
+import threading
+import weakref
+
+
+class WorkflowWatcher:
+    """
+    Reload the workflow of every watched client when its file changes.
+
+    A background thread checks the files every ``interval`` seconds by stat,
+    so it works on any filesystem without extra dependencies. Changed files are
+    parsed once through the clients' shared ``WorkflowCache`` and swapped into
+    each client in a single assignment: a generation always runs entirely on
+    the old or entirely on the new workflow. Reloading discards ``set_data()``
+    changes, like ``reload(force=True)``.
+
+    Clients are held by weak references and drop out once garbage collected.
+    Replace workflow files atomically (write a temporary file, then rename)
+    so a half-written file is never loaded; a file that fails to parse is
+    retried on the next check while clients keep the previous workflow.
+
+    Usage:
+        watcher = WorkflowWatcher(interval=1.0)
+        watcher.watch(client)
+        watcher.start()
+        ...
+        watcher.stop()
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._clients = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def watch(self, *clients):
+        """Reload these clients' workflows when their files change"""
+        with self._lock:
+            for client in clients:
+                self._clients.add(client)
+
+    def unwatch(self, *clients):
+        with self._lock:
+            for client in clients:
+                self._clients.discard(client)
+
+    def check(self):
+        """Reload every watched client whose workflow file changed"""
+        with self._lock:
+            clients = list(self._clients)
+        stamps = {}
+        for client in clients:
+            path = os.path.abspath(client.PROMPT_FILE)
+            if path not in stamps:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Missing while being replaced; try again next time
+                    stamps[path] = None
+                    continue
+                stamps[path] = (stat.st_mtime_ns, stat.st_size)
+            if stamps[path] is not None and stamps[path] != client._workflow_stamp:
+                client.reload()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="comfyui-workflow-watcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"Error checking workflow files: {e}")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -11,7 +11,7 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/sugarkwork/Comfyui_api_client",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks*"]),
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
@@ -30,6 +30,10 @@ setup(
         "aiohttp",
         "pillow",
     ],
+    extras_require={
+        "websocket": ["websocket-client"],
+        "otel": ["opentelemetry-api"],
+    },
     keywords="comfyui api client stable-diffusion",
     project_urls={
         "Bug Reports": "https://github.com/sugarkwork/Comfyui_api_client/issues",
@@ -0,0 +1,41 @@
+"""Shared test helpers"""
+
+import requests
+
+
+class FakeResponse:
+    """A requests.Response stand-in"""
+
+    def __init__(self, payload=None, status=200, content=b"", headers=None):
+        self.payload = payload
+        self.status_code = status
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error", response=self)
+
+    def json(self):
+        return self.payload
+
+
+class FakeSession:
+    """
+    A requests.Session stand-in that records ``(method, url, kwargs)`` in
+    ``requests``; subclasses answer them in ``respond()``.
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        self.requests.append(("GET", url, kwargs))
+        return self.respond("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        self.requests.append(("POST", url, kwargs))
+        return self.respond("POST", url, **kwargs)
+
+    def respond(self, method, url, **kwargs):
+        return FakeResponse({})
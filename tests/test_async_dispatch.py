@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""Test routing of WebSocket messages to concurrent prompts in ComfyUIClientAsync"""
+
+import asyncio
+import json
+import os
+
+import aiohttp
+import pytest
+
+from comfyuiclient import ComfyUIClientAsync, RetryPolicy
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+
+class FakeMessage:
+    def __init__(self, msg_type, data=None):
+        self.type = msg_type
+        self.data = data
+
+
+class FakeWebSocket:
+    """Stands in for aiohttp's ClientWebSocketResponse"""
+
+    def __init__(self):
+        self.messages = asyncio.Queue()
+
+    def send(self, msg_type, **data):
+        text = json.dumps({"type": msg_type, "data": data})
+        self.messages.put_nowait(FakeMessage(aiohttp.WSMsgType.TEXT, text))
+
+    def drop(self):
+        self.messages.put_nowait(FakeMessage(aiohttp.WSMsgType.CLOSED))
+
+    async def receive(self):
+        return await self.messages.get()
+
+    async def close(self):
+        pass
+
+
+async def make_client(**kwargs):
+    client = ComfyUIClientAsync("localhost:8188", WORKFLOW_API, **kwargs)
+    client.ws = FakeWebSocket()
+    client._reader_task = asyncio.ensure_future(client._read_messages())
+    return client
+
+
+def test_concurrent_prompts_complete_out_of_order():
+    async def run():
+        client = await make_client()
+        waits = [
+            asyncio.ensure_future(client.wait_for_completion(prompt_id, timeout=1))
+            for prompt_id in ("a", "b", "c")
+        ]
+        await asyncio.sleep(0)
+        for prompt_id in ("c", "a", "b"):
+            client.ws.send("progress", value=1, max=2, prompt_id=prompt_id)
+            client.ws.send("executing", node=None, prompt_id=prompt_id)
+        await asyncio.gather(*waits)
+        assert not client._waiters
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_completion_before_wait_is_not_lost():
+    async def run():
+        client = await make_client()
+        client.ws.send("executing", node=None, prompt_id="early")
+        await asyncio.sleep(0.01)
+        await client.wait_for_completion("early", timeout=1)
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_execution_error_raises_for_that_prompt_only():
+    async def run():
+        client = await make_client()
+        bad = asyncio.ensure_future(client.wait_for_completion("bad", timeout=1))
+        good = asyncio.ensure_future(client.wait_for_completion("good", timeout=1))
+        await asyncio.sleep(0)
+        client.ws.send(
+            "execution_error", prompt_id="bad", node_id="3", exception_message="OOM"
+        )
+        client.ws.send("executing", node=None, prompt_id="good")
+        with pytest.raises(RuntimeError, match="OOM"):
+            await bad
+        await good
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_closed_socket_fails_pending_prompts():
+    async def run():
+        client = await make_client(reconnect_attempts=0)
+        pending = asyncio.ensure_future(client.wait_for_completion("p", timeout=1))
+        await asyncio.sleep(0)
+        client.ws.drop()
+        with pytest.raises(ConnectionError):
+            await pending
+        with pytest.raises(ConnectionError):
+            await client.wait_for_completion("later")
+        await client.close()
+
+    asyncio.run(run())
+
+
+class FakeSession:
+    """Hands out new sockets and serves history for reconnect tests"""
+
+    def __init__(self, history, failures=0):
+        self.history = history
+        self.failures = failures
+        self.connects = []
+
+    async def ws_connect(self, url, heartbeat=None):
+        self.connects.append(url)
+        if self.failures:
+            self.failures -= 1
+            raise aiohttp.ClientConnectionError("refused")
+        return FakeWebSocket()
+
+    async def close(self):
+        pass
+
+
+def test_dropped_socket_reconnects_and_reconciles():
+    async def run():
+        client = await make_client(retry=RetryPolicy(backoff=0))
+        client.session = FakeSession({"done": {"outputs": {}}}, failures=2)
+
+        async def get_history(prompt_id):
+            return {k: v for k, v in client.session.history.items() if k == prompt_id}
+
+        client.get_history = get_history
+        done = asyncio.ensure_future(client.wait_for_completion("done", timeout=1))
+        running = asyncio.ensure_future(client.wait_for_completion("run", timeout=1))
+        await asyncio.sleep(0)
+
+        client.ws.drop()
+        # "done" finished while disconnected and is settled from history
+        await done
+        assert len(client.session.connects) == 3
+        assert client.session.connects[-1].endswith(client.CLIENT_ID)
+
+        # "run" is still running; the new socket delivers its completion
+        client.ws.send("executing", node=None, prompt_id="run")
+        await running
+        await client.close()
+
+    asyncio.run(run())
+
+
+def test_gives_up_after_reconnect_attempts():
+    async def run():
+        client = await make_client(retry=RetryPolicy(backoff=0), reconnect_attempts=2)
+        client.session = FakeSession({}, failures=5)
+        pending = asyncio.ensure_future(client.wait_for_completion("p", timeout=1))
+        await asyncio.sleep(0)
+
+        client.ws.drop()
+        with pytest.raises(ConnectionError):
+            await pending
+        assert len(client.session.connects) == 2
+        await client.close()
+
+    asyncio.run(run())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Smoke test of the benchmark harness and its fake ComfyUI server"""
+
+import json
+
+from benchmarks import run
+from benchmarks.fake_server import FakeComfyUI
+from comfyuiclient import ComfyUIClient
+
+
+def test_fake_server_serves_a_generation():
+    with FakeComfyUI(delay=0.01, image_size=(16, 16), batch=2) as server:
+        client = ComfyUIClient(server.address, run.WORKFLOW_API)
+        client.connect()
+        try:
+            result = client.generate(["Result Image"], output="bytes")
+        finally:
+            client.close()
+
+    assert result["Result Image"] == server.image
+    assert len(result.images["Result Image"]) == 2
+    assert server.requests["/prompt"] == 1
+    assert server.requests["/view"] == 2
+
+
+def test_run_reports_every_scenario(tmp_path, capsys):
+    path = str(tmp_path / "results.json")
+    argv = ["--jobs", "3", "--convert-jobs", "5", "--delay", "0"]
+    argv += ["--image-size", "16x16", "--json", path]
+
+    assert run.main(argv) == 0
+
+    with open(path, encoding="utf-8") as f:
+        results = json.load(f)["results"]
+    assert [r["scenario"] for r in results] == ["sync", "async", "convert"]
+    assert all(r["jobs_per_sec"] > 0 and r["p99_ms"] >= r["p50_ms"] for r in results)
+    assert "execution" in results[0]["phases_ms"]
+    assert "jobs/s" in capsys.readouterr().out
+
+
+def test_regressions_against_a_baseline():
+    baseline = {"results": [{"scenario": "sync", "jobs_per_sec": 100.0, "p99_ms": 10}]}
+    current = [
+        {"scenario": "sync", "jobs_per_sec": 70.0, "p99_ms": 11},
+        {"scenario": "convert", "jobs_per_sec": 1.0, "p99_ms": 1},
+    ]
+
+    assert run.regressions(current, baseline, 0.2) == [
+        "sync: 70.0 jobs/s, baseline 100.0"
+    ]
+    assert run.regressions(current, baseline, 0.5) == []
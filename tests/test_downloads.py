@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Test fetching of output images"""
+
+import asyncio
+import io
+import os
+import threading
+import time
+
+import pytest
+
+from comfyuiclient import ComfyUIClient, ComfyUIClientAsync
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+OUTPUTS = {
+    "9": {
+        "images": [
+            {"filename": f"batch_{i}.png", "subfolder": "", "type": "output"}
+            for i in range(6)
+        ]
+    },
+    "10": {"images": []},
+    "12": {"text": ["caption"]},
+}
+
+EXPECTED = {"9": [f"batch_{i}.png".encode() for i in range(6)], "10": []}
+
+
+def test_sync_downloads_keep_order():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API, download_concurrency=3)
+
+    def fake_get_image(filename, subfolder, folder_type):
+        # Later images finish first
+        time.sleep(0.01 * (6 - int(filename[6])))
+        return filename.encode()
+
+    client.get_image = fake_get_image
+
+    images, text = client.download_outputs(OUTPUTS)
+
+    assert images == EXPECTED
+    assert text == {"12": ["caption"]}
+
+
+def test_sync_downloads_share_one_pool_until_close():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API, download_concurrency=2)
+    threads = set()
+
+    def fake_get_image(filename, subfolder, folder_type):
+        threads.add(threading.current_thread().name)
+        time.sleep(0.001)
+        return filename.encode()
+
+    client.get_image = fake_get_image
+
+    for _ in range(5):
+        assert client.download_outputs(OUTPUTS)[0] == EXPECTED
+    executor = client._download_executor
+
+    assert len(threads) <= 2
+    assert all(name.startswith("comfyui-download") for name in threads)
+    client.close()
+    assert client._download_executor is None
+    with pytest.raises(RuntimeError):
+        executor.submit(print)
+
+
+def test_async_downloads_keep_order_and_concurrency_limit():
+    async def run():
+        client = ComfyUIClientAsync(
+            "localhost:8188", WORKFLOW_API, download_concurrency=2
+        )
+        state = {"running": 0, "peak": 0}
+
+        async def fake_get_image(filename, subfolder, folder_type):
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+            await asyncio.sleep(0.01 * (6 - int(filename[6])))
+            state["running"] -= 1
+            return filename.encode()
+
+        client.get_image = fake_get_image
+
+        images, text = await client.download_outputs(OUTPUTS)
+
+        assert images == EXPECTED
+        assert text == {"12": ["caption"]}
+        assert state["peak"] == 2
+
+    asyncio.run(run())
+
+
+def fake_stream_image(filename, subfolder, folder_type, write):
+    data = filename.encode()
+    for i in range(0, len(data), 4):
+        write(data[i : i + 4])
+    return len(data)
+
+
+def test_sync_stream_to_directory(tmp_path):
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+    client.stream_image = fake_stream_image
+
+    images, text = client.download_outputs(OUTPUTS, sink=str(tmp_path / "out"))
+
+    assert [os.path.basename(path) for path in images["9"]] == [
+        f"batch_{i}.png" for i in range(6)
+    ]
+    for path in images["9"]:
+        with open(path, "rb") as f:
+            assert f.read() == os.path.basename(path).encode()
+    assert not [name for name in os.listdir(tmp_path / "out") if name.endswith(".part")]
+
+
+def test_same_names_in_different_subfolders_stay_apart(tmp_path):
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+
+    def stream_image(filename, subfolder, folder_type, write):
+        write(f"{subfolder}/{filename}".encode())
+
+    client.stream_image = stream_image
+    outputs = {
+        "9": {"images": [{"filename": "a.png", "subfolder": "", "type": "output"}]},
+        "12": {
+            "images": [
+                {"filename": "a.png", "subfolder": "upscaled", "type": "output"},
+                {"filename": "b.png", "subfolder": "../..", "type": "output"},
+            ]
+        },
+    }
+
+    images, _ = client.download_outputs(outputs, sink=str(tmp_path))
+
+    assert images == {
+        "9": [str(tmp_path / "a.png")],
+        "12": [str(tmp_path / "upscaled" / "a.png"), str(tmp_path / "b.png")],
+    }
+    with open(images["9"][0], "rb") as f:
+        assert f.read() == b"/a.png"
+    with open(images["12"][0], "rb") as f:
+        assert f.read() == b"upscaled/a.png"
+
+
+def test_sync_stream_to_file_and_callback():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+    client.stream_image = fake_stream_image
+
+    buffer = io.BytesIO()
+    images, _ = client.download_outputs(OUTPUTS, sink=buffer)
+    assert buffer.getvalue() == b"".join(EXPECTED["9"])
+    assert images["9"] == OUTPUTS["9"]["images"]
+
+    chunks = []
+    client.download_outputs(OUTPUTS, sink=lambda *args: chunks.append(args))
+    assert b"".join(chunk for _, _, chunk in chunks) == b"".join(EXPECTED["9"])
+    assert {node_id for node_id, _, _ in chunks} == {"9"}
+
+
+def test_failed_stream_leaves_no_partial_file(tmp_path):
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+
+    def broken_stream(filename, subfolder, folder_type, write):
+        write(b"half")
+        if filename != "batch_0.png":
+            # Still writing when the first download fails
+            time.sleep(0.05)
+        raise ConnectionError("dropped")
+
+    client.stream_image = broken_stream
+
+    with pytest.raises(ConnectionError):
+        client.download_outputs(OUTPUTS, sink=str(tmp_path))
+    assert os.listdir(tmp_path) == []
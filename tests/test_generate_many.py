@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Test batch submission with bounded concurrency"""
+
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from comfyuiclient import ComfyUIClient, ComfyUIClientAsync
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+
+def test_sync_generate_many_bounds_concurrency():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+    lock = threading.Lock()
+    state = {"running": 0, "peak": 0}
+
+    def fake_generate(node_names=None, overrides=None, output="pil"):
+        with lock:
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+        time.sleep(0.01 * (5 - overrides["KSampler"]["seed"] % 5))
+        with lock:
+            state["running"] -= 1
+        return overrides["KSampler"]["seed"]
+
+    client.generate = fake_generate
+    jobs = [{"KSampler": {"seed": i}} for i in range(12)]
+
+    results = dict(client.generate_many(jobs, max_in_flight=3))
+
+    assert results == {i: i for i in range(12)}
+    assert state["peak"] <= 3
+
+
+def test_sync_generate_many_errors():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+
+    def fake_generate(node_names=None, overrides=None, output="pil"):
+        if overrides["fail"]:
+            raise ConnectionError("boom")
+        return "ok"
+
+    client.generate = fake_generate
+    jobs = [{"fail": False}, {"fail": True}]
+
+    results = dict(client.generate_many(jobs, return_exceptions=True))
+    assert results[0] == "ok"
+    assert isinstance(results[1], ConnectionError)
+
+    with pytest.raises(ConnectionError):
+        list(client.generate_many(jobs))
+
+
+def test_async_generate_many_yields_in_completion_order():
+    async def run():
+        client = ComfyUIClientAsync("localhost:8188", WORKFLOW_API)
+        state = {"running": 0, "peak": 0}
+
+        async def fake_generate(node_names=None, overrides=None, output="pil"):
+            state["running"] += 1
+            state["peak"] = max(state["peak"], state["running"])
+            await asyncio.sleep(overrides["delay"])
+            state["running"] -= 1
+            return overrides["delay"]
+
+        client.generate = fake_generate
+        jobs = [{"delay": 0.05}, {"delay": 0.01}, {"delay": 0.03}, {"delay": 0.0}]
+
+        order = [
+            index async for index, _ in client.generate_many(jobs, max_in_flight=2)
+        ]
+
+        assert sorted(order) == [0, 1, 2, 3]
+        assert order[0] == 1
+        assert state["peak"] == 2
+
+    asyncio.run(run())
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Test the structured result returned by generate()"""
+
+import os
+
+from comfyuiclient import ComfyUIClient, GenerationResult
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+
+def make_client(images, text=None):
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+    client.queue_prompt = lambda prompt: {"prompt_id": "p1"}
+    client.get_outputs = lambda prompt_id: (images, text or {})
+    return client
+
+
+def test_batch_keeps_every_image():
+    result_id = ComfyUIClient("localhost:8188", WORKFLOW_API).find_key_by_title(
+        "Result Image"
+    )
+    client = make_client({result_id: [b"first", b"second", b"third"]})
+
+    result = client.generate(["Result Image"], output="bytes")
+
+    assert isinstance(result, GenerationResult)
+    assert result.prompt_id == "p1"
+    assert result.images["Result Image"] == [b"first", b"second", b"third"]
+    assert result["Result Image"] == b"first"
+    assert list(result.items()) == [("Result Image", b"first")]
+
+
+def test_unrequested_nodes_and_text():
+    client = make_client({"99": [b"other"]}, {"7": ["caption"]})
+    text_title = client.comfyui_prompt["7"]["_meta"]["title"]
+
+    result = client.generate([text_title], output="bytes")
+
+    assert result == {text_title: ["caption"]}
+    assert result.text == {text_title: ["caption"]}
+    assert result.images == {}
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""Test LazyImage outputs"""
+
+import io
+
+from PIL import Image
+
+from comfyuiclient import LazyImage
+
+
+def make_png():
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 4), (255, 0, 0)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def test_decodes_only_on_access():
+    image = LazyImage(make_png())
+    assert image._image is None
+
+    assert image.size == (8, 4)
+    assert image.getpixel((0, 0)) == (255, 0, 0)
+    assert image._image is not None
+
+
+def test_save_same_format_writes_original_bytes(tmp_path):
+    data = make_png()
+    image = LazyImage(data)
+
+    image.save(tmp_path / "out.png")
+    buffer = io.BytesIO()
+    image.save(buffer)
+
+    assert (tmp_path / "out.png").read_bytes() == data
+    assert buffer.getvalue() == data
+
+
+def test_save_other_format_reencodes(tmp_path):
+    image = LazyImage(make_png())
+
+    image.save(tmp_path / "out.jpg")
+
+    with Image.open(tmp_path / "out.jpg") as saved:
+        assert saved.format == "JPEG"
+        assert saved.size == (8, 4)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Test load balancing and failover in ComfyUIPool"""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+
+from comfyuiclient import ComfyUIPool, ComfyUIPoolAsync
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+SERVERS = ["gpu0:8188", "gpu1:8188", "gpu2:8188"]
+
+
+def make_pool(**kwargs):
+    pool = ComfyUIPool(SERVERS, WORKFLOW_API, **kwargs)
+    calls = []
+    for client in pool.clients:
+
+        def generate(node_names=None, overrides=None, output="pil", client=client):
+            calls.append(client.SERVER_ADDRESS)
+            time.sleep(0.02)
+            return client.SERVER_ADDRESS
+
+        client.generate = generate
+        client.connect = lambda: None
+        client.get_queue = lambda: {}
+    return pool, calls
+
+
+def test_dispatch_prefers_least_loaded_server():
+    pool, calls = make_pool()
+    pool.clients[0].queue_remaining = 5
+
+    results = dict(pool.generate_many([{}] * 8, max_in_flight=4))
+
+    assert len(results) == 8
+    assert "gpu0:8188" not in calls
+    assert {calls.count("gpu1:8188"), calls.count("gpu2:8188")} == {4}
+
+
+def test_failover_and_reconnect():
+    pool, calls = make_pool(retry_after=0.05)
+    broken = pool.clients[0]
+
+    def fail(node_names=None, overrides=None, output="pil"):
+        raise ConnectionError("server gone")
+
+    broken.generate = fail
+
+    assert pool.generate() != "gpu0:8188"
+    assert pool.backends[0].down_until is not None
+    assert "gpu0:8188" not in [pool.generate() for _ in range(4)]
+
+    reconnected = []
+    broken.connect = lambda: reconnected.append(True)
+    broken.generate = lambda node_names=None, overrides=None, output="pil": "back"
+    time.sleep(0.06)
+    assert pool.generate() == "back"
+    assert reconnected == [True]
+    assert pool.backends[0].down_until is None
+
+
+def test_backend_is_not_reconnected_under_running_generations():
+    pool, calls = make_pool(retry_after=0.01)
+    busy = pool.backends[0]
+    release = threading.Event()
+    closed = []
+    busy.client.close = lambda: closed.append(True)
+
+    def generate(node_names=None, overrides=None, output="pil"):
+        closes = len(closed)
+        release.wait(5)
+        if len(closed) > closes:
+            raise AttributeError("'NoneType' object has no attribute 'post'")
+        return "slow"
+
+    busy.client.generate = generate
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        running = executor.submit(pool.generate)
+        while not busy.in_flight:
+            time.sleep(0.001)
+        # Another generation on the same server failed
+        busy.mark_down(0.01)
+        time.sleep(0.02)
+        assert pool.generate() != "slow"
+        assert closed == []
+        release.set()
+        assert running.result() == "slow"
+
+    time.sleep(0.02)
+    pool.generate()
+    assert closed == [True]
+    assert busy.down_until is None
+
+
+def test_rejected_prompt_does_not_fail_over():
+    pool, calls = make_pool()
+    response = requests.Response()
+    response.status_code = 400
+
+    def reject(node_names=None, overrides=None, output="pil"):
+        try:
+            raise requests.HTTPError(response=response)
+        except requests.RequestException as e:
+            raise ConnectionError(f"Failed to queue prompt: {e}")
+
+    for client in pool.clients:
+        client.generate = reject
+
+    with pytest.raises(ConnectionError):
+        pool.generate()
+    assert all(backend.down_until is None for backend in pool.backends)
+
+
+def test_async_pool_fails_when_every_server_is_down():
+    async def run():
+        pool = ComfyUIPoolAsync(SERVERS[:2], WORKFLOW_API)
+        attempts = []
+
+        for client in pool.clients:
+
+            async def fail(node_names=None, overrides=None, output="pil", c=client):
+                attempts.append(c.SERVER_ADDRESS)
+                raise ConnectionError("server gone")
+
+            client.generate = fail
+
+        with pytest.raises(ConnectionError, match="No ComfyUI server available"):
+            await pool.generate()
+        assert sorted(attempts) == SERVERS[:2]
+
+    asyncio.run(run())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Test progress events of running prompts"""
+
+import asyncio
+import os
+
+import pytest
+
+from comfyuiclient import ComfyUIClient, ComfyUIClientAsync
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+
+def server_messages(prompt_id, fail=False):
+    """The messages ComfyUI sends while running the example workflow"""
+    yield {"type": "execution_start", "data": {"prompt_id": prompt_id}}
+    yield {
+        "type": "execution_cached",
+        "data": {"nodes": ["4", "6", "7"], "prompt_id": prompt_id},
+    }
+    yield {"type": "executing", "data": {"node": "3", "prompt_id": prompt_id}}
+    for step in (1, 2):
+        yield {
+            "type": "progress",
+            "data": {"value": step, "max": 2, "node": "3", "prompt_id": prompt_id},
+        }
+    if fail:
+        yield {
+            "type": "execution_error",
+            "data": {
+                "node_id": "3",
+                "exception_message": "OOM",
+                "prompt_id": prompt_id,
+            },
+        }
+        return
+    yield {
+        "type": "executed",
+        "data": {"node": "10", "output": {"images": []}, "prompt_id": prompt_id},
+    }
+    yield {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}}
+
+
+def test_sync_generate_reports_progress():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+
+    def queue_prompt(prompt, prompt_id=None):
+        for message in server_messages(prompt_id):
+            client._handle_message(message)
+        return {"prompt_id": prompt_id}
+
+    client.queue_prompt = queue_prompt
+    client.get_outputs = lambda prompt_id: ({}, {})
+    events = []
+
+    result = client.generate(on_progress=events.append)
+
+    assert [event.type for event in events] == [
+        "execution_start",
+        "execution_cached",
+        "executing",
+        "progress",
+        "progress",
+        "executed",
+        "executing",
+    ]
+    assert {event.prompt_id for event in events} == {result.prompt_id}
+    assert events[1].nodes == ["4", "6", "7"]
+    assert (events[4].node, events[4].value, events[4].max) == ("3", 2, 2)
+    assert events[5].output == {"images": []}
+    assert all(event.elapsed >= 0 for event in events)
+
+
+def make_async_client(fail=False):
+    client = ComfyUIClientAsync("localhost:8188", WORKFLOW_API)
+
+    async def queue_prompt(prompt, prompt_id=None):
+        async def run():
+            for message in server_messages(prompt_id, fail):
+                await asyncio.sleep(0)
+                client._handle_message(message)
+
+        asyncio.ensure_future(run())
+        return {"prompt_id": prompt_id}
+
+    async def get_outputs(prompt_id):
+        waiter = client._get_waiter(prompt_id)
+        try:
+            await waiter.done
+        finally:
+            client._waiters.pop(prompt_id, None)
+        return {}, {}
+
+    client.queue_prompt = queue_prompt
+    client.get_outputs = get_outputs
+    return client
+
+
+def test_stream_yields_events_then_the_result():
+    async def run():
+        client = make_async_client()
+        return [event async for event in client.stream(["Result Image"])]
+
+    events = asyncio.run(run())
+
+    assert [event.type for event in events][-3:] == ["executed", "executing", "result"]
+    assert events[3].type == "progress" and events[3].value == 1
+    assert events[-1].output.prompt_id == events[0].prompt_id
+
+
+def test_stream_raises_execution_errors():
+    async def run():
+        client = make_async_client(fail=True)
+        seen = []
+        with pytest.raises(RuntimeError, match="OOM"):
+            async for event in client.stream():
+                seen.append(event.type)
+        return seen
+
+    assert asyncio.run(run())[-2:] == ["progress", "execution_error"]
+
+
+def test_progress_follows_ids_assigned_by_the_server():
+    from benchmarks.fake_server import FakeComfyUI
+
+    with FakeComfyUI(delay=0.01, image_size=(8, 8), assign_ids=True) as server:
+        client = ComfyUIClient(server.address, WORKFLOW_API, timeout=10)
+        client.connect()
+        events = []
+        try:
+            result = client.generate(["Result Image"], on_progress=events.append)
+        finally:
+            client.close()
+
+        async def run():
+            client = ComfyUIClientAsync(server.address, WORKFLOW_API)
+            await client.connect()
+            events = []
+            try:
+                coroutine = client.generate(["Result Image"], on_progress=events.append)
+                return await asyncio.wait_for(coroutine, 10), events
+            finally:
+                await client.close()
+
+        async_result, async_events = asyncio.run(run())
+
+    for result, events in ((result, events), (async_result, async_events)):
+        assert result.prompt_id in server.history
+        assert result["Result Image"] is not None
+        assert "progress" in [event.type for event in events]
+        assert {event.prompt_id for event in events} == {result.prompt_id}
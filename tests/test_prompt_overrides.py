@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""Test per-call prompt overrides"""
+
+import asyncio
+import os
+
+import pytest
+
+from comfyuiclient import ComfyUIClient, ComfyUIClientAsync, apply_overrides
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+
+def test_overrides_leave_base_prompt_untouched():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+    seed = client.comfyui_prompt["3"]["inputs"]["seed"]
+
+    prompt = client.prepare_prompt({"KSampler": {"seed": 42, "steps": 4}})
+
+    assert prompt["3"]["inputs"]["seed"] == 42
+    assert prompt["3"]["inputs"]["steps"] == 4
+    assert client.comfyui_prompt["3"]["inputs"]["seed"] == seed
+    assert prompt["3"]["inputs"]["model"] == ["4", 0]
+
+
+def test_only_touched_nodes_are_copied():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+
+    prompt = client.prepare_prompt({"3": {"seed": 1}})
+
+    assert prompt["3"] is not client.comfyui_prompt["3"]
+    for node_id in client.comfyui_prompt:
+        if node_id != "3":
+            assert prompt[node_id] is client.comfyui_prompt[node_id]
+
+
+def test_no_overrides_returns_base_prompt():
+    base = {"1": {"class_type": "A", "inputs": {}}}
+    assert apply_overrides(base, None) is base
+
+
+def test_unknown_node_raises():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+    with pytest.raises(ValueError):
+        client.prepare_prompt({"NonExistentNode": {"text": "x"}})
+
+
+@pytest.mark.parametrize("client_class", [ComfyUIClient, ComfyUIClientAsync])
+def test_set_data_leaves_built_prompts_untouched(client_class):
+    client = client_class("localhost:8188", WORKFLOW_API)
+    prompt = client.prepare_prompt({"CLIPTextEncode": {"text": "a cat"}})
+    seed = prompt["3"]["inputs"]["seed"]
+
+    done = client.set_data(key="KSampler", seed=seed + 1)
+    if asyncio.iscoroutine(done):
+        asyncio.run(done)
+
+    assert prompt["3"]["inputs"]["seed"] == seed
+    assert client.comfyui_prompt["3"]["inputs"]["seed"] == seed + 1
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Test local validation of prompts before they are queued"""
+
+import json
+import os
+
+import pytest
+
+from comfyuiclient import ComfyUIClient, PromptValidationError
+from comfyuiclient import client as client_module
+from comfyuiclient import validate_prompt
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+OBJECT_INFO = {
+    "CheckpointLoaderSimple": {
+        "input": {"required": {"ckpt_name": [["v1-5-pruned.safetensors"]]}},
+        "output": ["MODEL", "CLIP", "VAE"],
+    },
+    "CLIPTextEncode": {
+        "input": {"required": {"text": ["STRING"], "clip": ["CLIP"]}},
+        "output": ["CONDITIONING"],
+    },
+    "EmptyLatentImage": {
+        "input": {
+            "required": {
+                "width": ["INT", {"min": 16}],
+                "height": ["INT", {"min": 16}],
+                "batch_size": ["INT", {"min": 1}],
+            }
+        },
+        "output": ["LATENT"],
+    },
+    "KSampler": {
+        "input": {
+            "required": {
+                "model": ["MODEL"],
+                "seed": ["INT", {"min": 0}],
+                "steps": ["INT", {"min": 1}],
+                "cfg": ["FLOAT"],
+                "sampler_name": [["euler"]],
+                "scheduler": [["normal"]],
+                "positive": ["CONDITIONING"],
+                "negative": ["CONDITIONING"],
+                "latent_image": ["LATENT"],
+                "denoise": ["FLOAT", {"min": 0.0, "max": 1.0}],
+            }
+        },
+        "output": ["LATENT"],
+    },
+    "VAEDecode": {
+        "input": {"required": {"samples": ["LATENT"], "vae": ["VAE"]}},
+        "output": ["IMAGE"],
+    },
+    "PreviewImage": {
+        "input": {"required": {"images": ["IMAGE"]}},
+        "output": [],
+        "output_node": True,
+    },
+}
+
+SCHEMA = client_module._node_schemas(OBJECT_INFO)
+
+
+@pytest.fixture
+def prompt():
+    with open(WORKFLOW_API, encoding="utf8") as f:
+        return json.load(f)
+
+
+def errors_of(prompt, schema=None):
+    with pytest.raises(PromptValidationError) as info:
+        validate_prompt(prompt, schema)
+    return info.value.errors
+
+
+def test_valid_prompt_passes(prompt):
+    validate_prompt(prompt)
+    validate_prompt(prompt, SCHEMA)
+
+
+def test_broken_links_are_found_without_a_schema(prompt):
+    prompt["3"]["inputs"]["model"] = None
+    prompt["3"]["inputs"]["positive"] = ["99", 0]
+    prompt["8"]["inputs"]["vae"] = ["4"]
+
+    assert errors_of(prompt) == [
+        "node 3 (KSampler): input 'model' is not connected",
+        "node 3 (KSampler): input 'positive' links to missing node '99'",
+        "node 8 (VAEDecode): input 'vae' is a malformed link",
+    ]
+
+
+def test_cycles_are_found(prompt):
+    prompt["5"]["inputs"]["width"] = ["3", 0]
+
+    assert errors_of(prompt) == ["node 3 is part of a dependency cycle"]
+
+
+def test_schema_checks(prompt):
+    prompt["3"]["inputs"]["steps"] = 0
+    prompt["3"]["inputs"]["latent_image"] = ["6", 0]
+    prompt["8"]["inputs"]["samples"] = ["3", 1]
+    del prompt["5"]["inputs"]["batch_size"]
+    prompt["7"]["class_type"] = "CLIPTextEncodeSDXL"
+
+    assert errors_of(prompt, SCHEMA) == [
+        "node 3 (KSampler): input 'steps' is 0, below its minimum 1",
+        "node 3 (KSampler): input 'latent_image' expects LATENT,"
+        " node 6 outputs CONDITIONING",
+        "node 5 (EmptyLatentImage): required input 'batch_size' is missing",
+        "node 7 (CLIPTextEncodeSDXL): node type is not installed on the server",
+        "node 8 (VAEDecode): input 'samples' links to missing output 1 of node 3",
+    ]
+
+
+def test_inputs_missing_from_the_schema_are_ignored(prompt):
+    # Like the server, which drops inputs a node type does not declare
+    prompt["3"]["inputs"]["noise_offset"] = 0.1
+    prompt["8"]["inputs"]["extra_link"] = ["99", 0]
+
+    validate_prompt(prompt, SCHEMA)
+
+
+def test_prompt_needs_an_output_node(prompt):
+    del prompt["10"]
+
+    assert errors_of(prompt, SCHEMA) == ["prompt has no output node"]
+
+
+def test_generate_validates_before_queueing():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+    client.schema = SCHEMA
+    queued = []
+
+    def queue_prompt(prompt):
+        queued.append(prompt)
+        return {"prompt_id": "p"}
+
+    client.queue_prompt = queue_prompt
+    client.get_outputs = lambda prompt_id: ({}, {})
+
+    with pytest.raises(ValueError, match="below its minimum"):
+        client.generate(["Result Image"], overrides={"KSampler": {"steps": 0}})
+    assert queued == []
+
+    client.generate(["Result Image"], overrides={"KSampler": {"steps": 30}})
+    client.validate = False
+    client.generate(["Result Image"], overrides={"KSampler": {"steps": 0}})
+    assert [p["3"]["inputs"]["steps"] for p in queued] == [30, 0]
+
+
+def test_errors_are_value_errors(prompt):
+    prompt["3"]["inputs"]["model"] = ["4", "0"]
+
+    with pytest.raises(ValueError, match="Invalid prompt: .*malformed link"):
+        validate_prompt(prompt)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Test serving repeated prompts from the result cache"""
+
+import asyncio
+import io
+import json
+import os
+import threading
+
+from PIL import Image
+
+from comfyuiclient import ComfyUIClient, ComfyUIClientAsync, ResultCache, prompt_hash
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+
+def png(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def make_client(cache, client_class=ComfyUIClient):
+    client = client_class("localhost:8188", WORKFLOW_API, result_cache=cache)
+    client.queued = []
+
+    def queue_prompt(prompt):
+        client.queued.append(prompt)
+        return {"prompt_id": f"p{len(client.queued)}"}
+
+    def get_outputs(prompt_id):
+        return {"10": [png("red"), png("blue")]}, {}
+
+    client.queue_prompt = queue_prompt
+    client.get_outputs = get_outputs
+    return client
+
+
+def test_prompt_hash_ignores_titles_and_key_order():
+    with open(WORKFLOW_API, encoding="utf8") as f:
+        prompt = json.load(f)
+    key = prompt_hash(prompt)
+
+    prompt["3"]["_meta"]["title"] = "Renamed"
+    reordered = {node_id: prompt[node_id] for node_id in reversed(list(prompt))}
+    assert prompt_hash(reordered) == key
+
+    prompt["3"]["inputs"]["seed"] += 1
+    assert prompt_hash(prompt) != key
+
+
+def test_repeated_prompt_is_served_from_cache():
+    client = make_client(ResultCache())
+
+    first = client.generate(["Result Image"], overrides={"KSampler": {"seed": 1}})
+    again = client.generate(["Result Image"], overrides={"KSampler": {"seed": 1}})
+    other = client.generate(["Result Image"], overrides={"KSampler": {"seed": 2}})
+
+    assert len(client.queued) == 2
+    assert not first.cached and again.cached and not other.cached
+    assert again.prompt_id == first.prompt_id
+    assert [i.getpixel((0, 0)) for i in again.images["Result Image"]] == [
+        (255, 0, 0),
+        (0, 0, 255),
+    ]
+
+
+def test_memory_is_bounded_by_bytes():
+    size = len(png("red")) + len(png("blue"))
+    cache = ResultCache(max_bytes=2 * size)
+    client = make_client(cache)
+
+    for seed in range(3):
+        client.generate(overrides={"KSampler": {"seed": seed}})
+    client.generate(overrides={"KSampler": {"seed": 0}})
+
+    assert len(cache) == 2
+    assert len(client.queued) == 4
+
+
+def test_disk_entries_survive_and_are_evicted(tmp_path):
+    directory = str(tmp_path / "results")
+    size = len(png("red")) + len(png("blue"))
+    client = make_client(ResultCache(directory=directory, max_disk_bytes=3 * size))
+    for seed in range(4):
+        client.generate(overrides={"KSampler": {"seed": seed}})
+    assert len(os.listdir(directory)) <= 3
+
+    client = make_client(ResultCache(directory=directory))
+    result = client.generate(["Result Image"], overrides={"KSampler": {"seed": 3}})
+    assert result.cached
+    assert result.images["Result Image"][1].getpixel((0, 0)) == (0, 0, 255)
+    client.generate(overrides={"KSampler": {"seed": 0}})
+    assert len(client.queued) == 1
+
+
+def test_async_client_uses_the_cache():
+    async def run():
+        client = make_client(ResultCache(), ComfyUIClientAsync)
+        queue_prompt, get_outputs = client.queue_prompt, client.get_outputs
+
+        async def queue_async(prompt):
+            return queue_prompt(prompt)
+
+        async def outputs_async(prompt_id):
+            return get_outputs(prompt_id)
+
+        client.queue_prompt, client.get_outputs = queue_async, outputs_async
+        results = [await client.generate(["Result Image"]) for _ in range(2)]
+        assert [r.cached for r in results] == [False, True]
+        assert len(client.queued) == 1
+
+    asyncio.run(run())
+
+
+class BlockingCache(ResultCache):
+    """Holds every lookup until ``release`` is set"""
+
+    def __init__(self):
+        super().__init__()
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def get(self, key):
+        self.entered.set()
+        self.release.wait(5)
+        return super().get(key)
+
+
+def test_outputs_are_stored_under_the_hash_of_the_queued_prompt():
+    async def run():
+        cache = BlockingCache()
+        client = make_client(cache, ComfyUIClientAsync)
+        queue_prompt, get_outputs = client.queue_prompt, client.get_outputs
+
+        async def queue_async(prompt):
+            return queue_prompt(prompt)
+
+        async def outputs_async(prompt_id):
+            return get_outputs(prompt_id)
+
+        client.queue_prompt, client.get_outputs = queue_async, outputs_async
+        await client.set_data(key="KSampler", seed=1)
+        job = asyncio.ensure_future(client.generate(["Result Image"]))
+        await asyncio.get_event_loop().run_in_executor(None, cache.entered.wait)
+        await client.set_data(key="KSampler", seed=2)
+        cache.release.set()
+        await job
+        return cache, client.queued
+
+    cache, queued = asyncio.run(run())
+
+    assert queued[0]["3"]["inputs"]["seed"] == 1
+    assert cache.get(prompt_hash(queued[0])) is not None
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Test retries of transient HTTP failures"""
+
+import asyncio
+import os
+import time
+
+import pytest
+import requests
+
+from comfyuiclient import ComfyUIClient, RetryPolicy
+
+from .conftest import FakeResponse, FakeSession
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+
+class FakeServer(FakeSession):
+    """A requests.Session stand-in that replays scripted failures"""
+
+    def __init__(self, failures=()):
+        super().__init__()
+        self.failures = list(failures)
+        self.queued = []
+
+    def _fail(self):
+        if self.failures:
+            failure = self.failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return FakeResponse(status=failure)
+        return None
+
+    def respond(self, method, url, json=None, **kwargs):
+        if method == "POST":
+            assert url.endswith("/prompt"), url
+            self.queued.append(json["prompt_id"])
+            # The server got the prompt, but the response is lost
+            failure = self._fail()
+            return failure or FakeResponse({"prompt_id": json["prompt_id"]})
+        if url.endswith("/queue"):
+            return FakeResponse(
+                {
+                    "queue_running": [],
+                    "queue_pending": [[0, p] for p in self.queued],
+                }
+            )
+        return self._fail() or FakeResponse({"p": {"outputs": {}}})
+
+
+def make_client(server):
+    client = ComfyUIClient(
+        "localhost:8188",
+        WORKFLOW_API,
+        retry=RetryPolicy(max_attempts=3, backoff=0),
+    )
+    client.session = server
+    return client
+
+
+def test_transient_status_is_retried():
+    server = FakeServer([503, requests.ConnectionError("reset")])
+    client = make_client(server)
+
+    assert client.get_history("p") == {"p": {"outputs": {}}}
+    assert len(server.requests) == 3
+
+
+def test_client_errors_and_exhausted_retries_raise():
+    client = make_client(FakeServer([404]))
+    with pytest.raises(ConnectionError):
+        client.get_history("p")
+    assert len(client.session.requests) == 1
+
+    client = make_client(FakeServer([503, 503, 503, 503]))
+    with pytest.raises(ConnectionError):
+        client.get_history("p")
+    assert len(client.session.requests) == 3
+
+
+def test_lost_queue_response_does_not_queue_twice():
+    server = FakeServer([requests.ConnectionError("reset")])
+    client = make_client(server)
+
+    result = client.queue_prompt({}, prompt_id="abc")
+
+    assert result["prompt_id"] == "abc"
+    assert server.queued == ["abc"]
+
+
+def test_get_images_resumes_a_known_prompt():
+    server = FakeServer()
+    server.queued.append("p")
+    client = make_client(server)
+    client.wait_for_completion = lambda prompt_id, timeout=None: {"outputs": {}}
+
+    assert client.get_images({}, prompt_id="p") == ({}, {})
+    assert server.queued == ["p"]
+
+
+def test_partial_stream_is_not_retried():
+    client = make_client(FakeServer())
+    chunks = []
+
+    class BrokenStream(FakeResponse):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            pass
+
+        def iter_content(self, size):
+            yield b"half"
+            raise requests.exceptions.ChunkedEncodingError("dropped")
+
+    client.session.get = lambda url, **kwargs: BrokenStream()
+
+    with pytest.raises(ConnectionError):
+        client.stream_image("a.png", "", "output", chunks.append)
+    assert chunks == [b"half"]
+
+
+def test_policy_backoff_and_async_retries():
+    policy = RetryPolicy(backoff=1.0, max_backoff=3.0, jitter=0.5)
+    assert 0.5 <= policy.delay(1) <= 1.0
+    assert 1.5 <= policy.delay(5) <= 3.0
+
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise asyncio.TimeoutError()
+        return "ok"
+
+    policy = RetryPolicy(backoff=0)
+    assert asyncio.run(policy.call_async(flaky)) == "ok"
+    assert len(attempts) == 2
+
+
+def test_finished_prompts_resume_without_waiting():
+    from benchmarks.fake_server import FakeComfyUI
+    from comfyuiclient import ComfyUIClientAsync
+
+    with FakeComfyUI(delay=0, image_size=(8, 8)) as server:
+        client = ComfyUIClient(server.address, WORKFLOW_API)
+        client.connect()
+        try:
+            result = client.generate(["Result Image"], output="bytes")
+            began = time.monotonic()
+            images, _ = client.get_images({}, prompt_id=result.prompt_id)
+            assert time.monotonic() - began < 1
+            assert images["10"] == [server.image]
+        finally:
+            client.close()
+
+        async def resume_async():
+            client = ComfyUIClientAsync(server.address, WORKFLOW_API)
+            await client.connect()
+            try:
+                result = await client.generate(["Result Image"], output="bytes")
+                resumed = client.get_images({}, prompt_id=result.prompt_id)
+                return await asyncio.wait_for(resumed, 5)
+            finally:
+                await client.close()
+
+        images, _ = asyncio.run(resume_async())
+        assert images["10"] == [server.image]
+        assert server.requests["/prompt"] == 2
+
+
+def test_async_resume_of_another_clients_running_prompt():
+    from benchmarks.fake_server import FakeComfyUI
+    from comfyuiclient import ComfyUIClientAsync
+
+    async def resume(address):
+        first = ComfyUIClientAsync(address, WORKFLOW_API)
+        await first.connect()
+        prompt_id = (await first.queue_prompt(first.prepare_prompt()))["prompt_id"]
+        # The worker restarts; messages keep going to the first client id
+        await first.close()
+        client = ComfyUIClientAsync(address, WORKFLOW_API)
+        client.HISTORY_CHECK_INTERVAL = 0.05
+        await client.connect()
+        try:
+            resumed = client.get_images({}, prompt_id=prompt_id)
+            return await asyncio.wait_for(resumed, 5)
+        finally:
+            await client.close()
+
+    with FakeComfyUI(delay=0.3, image_size=(8, 8)) as server:
+        images, _ = asyncio.run(resume(server.address))
+        assert images["10"] == [server.image]
+        assert server.requests["/prompt"] == 1
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""Test the object_info schema cache and local input validation"""
+
+import os
+
+import pytest
+
+from comfyuiclient import WIDGET_MAPPINGS, ComfyUIClient, SchemaCache
+from comfyuiclient import client as client_module
+
+from .conftest import FakeResponse, FakeSession
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+OBJECT_INFO = {
+    "KSampler": {
+        "input": {
+            "required": {
+                "model": ["MODEL"],
+                "seed": ["INT", {"min": 0, "max": 2**64 - 1}],
+                "steps": ["INT", {"default": 20, "min": 1, "max": 10000}],
+                "cfg": ["FLOAT", {"min": 0.0, "max": 100.0}],
+                "sampler_name": [["euler", "dpmpp_2m"]],
+                "scheduler": [["normal", "karras"]],
+                "denoise": ["FLOAT", {"min": 0.0, "max": 1.0}],
+            }
+        }
+    },
+    "CLIPTextEncode": {
+        "input": {"required": {"text": ["STRING"], "clip": ["CLIP"]}},
+    },
+}
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    saved = dict(WIDGET_MAPPINGS)
+    yield
+    WIDGET_MAPPINGS.clear()
+    WIDGET_MAPPINGS.update(saved)
+    client_module._widget_mappings_version += 1
+
+
+class FakeServer(FakeSession):
+    """Serves OBJECT_INFO with an ETag, honouring If-None-Match"""
+
+    def __init__(self, etag='"v1"'):
+        super().__init__()
+        self.etag = etag
+
+    @property
+    def sent_headers(self):
+        return [kwargs.get("headers") or {} for _, _, kwargs in self.requests]
+
+    def respond(self, method, url, headers=None, **kwargs):
+        assert url.endswith("/object_info")
+        if self.etag and (headers or {}).get("If-None-Match") == self.etag:
+            return FakeResponse(status=304)
+        return FakeResponse(
+            OBJECT_INFO, headers={"ETag": self.etag} if self.etag else None
+        )
+
+
+def make_client(cache, server=None):
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API, schema_cache=cache)
+    client.session = server or FakeServer()
+    return client
+
+
+def test_schema_is_fetched_once_and_revalidated_by_etag():
+    cache = SchemaCache()
+    client = make_client(cache)
+
+    assert client.get_object_info() == OBJECT_INFO
+    assert make_client(cache, client.session).get_object_info() == OBJECT_INFO
+    assert client.session.sent_headers == [{}]
+
+    assert client.get_object_info(refresh=True) == OBJECT_INFO
+    assert client.session.sent_headers[1] == {"If-None-Match": '"v1"'}
+    assert cache.get("localhost:8188")["version"] == '"v1"'
+
+
+def test_stale_schema_is_revalidated(monkeypatch):
+    cache = SchemaCache(max_age=60)
+    client = make_client(cache, FakeServer(etag=None))
+    client.get_object_info()
+    version = cache.get("localhost:8188")["version"]
+
+    now = client_module.time.time()
+    monkeypatch.setattr(client_module.time, "time", lambda: now + 61)
+    client.get_object_info()
+
+    assert len(client.session.requests) == 2
+    assert cache.get("localhost:8188")["version"] == version
+
+
+def test_schema_persists_to_disk(tmp_path):
+    path = str(tmp_path / "schemas.json")
+    make_client(SchemaCache(path=path)).get_object_info()
+
+    client = make_client(SchemaCache(path=path))
+    assert client.get_object_info() == OBJECT_INFO
+    assert client.session.requests == []
+
+
+def test_set_data_is_validated_locally():
+    client = make_client(SchemaCache())
+    client.load_schema()
+
+    client.set_data(key="KSampler", seed=42, input_key="cfg", input_value=7.5)
+    assert client.comfyui_prompt["3"]["inputs"]["seed"] == 42
+
+    with pytest.raises(ValueError, match="KSampler.steps"):
+        client.set_data(key="KSampler", input_key="steps", input_value=0)
+    with pytest.raises(ValueError, match="not one of"):
+        client.set_data(key="KSampler", input_key="sampler_name", input_value="ddim")
+    with pytest.raises(ValueError, match="expects FLOAT"):
+        client.set_data(key="KSampler", input_key="denoise", input_value="high")
+    with pytest.raises(ValueError, match="no input 'Number'"):
+        client.set_data(key="KSampler", number=3)
+    with pytest.raises(ValueError, match="not installed"):
+        client.set_data(key="EmptyLatentImage", input_key="width", input_value=64)
+
+    assert client.comfyui_prompt["3"]["inputs"]["steps"] == 20
+
+
+def test_load_schema_has_no_side_effects(monkeypatch):
+    custom_node = {"input": {"required": {"scale": ["FLOAT", {"default": 2.0}]}}}
+    monkeypatch.setitem(OBJECT_INFO, "UpscaleBy", custom_node)
+    client = make_client(SchemaCache())
+    client.set_data(key="KSampler", seed=42)
+    mappings = {name: list(widgets) for name, widgets in WIDGET_MAPPINGS.items()}
+
+    client.load_schema()
+
+    assert WIDGET_MAPPINGS == mappings
+    assert "UpscaleBy" in client.schema
+    assert client.comfyui_prompt["3"]["inputs"]["seed"] == 42
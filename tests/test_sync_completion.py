@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Test completion detection in the sync ComfyUIClient"""
+
+import os
+import threading
+
+import pytest
+
+from comfyuiclient import ComfyUIClient
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+FINISHED = {"p": {"outputs": {}, "status": {"completed": True}}}
+
+
+def make_client(**kwargs):
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API, **kwargs)
+    client.POLL_INTERVAL_MIN = 0.001
+    return client
+
+
+def test_polling_fallback_without_websocket():
+    client = make_client(use_websocket=False)
+    responses = [{}, {}, FINISHED]
+    client.get_history = lambda prompt_id: responses.pop(0)
+
+    assert client.wait_for_completion("p", timeout=5) == FINISHED["p"]
+    assert not responses
+
+
+def test_polling_timeout():
+    client = make_client(timeout=0.05, use_websocket=False)
+    client.get_history = lambda prompt_id: {}
+
+    with pytest.raises(TimeoutError):
+        client.wait_for_completion("p")
+
+
+def test_websocket_completion_wakes_waiter():
+    client = make_client()
+    client.ws = object()  # only checked for presence
+    history = {}
+    calls = []
+
+    def get_history(prompt_id):
+        calls.append(prompt_id)
+        return history
+
+    client.get_history = get_history
+
+    def finish():
+        history.update(FINISHED)
+        client._get_waiter("p").set_result(None)
+
+    timer = threading.Timer(0.05, finish)
+    timer.start()
+    assert client.wait_for_completion("p", timeout=5) == FINISHED["p"]
+    timer.join()
+    assert len(calls) == 1
+    assert not client._waiters
+
+
+def test_websocket_execution_error():
+    client = make_client()
+    client.ws = object()
+    client.get_history = lambda prompt_id: {}
+    client._get_waiter("p").set_exception(RuntimeError("OOM"))
+
+    with pytest.raises(RuntimeError, match="OOM"):
+        client.wait_for_completion("p", timeout=5)
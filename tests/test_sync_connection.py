@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Test HTTP connection settings and thread safety of ComfyUIClient"""
+
+import os
+import threading
+import time
+
+from comfyuiclient import ComfyUIClient
+from comfyuiclient import client as client_module
+
+from .conftest import FakeSession
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+
+def test_connection_pool_and_keep_alive():
+    client = ComfyUIClient(
+        "localhost:8188",
+        WORKFLOW_API,
+        use_websocket=False,
+        pool_size=64,
+        keep_alive=False,
+    )
+    client.connect()
+    try:
+        adapter = client.session.get_adapter("http://localhost:8188/prompt")
+        assert adapter._pool_maxsize == 64
+        assert client.session.headers["Connection"] == "close"
+    finally:
+        client.close()
+
+
+def test_requests_use_timeouts():
+    client = ComfyUIClient(
+        "localhost:8188", WORKFLOW_API, connect_timeout=2, read_timeout=30
+    )
+    client.session = FakeSession()
+    client.get_history("p")
+    client.get_queue()
+
+    timeouts = [kwargs["timeout"] for _, _, kwargs in client.session.requests]
+    assert timeouts == [(2, 30), (2, 30)]
+
+
+def test_set_data_never_mutates_a_prompt_in_use():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+    in_use = client.prepare_prompt()
+    seed = in_use["3"]["inputs"]["seed"]
+
+    def set_seeds():
+        for i in range(200):
+            client.set_data(key="KSampler", seed=i)
+
+    threads = [threading.Thread(target=set_seeds) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert in_use["3"]["inputs"]["seed"] == seed
+    assert client.comfyui_prompt["3"]["inputs"]["seed"] == 199
+
+
+def test_concurrent_set_data_keeps_every_update(monkeypatch):
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+    apply_overrides = client_module.apply_overrides
+
+    def slow_apply_overrides(*args):
+        # Widen the window between reading and replacing the template
+        time.sleep(0.01)
+        return apply_overrides(*args)
+
+    monkeypatch.setattr(client_module, "apply_overrides", slow_apply_overrides)
+    threads = [
+        threading.Thread(target=client.set_data, args=(key,), kwargs={"text": key})
+        for key in ("CLIP Text Encode Positive", "CLIP Text Encode Negative")
+    ] + [
+        threading.Thread(target=client.set_data, args=("KSampler",), kwargs={"seed": 7})
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    prompt = client.comfyui_prompt
+    assert prompt["6"]["inputs"]["text"] == "CLIP Text Encode Positive"
+    assert prompt["7"]["inputs"]["text"] == "CLIP Text Encode Negative"
+    assert prompt["3"]["inputs"]["seed"] == 7
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Test per-phase timings and the metrics hook"""
+
+import io
+import os
+
+from PIL import Image
+
+from comfyuiclient import ComfyUIClient, OpenTelemetryMetrics, Span
+
+from .conftest import FakeResponse, FakeSession
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+
+def png():
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class FakeServer(FakeSession):
+    """Answers /prompt, /history and /view, reporting progress to ``client``"""
+
+    def __init__(self, client, batch=2):
+        super().__init__()
+        self.client = client
+        self.batch = batch
+
+    def respond(self, method, url, json=None, **kwargs):
+        if method == "GET":
+            return self._get(url)
+        prompt_id = json["prompt_id"]
+        for message in (
+            {"type": "execution_start", "data": {"prompt_id": prompt_id}},
+            {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}},
+        ):
+            self.client._handle_message(message)
+        return FakeResponse({"prompt_id": prompt_id})
+
+    def _get(self, url):
+        if url.endswith("/view"):
+            return FakeResponse(content=png())
+        prompt_id = url.rsplit("/", 1)[1]
+        images = [
+            {"filename": f"{i}.png", "subfolder": "", "type": "output"}
+            for i in range(self.batch)
+        ]
+        return FakeResponse({prompt_id: {"outputs": {"10": {"images": images}}}})
+
+
+def make_client(metrics=None):
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API, metrics=metrics)
+    client.session = FakeServer(client)
+    client.ws = object()  # completion is reported through _handle_message
+    return client
+
+
+def test_generate_records_every_phase():
+    recorded = []
+    client = make_client(recorded.append)
+
+    result = client.generate(["Result Image"], on_progress=lambda event: None)
+
+    assert [span.name for span in result.timings] == [
+        "queue_prompt",
+        "wait_for_start",
+        "execution",
+        "get_history",
+        "get_image",
+        "get_image",
+        "decode",
+    ]
+    assert recorded == result.timings
+    assert all(span.duration >= 0 for span in result.timings)
+    assert result.timings[0].attributes == {"prompt_id": result.prompt_id}
+    assert sorted(span.attributes["filename"] for span in result.timings[4:6]) == [
+        "0.png",
+        "1.png",
+    ]
+    durations = result.durations()
+    assert durations["get_image"] == sum(s.duration for s in result.timings[4:6])
+
+
+def test_concurrent_generations_keep_their_own_timings():
+    client = make_client()
+
+    results = [result for _, result in client.generate_many([{}, {}, {}])]
+
+    for result in results:
+        prompt_ids = {span.attributes.get("prompt_id") for span in result.timings}
+        assert prompt_ids - {None} == {result.prompt_id}
+
+
+def test_hook_errors_are_reported(capsys):
+    def broken_hook(span):
+        raise RuntimeError("collector down")
+
+    client = make_client(broken_hook)
+    result = client.generate()
+    assert "Error in metrics hook: collector down" in capsys.readouterr().out
+    assert "decode" in result.durations()
+
+
+class FakeInstrument:
+    def __init__(self):
+        self.records = []
+        self.spans = []
+
+    def create_histogram(self, name, unit="", description=""):
+        self.name, self.unit = name, unit
+        return self
+
+    def record(self, value, attributes=None):
+        self.records.append((value, attributes))
+
+    def start_span(self, name, start_time=None, attributes=None):
+        self.spans.append([name, start_time, attributes, None])
+        return self
+
+    def end(self, end_time=None):
+        self.spans[-1][3] = end_time
+
+
+def test_open_telemetry_adapter():
+    meter = FakeInstrument()
+    tracer = FakeInstrument()
+    metrics = OpenTelemetryMetrics(meter=meter, tracer=tracer)
+
+    metrics(Span("get_image", 10.0, 0.5, {"filename": "a.png"}))
+    metrics(Span("queue_prompt", 12.0, 0.25, {"error": "ConnectionError"}))
+
+    assert (meter.name, meter.unit) == ("comfyui.client.duration", "s")
+    assert meter.records == [
+        (0.5, {"phase": "get_image"}),
+        (0.25, {"phase": "queue_prompt", "error": "ConnectionError"}),
+    ]
+    assert tracer.spans[0] == [
+        "get_image",
+        10 * 10**9,
+        {"filename": "a.png"},
+        10 * 10**9 + 5 * 10**8,
+    ]
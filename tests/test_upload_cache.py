@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Test the content-hash keyed upload cache"""
+
+import io
+import os
+import threading
+
+from PIL import Image
+
+from comfyuiclient import ComfyUIClient, UploadCache
+
+from .conftest import FakeResponse, FakeSession
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+
+class FakeServer(FakeSession):
+    """Answers /upload/image, recording the uploaded file names"""
+
+    def __init__(self):
+        super().__init__()
+        self.uploads = []
+        self.bodies = []
+
+    def respond(self, method, url, files=None, data=None, **kwargs):
+        if files is None:
+            # Streamed multipart body
+            body = b"".join(data)
+            filename = body.split(b'filename="')[1].split(b'"')[0].decode()
+            self.bodies.append(body)
+        else:
+            filename = files["image"][0]
+        self.uploads.append(filename)
+        return FakeResponse({"name": filename, "subfolder": "temp"})
+
+
+def make_client(**kwargs):
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API, **kwargs)
+    client.session = FakeServer()
+    return client
+
+
+def test_identical_images_upload_once():
+    client = make_client()
+    first = client.upload_image(Image.new("RGB", (16, 16), (10, 20, 30)))
+    second = client.upload_image(Image.new("RGB", (16, 16), (10, 20, 30)))
+    other = client.upload_image(Image.new("RGB", (16, 16), (0, 0, 0)))
+
+    assert first == second
+    assert other != first
+    assert len(client.session.uploads) == 2
+    assert first == "temp/" + client.session.uploads[0]
+    assert client.session.uploads[0] != "temp.png"
+
+
+def test_upload_cache_disabled():
+    client = make_client(upload_cache=False)
+    image = Image.new("RGB", (16, 16))
+    client.upload_image(image)
+    client.upload_image(image)
+    assert len(client.session.uploads) == 2
+
+
+def test_lru_eviction():
+    cache = UploadCache(max_entries=2)
+    cache.put("a", "temp/a.png")
+    cache.put("b", "temp/b.png")
+    cache.get("a")
+    cache.put("c", "temp/c.png")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "temp/a.png"
+    assert len(cache) == 2
+
+
+def test_persistence_is_shared_across_instances(tmp_path):
+    path = str(tmp_path / "uploads.json")
+    image = Image.new("RGB", (16, 16), (1, 2, 3))
+    client = make_client(upload_cache=UploadCache(path=path))
+    client.upload_image(image)
+
+    restarted = make_client(upload_cache=UploadCache(path=path))
+    restarted.upload_image(image)
+
+    assert restarted.session.uploads == []
+
+
+def test_encoded_bytes_paths_and_buffers_share_an_upload(tmp_path):
+    path = str(tmp_path / "input.png")
+    Image.new("RGB", (16, 16), (4, 5, 6)).save(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    client = make_client()
+
+    results = {
+        client.upload_image(data),
+        client.upload_image(path),
+        client.upload_image(io.BytesIO(data)),
+    }
+
+    assert len(results) == 1
+    assert client.session.uploads[0].endswith(".png")
+    assert len(client.session.uploads) == 1
+
+
+def test_path_upload_is_streamed(tmp_path):
+    path = str(tmp_path / "input.jpg")
+    Image.new("RGB", (16, 16)).save(path, format="JPEG")
+    client = make_client(upload_cache=False)
+
+    client.upload_image(path)
+
+    with open(path, "rb") as f:
+        assert f.read() in client.session.bodies[0]
+    assert client.session.uploads[0].endswith(".jpg")
+
+
+def test_encoder_options_are_part_of_the_key():
+    client = make_client()
+    image = Image.new("RGB", (16, 16), (7, 8, 9))
+
+    png = client.upload_image(image)
+    fast_png = client.upload_image(image, compress_level=1)
+    jpeg = client.upload_image(image, format="JPEG", quality=90)
+
+    assert len({png, fast_png, jpeg}) == 3
+    assert jpeg.endswith(".jpeg")
+
+
+def test_palette_and_transparency_are_part_of_the_key():
+    client = make_client()
+    red = Image.new("P", (16, 16), 0)
+    red.putpalette([255, 0, 0] * 256)
+    blue = red.copy()
+    blue.putpalette([0, 0, 255] * 256)
+    clear_red = red.copy()
+    clear_red.info["transparency"] = 0
+
+    uploads = {client.upload_image(image) for image in (red, blue, clear_red)}
+
+    assert len(uploads) == 3
+    assert len(client.session.uploads) == 3
+
+
+def test_shared_file_keeps_every_writers_entries(tmp_path):
+    path = str(tmp_path / "uploads.json")
+    first, second = UploadCache(path=path), UploadCache(path=path)
+
+    def fill(cache, name):
+        for i in range(200):
+            cache.put(f"{name}{i}", f"input/{name}{i}.png")
+
+    threads = [
+        threading.Thread(target=fill, args=(first, "a")),
+        threading.Thread(target=fill, args=(second, "b")),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    restarted = UploadCache(path=path)
+    assert len(restarted) == 400
+    assert restarted.get("a199") == "input/a199.png"
+    assert not [name for name in os.listdir(str(tmp_path)) if name.endswith(".tmp")]
+
+
+def test_journal_is_compacted_and_survives_a_torn_line(tmp_path):
+    path = str(tmp_path / "uploads.json")
+    cache = UploadCache(max_entries=3, path=path)
+    for i in range(10):
+        cache.put(str(i), f"input/{i}.png")
+    with open(path, encoding="utf8") as f:
+        assert len(f.readlines()) <= 6
+
+    with open(path, "a", encoding="utf8") as f:
+        f.write('{"10": "inp')
+    restarted = UploadCache(max_entries=3, path=path)
+    assert [restarted.get(str(i)) for i in (6, 7, 9)] == [
+        None,
+        "input/7.png",
+        "input/9.png",
+    ]
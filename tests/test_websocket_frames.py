@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Test decoding binary WebSocket image frames"""
+
+import json
+import os
+import struct
+
+from comfyuiclient import ComfyUIClient
+from comfyuiclient import client as client_module
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+PNG = b"\x89PNG\r\n\x1a\nimage"
+
+
+def preview_frame(data=PNG):
+    return struct.pack(">II", 1, 2) + data
+
+
+def metadata_frame(metadata, data=PNG):
+    encoded = json.dumps(metadata).encode()
+    return struct.pack(">II", 4, len(encoded)) + encoded + data
+
+
+def test_parse_frames():
+    assert client_module._parse_frame(preview_frame()) == ({}, "png", PNG)
+
+    metadata = {"image_type": "image/webp", "node_id": "9", "prompt_id": "p"}
+    assert client_module._parse_frame(metadata_frame(metadata)) == (
+        metadata,
+        "webp",
+        PNG,
+    )
+
+    assert client_module._parse_frame(struct.pack(">II", 3, 0) + b"text") is None
+    assert client_module._parse_frame(b"\x00") is None
+
+
+def make_client(prompt_id="p1"):
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API, validate=False)
+    client.comfyui_prompt["10"]["class_type"] = "SaveImageWebsocket"
+
+    def queue_prompt(prompt, prompt_id=None):
+        client._handle_message(
+            {"type": "executing", "data": {"node": "3", "prompt_id": prompt_id}}
+        )
+        client._handle_frame(preview_frame(b"step"))
+        client._handle_message(
+            {"type": "executing", "data": {"node": "10", "prompt_id": prompt_id}}
+        )
+        client._handle_frame(preview_frame())
+        client._handle_frame(preview_frame())
+        client._handle_message(
+            {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}}
+        )
+        return {"prompt_id": prompt_id}
+
+    client.queue_prompt = queue_prompt
+    client.wait_for_completion = lambda prompt_id, timeout=None: {"outputs": {}}
+    client.download_outputs = lambda outputs, sink=None: ({}, {})
+    return client
+
+
+def test_frames_route_to_the_executing_prompt():
+    client = make_client()
+    events = []
+
+    result = client.generate(
+        ["Result Image"], output="bytes", on_progress=events.append
+    )
+
+    previews = [event for event in events if event.type == "preview"]
+    assert [(event.node, event.output) for event in previews] == [
+        ("3", b"step"),
+        ("10", PNG),
+        ("10", PNG),
+    ]
+    assert {event.prompt_id for event in previews} == {result.prompt_id}
+    assert result.images["Result Image"] == [PNG, PNG]
+
+
+def test_websocket_outputs_go_to_the_sink(tmp_path):
+    client = make_client()
+    prompt_id = client._queue_tracked(client.comfyui_prompt, None)
+
+    images, _ = client.get_outputs(prompt_id, sink=str(tmp_path))
+
+    paths = images["10"]
+    assert [os.path.basename(path) for path in paths] == [
+        f"{prompt_id}_10_00000.png",
+        f"{prompt_id}_10_00001.png",
+    ]
+    with open(paths[1], "rb") as f:
+        assert f.read() == PNG
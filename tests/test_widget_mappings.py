@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Test the widget mapping registry used by convert_workflow_to_api"""
+
+import json
+import os
+
+import pytest
+
+from comfyuiclient import (
+    WIDGET_MAPPINGS,
+    ComfyUIClient,
+    WorkflowCache,
+)
+from comfyuiclient import client as client_module
+from comfyuiclient import (
+    convert_workflow_to_api,
+    load_widget_mappings,
+    register_widget_mapping,
+    widget_mappings_from_object_info,
+)
+
+WORKFLOW = os.path.join(os.path.dirname(__file__), "..", "workflow.json")
+
+OBJECT_INFO = {
+    "KSampler": {
+        "input": {
+            "required": {
+                "model": ["MODEL"],
+                "seed": ["INT", {"default": 0, "control_after_generate": True}],
+                "steps": ["INT", {"default": 20}],
+                "sampler_name": [["euler", "dpmpp_2m"]],
+            }
+        },
+        "input_order": {"required": ["model", "seed", "steps", "sampler_name"]},
+    },
+    "LoadImage": {
+        "input": {"required": {"image": [["a.png"], {"image_upload": True}]}},
+    },
+    "UpscaleBy": {
+        "input": {
+            "required": {"image": ["IMAGE"], "scale": ["FLOAT", {"default": 2.0}]},
+            "optional": {
+                "mode": ["COMBO", {"options": ["nearest", "bicubic"]}],
+                "mask": ["STRING", {"forceInput": True}],
+            },
+        },
+    },
+}
+
+
+@pytest.fixture(autouse=True)
+def registry():
+    saved = dict(WIDGET_MAPPINGS)
+    yield
+    WIDGET_MAPPINGS.clear()
+    WIDGET_MAPPINGS.update(saved)
+    client_module._widget_mappings_version += 1
+
+
+def custom_workflow(widgets_values=(1.5, "bicubic")):
+    node = {"id": 1, "type": "UpscaleBy", "widgets_values": widgets_values}
+    return {"nodes": [node], "links": []}
+
+
+def test_mappings_from_object_info():
+    mappings = widget_mappings_from_object_info(OBJECT_INFO)
+
+    assert mappings == {
+        "KSampler": ["seed", None, "steps", "sampler_name"],
+        "LoadImage": ["image", None],
+        "UpscaleBy": ["scale", "mode"],
+    }
+
+
+def test_ui_only_widgets_are_skipped():
+    api = convert_workflow_to_api(WORKFLOW)
+
+    assert "seed_control" not in api["3"]["inputs"]
+    assert api["3"]["inputs"]["seed"] == 694907290331113
+    assert api["3"]["inputs"]["steps"] == 20
+
+
+def test_registered_node_types_convert():
+    assert convert_workflow_to_api(custom_workflow())["1"]["inputs"] == {}
+
+    register_widget_mapping("UpscaleBy", ["scale", "mode"])
+    api = convert_workflow_to_api(custom_workflow())
+    assert api["1"]["inputs"] == {"scale": 1.5, "mode": "bicubic"}
+
+    by_name = custom_workflow({"mode": "nearest", "scale": 3.0})
+    api = convert_workflow_to_api(by_name)
+    assert api["1"]["inputs"] == {"scale": 3.0, "mode": "nearest"}
+
+    api = convert_workflow_to_api(custom_workflow(), widget_mappings={})
+    assert api["1"]["inputs"] == {}
+
+
+def test_load_from_json_file_or_object_info(tmp_path):
+    path = tmp_path / "mappings.json"
+    path.write_text(json.dumps({"UpscaleBy": ["scale", None]}))
+
+    assert load_widget_mappings(str(path)) == {"UpscaleBy": ["scale", None]}
+    assert convert_workflow_to_api(custom_workflow())["1"]["inputs"] == {"scale": 1.5}
+
+    load_widget_mappings(OBJECT_INFO)
+    assert WIDGET_MAPPINGS["UpscaleBy"] == ["scale", "mode"]
+
+
+def test_fetch_widget_mappings_reconverts_the_workflow(tmp_path):
+    workflow = str(tmp_path / "workflow.json")
+    with open(workflow, "w", encoding="utf8") as f:
+        json.dump(custom_workflow([1.5, "bicubic"]), f)
+    cache_path = str(tmp_path / "widgets.json")
+
+    client = ComfyUIClient("localhost:8188", workflow, workflow_cache=WorkflowCache())
+    assert client.comfyui_prompt["1"]["inputs"] == {}
+
+    fetches = []
+
+    def get_object_info():
+        fetches.append(True)
+        return OBJECT_INFO
+
+    client.get_object_info = get_object_info
+    client.fetch_widget_mappings(cache_path)
+    assert client.comfyui_prompt["1"]["inputs"] == {"scale": 1.5, "mode": "bicubic"}
+
+    client.fetch_widget_mappings(cache_path)
+    assert fetches == [True]
+    with open(cache_path, encoding="utf8") as f:
+        assert json.load(f)["LoadImage"] == ["image", None]
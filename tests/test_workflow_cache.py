@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Test caching of parsed and converted workflow files"""
+
+import asyncio
+import os
+import shutil
+
+import pytest
+
+from comfyuiclient import ComfyUIClient, ComfyUIClientAsync, WorkflowCache
+from comfyuiclient import client as client_module
+
+WORKFLOW = os.path.join(os.path.dirname(__file__), "..", "workflow.json")
+
+
+@pytest.fixture
+def parses(monkeypatch):
+    calls = []
+    parse = client_module._parse_workflow
+
+    def counting_parse(data):
+        calls.append(data)
+        return parse(data)
+
+    monkeypatch.setattr(client_module, "_parse_workflow", counting_parse)
+    return calls
+
+
+@pytest.fixture
+def workflow(tmp_path):
+    path = str(tmp_path / "workflow.json")
+    shutil.copy(WORKFLOW, path)
+    return path
+
+
+def test_clients_share_one_parse(parses, workflow):
+    cache = WorkflowCache()
+    first = ComfyUIClient("localhost:8188", workflow, workflow_cache=cache)
+    second = ComfyUIClientAsync("localhost:8188", workflow, workflow_cache=cache)
+
+    assert len(parses) == 1
+    assert first.comfyui_prompt == second.comfyui_prompt
+    assert first.template.index is second.template.index
+
+    # Each client gets its own nodes and inputs
+    asyncio.run(second.set_data(key="KSampler", seed=5))
+    assert first.comfyui_prompt["3"]["inputs"]["seed"] != 5
+
+
+def test_reload_skips_unchanged_file(parses, workflow):
+    client = ComfyUIClient("localhost:8188", workflow, workflow_cache=WorkflowCache())
+    client.set_data(key="KSampler", seed=5)
+
+    client.reload()
+    assert client.comfyui_prompt["3"]["inputs"]["seed"] == 5
+    client.reload(force=True)
+    assert client.comfyui_prompt["3"]["inputs"]["seed"] != 5
+
+    # Touched but identical content is re-hashed, not re-parsed
+    stat = os.stat(workflow)
+    os.utime(workflow, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    client.reload()
+    assert len(parses) == 1
+
+    with open(workflow, "a", encoding="utf8") as f:
+        f.write("\n")
+    client.reload()
+    assert len(parses) == 2
+
+
+def test_disk_cache_skips_conversion(parses, workflow, tmp_path):
+    directory = str(tmp_path / "cache")
+    ComfyUIClient(
+        "localhost:8188", workflow, workflow_cache=WorkflowCache(directory=directory)
+    )
+    fresh = ComfyUIClient(
+        "localhost:8188", workflow, workflow_cache=WorkflowCache(directory=directory)
+    )
+
+    assert len(parses) == 1
+    assert len(os.listdir(directory)) == 1
+    assert fresh.find_key_by_title("KSampler") is not None
+
+
+def test_cache_disabled(parses, workflow):
+    ComfyUIClient("localhost:8188", workflow, workflow_cache=False)
+    ComfyUIClient("localhost:8188", workflow, workflow_cache=False)
+    assert len(parses) == 2
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Test the precomputed node index of WorkflowTemplate"""
+
+import json
+import os
+
+import pytest
+
+from comfyuiclient import ComfyUIClient, WorkflowTemplate
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+
+def linear_find(prompt, name):
+    """The lookup find_key_by_title used to do on every call"""
+    name = name.strip()
+    for key, value in prompt.items():
+        if value.get("class_type", "").strip() == name:
+            return key
+        if value.get("_meta", {}).get("title", "").strip() == name:
+            return key
+    return None
+
+
+def test_index_matches_linear_scan():
+    with open(WORKFLOW_API, encoding="utf8") as f:
+        prompt = json.load(f)
+    template = WorkflowTemplate(prompt)
+
+    names = {node["class_type"] for node in prompt.values()}
+    names |= {node["_meta"]["title"] for node in prompt.values()}
+    for name in names | {"  KSampler ", "Missing"}:
+        assert template.find(name) == linear_find(prompt, name)
+
+
+def test_duplicate_titles_resolve_to_first_node():
+    prompt = {
+        "1": {"class_type": "CLIPTextEncode", "_meta": {"title": "Prompt"}},
+        "2": {"class_type": "CLIPTextEncode", "_meta": {"title": "Prompt"}},
+        "3": {"class_type": "KSampler", "_meta": {"title": "CLIPTextEncode"}},
+    }
+    template = WorkflowTemplate(prompt)
+
+    assert template.find("Prompt") == "1"
+    assert template.duplicates == {
+        "Prompt": ["1", "2"],
+        "CLIPTextEncode": ["1", "2", "3"],
+    }
+    with pytest.raises(ValueError, match="1, 2"):
+        template.find("Prompt", strict=True)
+    assert template.find("KSampler", strict=True) == "3"
+
+
+def test_slots_render_without_touching_the_template():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+    template = client.template
+    seed = template.slot("KSampler", "seed")
+    steps = template.slot("3", "steps")
+    base_seed = client.comfyui_prompt["3"]["inputs"]["seed"]
+
+    prompt = template.render({seed: 7, steps: 2})
+    assert prompt["3"]["inputs"]["seed"] == 7
+    assert prompt["3"]["inputs"]["steps"] == 2
+    assert client.comfyui_prompt["3"]["inputs"]["seed"] == base_seed
+
+    # Slots also work as generate() overrides
+    assert client.prepare_prompt({seed: 8})["3"]["inputs"]["seed"] == 8
+    with pytest.raises(ValueError):
+        template.slot("Missing", "seed")
+
+
+def test_index_follows_the_prompt():
+    client = ComfyUIClient("localhost:8188", WORKFLOW_API)
+    index = client.template.index
+
+    client.set_data(key="KSampler", seed=1)
+    assert client.template.index is index
+
+    client.comfyui_prompt = {"9": {"class_type": "SaveImage", "inputs": {}}}
+    assert client.find_key_by_title("SaveImage") == "9"
+    assert client.find_key_by_title("KSampler") is None
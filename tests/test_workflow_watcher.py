@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Test hot reloading of workflow files"""
+
+import gc
+import json
+import os
+import shutil
+import time
+
+from comfyuiclient import (
+    ComfyUIClient,
+    ComfyUIClientAsync,
+    WorkflowCache,
+    WorkflowWatcher,
+)
+
+WORKFLOW_API = os.path.join(os.path.dirname(__file__), "..", "workflow_api.json")
+
+
+def write_seed(path, seed, broken=False):
+    with open(WORKFLOW_API, encoding="utf8") as f:
+        prompt = json.load(f)
+    prompt["3"]["inputs"]["seed"] = seed
+    partial = path + ".tmp"
+    with open(partial, "w", encoding="utf8") as f:
+        f.write("{ broken" if broken else json.dumps(prompt))
+    os.replace(partial, path)
+    # Make sure the change is visible even on coarse mtime filesystems
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def make_clients(tmp_path):
+    path = str(tmp_path / "workflow_api.json")
+    shutil.copy(WORKFLOW_API, path)
+    cache = WorkflowCache()
+    sync_client = ComfyUIClient("localhost:8188", path, workflow_cache=cache)
+    async_client = ComfyUIClientAsync("localhost:8188", path, workflow_cache=cache)
+    return path, sync_client, async_client
+
+
+def test_change_is_swapped_into_every_client(tmp_path):
+    path, sync_client, async_client = make_clients(tmp_path)
+    watcher = WorkflowWatcher()
+    watcher.watch(sync_client, async_client)
+    sync_client.set_data(key="KSampler", seed=1)
+    before = sync_client.template
+
+    watcher.check()
+    assert sync_client.template is before
+
+    write_seed(path, 777)
+    watcher.check()
+    assert sync_client.comfyui_prompt["3"]["inputs"]["seed"] == 777
+    assert async_client.comfyui_prompt["3"]["inputs"]["seed"] == 777
+    assert sync_client.template.index is async_client.template.index
+
+
+def test_broken_file_keeps_previous_workflow(tmp_path, capsys):
+    path, sync_client, _ = make_clients(tmp_path)
+    watcher = WorkflowWatcher()
+    watcher.watch(sync_client)
+    seed = sync_client.comfyui_prompt["3"]["inputs"]["seed"]
+
+    write_seed(path, 5, broken=True)
+    watcher.check()
+    assert sync_client.comfyui_prompt["3"]["inputs"]["seed"] == seed
+
+    write_seed(path, 5)
+    watcher.check()
+    assert sync_client.comfyui_prompt["3"]["inputs"]["seed"] == 5
+
+
+def test_background_thread_and_weak_references(tmp_path):
+    path, sync_client, async_client = make_clients(tmp_path)
+
+    with WorkflowWatcher(interval=0.01) as watcher:
+        watcher.watch(sync_client, async_client)
+        write_seed(path, 42)
+        deadline = time.monotonic() + 5
+        while sync_client.comfyui_prompt["3"]["inputs"]["seed"] != 42:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+        del async_client
+        gc.collect()
+        assert list(watcher._clients) == [sync_client]